@@ -0,0 +1,76 @@
+"""
+Benchmark build_graph on synthetic street grids of increasing size.
+
+Usage (from the web directory): python -m benchmarks.build_graph
+"""
+
+import gc
+import random
+import time
+
+from cython_lib.route import build_graph
+from models.element_id import ElementId
+from models.fetch_relation import FetchRelationElement
+
+GRID_SIZES = (10, 20, 40, 80, 160)
+REPEAT = 5
+STEP = 0.001  # degrees
+
+
+def make_grid_ways(size: int, *, seed: int = 0) -> dict[ElementId, FetchRelationElement]:
+    rnd = random.Random(seed)  # noqa: S311
+    points = {(i, j): (50 + i * STEP, 20 + j * STEP) for i in range(size) for j in range(size)}
+    edges = [((i, j), (i + di, j + dj)) for i, j in points for di, dj in ((1, 0), (0, 1)) if (i + di, j + dj) in points]
+
+    point_ways: dict[tuple[int, int], list[ElementId]] = {}
+
+    for way_id, (a, b) in enumerate(edges):
+        point_ways.setdefault(a, []).append(ElementId(way_id))
+        point_ways.setdefault(b, []).append(ElementId(way_id))
+
+    ways = {}
+
+    for way_id, (a, b) in enumerate(edges):
+        way_id = ElementId(way_id)
+
+        if rnd.random() < 0.5:
+            a, b = b, a
+
+        ways[way_id] = FetchRelationElement(
+            id=way_id,
+            member=True,
+            oneway=rnd.random() < 0.1,
+            roundabout=False,
+            nodes=[hash(a), hash(b)],
+            latLngs=[points[a], points[b]],
+            connectedTo=[other for p in (a, b) for other in point_ways[p] if other != way_id],
+        )
+
+    return ways
+
+
+def main() -> None:
+    print(f'{"ways":>8} {"time [ms]":>10} {"per way [µs]":>13}')
+
+    for size in GRID_SIZES:
+        ways = make_grid_ways(size)
+        best = float('inf')
+
+        # like timeit, measure without the cyclic garbage collector,
+        # whose passes over all live objects would hide the scaling of build_graph itself
+        gc.collect()
+        gc.disable()
+
+        try:
+            for _ in range(REPEAT):
+                start = time.perf_counter()
+                build_graph(ways)
+                best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+        print(f'{len(ways):>8} {best * 1000:>10.2f} {best / len(ways) * 1e6:>13.2f}')
+
+
+if __name__ == '__main__':
+    main()
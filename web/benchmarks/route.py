@@ -0,0 +1,208 @@
+"""
+Benchmark calc_bus_route on the recorded payloads, in the pure Python and the compiled build.
+
+Payloads are deflate-compressed calc_bus_route request bodies: the synthetic ones in benchmarks/fixtures
+(see benchmarks/synthetic.py), or real ones recorded with CALC_ROUTE_RECORD_DIR.
+Every payload runs in a fresh process, so the peak memory is its own.
+
+The results are compared against benchmarks/baseline.json and the exit code is non-zero on a regression:
+a worse route, or more time or iterations than the tolerance allows.
+Timings are machine-specific, re-create the baseline with --update-baseline after changing the machine.
+
+Usage (from the web directory): python -m benchmarks.route [--build pure|compiled] [--update-baseline] [paths...]
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+
+WEB_DIR = Path(__file__).parents[1]
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+BASELINE_PATH = Path(__file__).parent / 'baseline.json'
+BUILDS = ('pure', 'compiled')
+
+TIME_LIMIT = 60  # seconds
+TIME_NOISE = 0.05  # seconds, smaller slowdowns are never reported
+LENGTH_TOLERANCE = 0.01
+
+
+def _import_pure(name: str) -> None:
+    # import the module from its source, even if a compiled one is available
+    spec = importlib.util.spec_from_file_location(name, WEB_DIR / f'{name.replace(".", "/")}.py')
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+
+async def _run(body: bytes, n_processes: int, engine: str = 'dfs') -> dict:
+    from dacite import Config, from_dict
+
+    # calc_bus_route imports it lazily, in the app process it is already imported by main
+    import relation_builder  # noqa: F401
+    from compression import deflate_decompress
+    from cython_lib import route as route_module
+    from cython_lib.route import RouteStats, calc_bus_route
+    from models.element_id import ElementId
+    from models.fetch_relation import FetchRelationBusStopCollection, FetchRelationElement, PublicTransport
+
+    data = json.loads(deflate_decompress(body))
+    config = Config(cast=[ElementId, tuple, PublicTransport], strict=True)
+    ways = {way_id: from_dict(FetchRelationElement, way, config) for way_id, way in data['ways'].items()}
+    ways_members = {way_id: way for way_id, way in ways.items() if way.member}
+    bus_stops = [from_dict(FetchRelationBusStopCollection, c, config) for c in data['busStops']]
+    stats = RouteStats()
+
+    # fork, so that the workers use the same build as this process
+    with ProcessPoolExecutor(n_processes, mp_context=multiprocessing.get_context('fork')) as executor:
+        start = time.perf_counter()
+        route = await asyncio.wait_for(
+            calc_bus_route(
+                ways_members,
+                ElementId(data['startWay']),
+                ElementId(data['stopWay']),
+                bus_stops,
+                data['tags'],
+                executor,
+                n_processes,
+                engine,
+                stats=stats,
+            ),
+            TIME_LIMIT,
+        )
+        elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_memory = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+    return {
+        'compiled': not route_module.__file__.endswith('.py'),
+        'time': round(elapsed, 3),
+        'iterations': stats.iterations,
+        'peak_memory': round(peak_memory / 1024, 1),
+        'ways': len({way.way.id for way in route.ways}),
+        'bus_stops': len(route.busStops),
+        'length': round(sum(way.way.length for way in route.ways), 1),
+    }
+
+
+def _child(build: str, path: Path, n_processes: int) -> None:
+    sys.path.insert(0, str(WEB_DIR))
+
+    # every compiled module is replaced, the pure route module would use the compiled native search otherwise
+    if build == 'pure':
+        _import_pure('cython_lib.geoutils')
+        _import_pure('cython_lib.route_native')
+        _import_pure('cython_lib.route')
+
+    # the route calculation logs go to stderr, stdout is reserved for the result
+    with redirect_stdout(sys.stderr):
+        result = asyncio.run(_run(path.read_bytes(), n_processes))
+
+    print(json.dumps(result))
+
+
+def _measure(build: str, path: Path, n_processes: int, verbose: bool) -> dict | None:
+    process = subprocess.run(  # noqa: S603
+        [sys.executable, '-m', 'benchmarks.route', '--child', build, '--processes', str(n_processes), str(path)],
+        cwd=WEB_DIR,
+        stdout=subprocess.PIPE,
+        stderr=None if verbose else subprocess.PIPE,
+        text=True,
+        check=False,
+    )
+
+    if process.returncode != 0:
+        print(f'{build}/{path.name}: failed\n{process.stderr or ""}', file=sys.stderr)
+        return None
+
+    return json.loads(process.stdout.splitlines()[-1])
+
+
+def _regressions(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    problems = []
+
+    if result['bus_stops'] < baseline['bus_stops']:
+        problems.append(f'bus stops {baseline["bus_stops"]} -> {result["bus_stops"]}')
+    if result['ways'] < baseline['ways']:
+        problems.append(f'ways {baseline["ways"]} -> {result["ways"]}')
+    if result['length'] > baseline['length'] * (1 + LENGTH_TOLERANCE):
+        problems.append(f'length {baseline["length"]} -> {result["length"]}')
+    if result['iterations'] > baseline['iterations'] * (1 + tolerance):
+        problems.append(f'iterations {baseline["iterations"]} -> {result["iterations"]}')
+    if result['time'] > max(baseline['time'] * (1 + tolerance), baseline['time'] + TIME_NOISE):
+        problems.append(f'time {baseline["time"]}s -> {result["time"]}s')
+
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the bus route calculation')
+    parser.add_argument('paths', nargs='*', type=Path, help='payloads to run, all fixtures by default')
+    parser.add_argument('--build', choices=BUILDS, action='append', help='build to run, all by default')
+    parser.add_argument('--processes', type=int, default=1, help='number of search processes')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative time and iterations increase')
+    parser.add_argument('--update-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--verbose', action='store_true', help='show the route calculation logs')
+    parser.add_argument('--child', choices=BUILDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.paths[0], args.processes)
+        return
+
+    paths: list[Path] = args.paths or sorted(FIXTURES_DIR.glob('*.json.deflate'))
+    baseline: dict[str, dict[str, dict]] = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.is_file() else {}
+    failed = False
+
+    print(
+        f'{"build":<9} {"payload":<32} {"time [s]":>9} {"iterations":>11} '
+        f'{"memory [MiB]":>13} {"ways":>5} {"stops":>6} {"length [m]":>11}'
+    )
+
+    for build in args.build or BUILDS:
+        for path in paths:
+            name = path.name.removesuffix('.json.deflate')
+            result = _measure(build, path, args.processes, args.verbose)
+
+            if result is None:
+                failed = True
+                continue
+
+            if build == 'compiled' and not result.pop('compiled'):
+                print(f'{build:<9} {name:<32} skipped, the compiled build is not available')
+                break
+
+            result.pop('compiled', None)
+            print(
+                f'{build:<9} {name:<32} {result["time"]:>9.3f} {result["iterations"]:>11} '
+                f'{result["peak_memory"]:>13.1f} {result["ways"]:>5} {result["bus_stops"]:>6} {result["length"]:>11.1f}'
+            )
+
+            if args.update_baseline:
+                baseline.setdefault(build, {})[name] = result
+            elif (expected := baseline.get(build, {}).get(name)) is not None:
+                for problem in _regressions(result, expected, args.tolerance):
+                    print(f'  regression: {problem}')
+                    failed = True
+
+    if args.update_baseline:
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        print(f'Baseline saved to {BASELINE_PATH.relative_to(WEB_DIR)}')
+    elif failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Generate the synthetic calc_bus_route payloads of the routing benchmark.
+
+Real payloads are recorded by setting CALC_ROUTE_RECORD_DIR, the synthetic ones cover
+the pathological shapes (roundabouts, loops, roundtrips) deterministically.
+
+Usage (from the web directory): python -m benchmarks.synthetic
+"""
+
+import math
+import random
+from collections.abc import Callable, Hashable
+from pathlib import Path
+
+from msgspec.json import Encoder
+
+from compression import deflate_compress
+from models.element_id import ElementId
+from models.fetch_relation import (
+    FetchRelationBusStop,
+    FetchRelationBusStopCollection,
+    FetchRelationElement,
+    PublicTransport,
+)
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+STEP = 0.002  # degrees
+
+_json_encode = Encoder().encode
+
+
+def _network(
+    points: dict[Hashable, tuple[float, float]],
+    edges: list[tuple[Hashable, Hashable]],
+    rnd: random.Random,
+    *,
+    oneway_p: float = 0.0,
+    roundabout: frozenset[tuple[Hashable, Hashable]] = frozenset(),
+) -> dict[ElementId, FetchRelationElement]:
+    node_ids = {p: i for i, p in enumerate(points, 1)}
+    point_ways: dict[Hashable, list[ElementId]] = {}
+
+    for way_id, (a, b) in enumerate(edges, 1000):
+        point_ways.setdefault(a, []).append(ElementId(way_id))
+        point_ways.setdefault(b, []).append(ElementId(way_id))
+
+    ways = {}
+
+    for way_id, (a, b) in enumerate(edges, 1000):
+        way_id = ElementId(way_id)
+        is_roundabout = (a, b) in roundabout
+
+        # roundabout ways keep their direction
+        if not is_roundabout and rnd.random() < 0.5:
+            a, b = b, a
+
+        (lat1, lon1), (lat2, lon2) = points[a], points[b]
+        mid = ((lat1 + lat2) / 2 + rnd.uniform(-1, 1) * STEP * 0.05, (lon1 + lon2) / 2)
+
+        ways[way_id] = FetchRelationElement(
+            id=way_id,
+            member=True,
+            oneway=is_roundabout or rnd.random() < oneway_p,
+            roundabout=is_roundabout,
+            nodes=[node_ids[a], 100_000 + int(way_id), node_ids[b]],
+            latLngs=[points[a], mid, points[b]],
+            connectedTo=sorted({other for p in (a, b) for other in point_ways[p] if other != way_id}),
+        )
+
+    return ways
+
+
+def _bus_stops(
+    ways: dict[ElementId, FetchRelationElement],
+    rnd: random.Random,
+    probability: float,
+) -> list[FetchRelationBusStopCollection]:
+    result = []
+
+    for way in ways.values():
+        if way.roundabout or rnd.random() >= probability:
+            continue
+
+        stop_id = ElementId(len(result) + 1)
+        lat, lon = way.latLngs[1]
+        offset = rnd.choice((-1, 1)) * STEP * 0.05
+        platform = FetchRelationBusStop(
+            id=stop_id,
+            type='node',
+            member=True,
+            latLng=(lat + offset, lon + offset),
+            tags={'highway': 'bus_stop', 'public_transport': 'platform', 'name': f'Stop {stop_id}'},
+            name=f'Stop {stop_id}',
+            groupName=f'stop {stop_id}',
+            highway='bus_stop',
+            public_transport=PublicTransport.PLATFORM,
+        )
+        result.append(FetchRelationBusStopCollection(platform=platform, stop=None))
+
+    return result
+
+
+def _payload(
+    relation_id: int,
+    ways: dict[ElementId, FetchRelationElement],
+    start_way: ElementId,
+    stop_way: ElementId,
+    bus_stops: list[FetchRelationBusStopCollection],
+    tags: dict[str, str],
+) -> dict:
+    return {
+        'relationId': relation_id,
+        'startWay': start_way,
+        'stopWay': stop_way,
+        'ways': ways,
+        'busStops': bus_stops,
+        'tags': {'type': 'route', 'route': 'bus', **tags},
+    }
+
+
+def _grid_points(nx: int, ny: int, rnd: random.Random) -> dict[Hashable, tuple[float, float]]:
+    return {
+        (i, j): (50 + j * STEP + rnd.uniform(-1, 1) * STEP * 0.05, 20 + i * STEP + rnd.uniform(-1, 1) * STEP * 0.05)
+        for i in range(nx)
+        for j in range(ny)
+    }
+
+
+def _grid_edges(points: dict[Hashable, tuple[float, float]]) -> list[tuple[Hashable, Hashable]]:
+    return [((i, j), (i + di, j + dj)) for i, j in points for di, dj in ((1, 0), (0, 1)) if (i + di, j + dj) in points]
+
+
+def grid(nx: int, ny: int, *, seed: int) -> dict:
+    rnd = random.Random(seed)  # noqa: S311
+    points = _grid_points(nx, ny, rnd)
+    ways = _network(points, _grid_edges(points), rnd, oneway_p=0.1)
+    way_ids = tuple(ways)
+    return _payload(seed, ways, way_ids[0], way_ids[-1], _bus_stops(ways, rnd, 0.3), {})
+
+
+def roundabout(*, seed: int) -> dict:
+    """
+    3x3 grid with a roundabout in place of the central intersection.
+    """
+
+    rnd = random.Random(seed)  # noqa: S311
+    points = _grid_points(3, 3, rnd)
+    grid_edges = _grid_edges(points)
+    center_lat, center_lon = points.pop((1, 1))
+    directions = ((1, 0), (0, 1), (-1, 0), (0, -1))
+    radius = STEP * 0.2
+
+    for di, dj in directions:
+        points['ring', di, dj] = (center_lat + dj * radius, center_lon + di * radius)
+
+    def ring_point(p: Hashable, other: Hashable) -> Hashable:
+        return ('ring', other[0] - 1, other[1] - 1) if p == (1, 1) else p
+
+    edges = [(ring_point(a, b), ring_point(b, a)) for a, b in grid_edges]
+    ring = [(('ring', *directions[k]), ('ring', *directions[(k + 1) % 4])) for k in range(4)]
+
+    ways = _network(points, edges + ring, rnd, oneway_p=0.1, roundabout=frozenset(ring))
+    way_ids = tuple(ways)
+    return _payload(seed, ways, way_ids[0], way_ids[len(edges) - 1], _bus_stops(ways, rnd, 0.3), {})
+
+
+def roundtrip(n: int, *, seed: int) -> dict:
+    """
+    Ring road with spokes to the center, the route starts and ends at the same point of the ring.
+    """
+
+    rnd = random.Random(seed)  # noqa: S311
+    points: dict[Hashable, tuple[float, float]] = {'center': (50, 20)}
+
+    for k in range(n):
+        angle = 2 * math.pi * k / n
+        points[k] = (50 + math.sin(angle) * STEP * 2, 20 + math.cos(angle) * STEP * 2)
+
+    ring = [(k, (k + 1) % n) for k in range(n)]
+    spokes = [(k, 'center') for k in range(0, n, 2)]
+
+    ways = _network(points, ring + spokes, rnd)
+    way_ids = tuple(ways)
+    return _payload(seed, ways, way_ids[0], way_ids[n - 1], _bus_stops(ways, rnd, 0.4), {'roundtrip': 'yes'})
+
+
+def loops(n: int, *, seed: int) -> dict:
+    """
+    Main street with dead-end branches, each ending in a small loop.
+
+    Serving the bus stops along the branches requires driving them there and back.
+    """
+
+    rnd = random.Random(seed)  # noqa: S311
+    points: dict[Hashable, tuple[float, float]] = {}
+
+    for k in range(n + 1):
+        points['main', k] = (50, 20 + k * STEP)
+
+    edges = [(('main', k), ('main', k + 1)) for k in range(n)]
+
+    for k in range(1, n, 2):
+        lat, lon = points['main', k]
+        points['branch', k] = (lat + STEP, lon)
+        points['loop', k, 0] = (lat + STEP * 1.5, lon - STEP * 0.5)
+        points['loop', k, 1] = (lat + STEP * 2, lon)
+        points['loop', k, 2] = (lat + STEP * 1.5, lon + STEP * 0.5)
+        edges.append((('main', k), ('branch', k)))
+        edges.append((('branch', k), ('loop', k, 0)))
+        edges.append((('loop', k, 0), ('loop', k, 1)))
+        edges.append((('loop', k, 1), ('loop', k, 2)))
+        edges.append((('loop', k, 2), ('branch', k)))
+
+    ways = _network(points, edges, rnd)
+    return _payload(seed, ways, ElementId(1000), ElementId(1000 + n - 1), _bus_stops(ways, rnd, 0.5), {})
+
+
+CASES: dict[str, Callable[[], dict]] = {
+    'small-grid': lambda: grid(2, 3, seed=0),
+    'medium-grid': lambda: grid(3, 3, seed=1),
+    'roundabout': lambda: roundabout(seed=2),
+    'roundtrip': lambda: roundtrip(8, seed=3),
+    'loops': lambda: loops(6, seed=4),
+}
+
+
+def main() -> None:
+    FIXTURES_DIR.mkdir(exist_ok=True)
+
+    for name, make_payload in CASES.items():
+        path = FIXTURES_DIR / f'{name}.json.deflate'
+        payload = make_payload()
+        path.write_bytes(deflate_compress(_json_encode(payload)))
+        print(f'{path.name}: {len(payload["ways"])} ways, {len(payload["busStops"])} bus stops')
+
+
+if __name__ == '__main__':
+    main()
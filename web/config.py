@@ -19,6 +19,37 @@ USER_AGENT = f'osm-relatify/{VERSION} (+https://github.com/Zaczero/osm-relatify)
 # https://wiki.openstreetmap.org/wiki/Overpass_API#Public_Overpass_API_instances
 OVERPASS_API_INTERPRETER = os.getenv('OVERPASS_API_INTERPRETER', 'https://overpass.monicz.dev/api/interpreter')
 
+# comma-separated, queries are hedged and failed over across them in the order of their health
+OVERPASS_API_INTERPRETERS = tuple(
+    url.strip() for url in os.getenv('OVERPASS_API_INTERPRETERS', OVERPASS_API_INTERPRETER).split(',') if url.strip()
+)
+
+# a hedged request is sent after the p95 latency of the endpoint, or after the fixed delay until it is known
+OVERPASS_HEDGE_DELAY = 10  # seconds
+OVERPASS_HEDGE_MIN_SAMPLES = 20
+
+# endpoints responding with 429 or 504 are backed off exponentially
+OVERPASS_BACKOFF_MIN = 5  # seconds
+OVERPASS_BACKOFF_MAX = 300  # seconds
+
+# downloaded grid cells are cached on disk and shared by all users, reloading the relation refreshes them
+OVERPASS_CACHE_PATH = os.getenv('OVERPASS_CACHE_PATH', 'data/overpass_cache.db')
+OVERPASS_CACHE_TTL = 7200  # seconds
+
+# missing cells are downloaded in groups of this many cells, with at most this many queries running at once,
+# a failed group is retried alone
+OVERPASS_QUERY_GROUP_SIZE = int(os.getenv('OVERPASS_QUERY_GROUP_SIZE', '16'))
+OVERPASS_QUERY_CONCURRENCY = int(os.getenv('OVERPASS_QUERY_CONCURRENCY', '4'))
+OVERPASS_QUERY_RETRIES = 2
+
+# answer the Overpass and OSM API reads from a local extract instead, imported with: python -m osm_extract
+OSM_EXTRACT_PATH = os.getenv('OSM_EXTRACT_PATH', None)
+
+# http clients are shared by the whole application, one per upstream
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '20'))  # per upstream
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', '10'))  # per upstream
+HTTP_KEEPALIVE_EXPIRY = 60  # seconds
+
 TAG_MAX_LENGTH = 255
 
 OSM_CLIENT = os.getenv('OSM_CLIENT', None)
@@ -37,6 +68,46 @@ CALC_ROUTE_MAX_REQUESTS = 3
 CALC_ROUTE_N_PROCESSES = max(1, CPU_COUNT // 4)
 CALC_ROUTE_MAX_PROCESSES = CALC_ROUTE_N_PROCESSES * CALC_ROUTE_MAX_REQUESTS
 
+# route workers are recycled after this many tasks, and all of them once a worker grows above the memory limit
+CALC_ROUTE_WORKER_MAX_TASKS = int(os.getenv('CALC_ROUTE_WORKER_MAX_TASKS', '500'))
+CALC_ROUTE_WORKER_MAX_RSS = int(os.getenv('CALC_ROUTE_WORKER_MAX_RSS', '1024')) * 1024 * 1024  # MiB
+
+# dfs: exhaustive parallel depth-first search
+# best_first: best-first search with admissible bounds, limited by a fixed cpu budget
+# bidirectional: joins paths searched from both ends, for long routes with few branches (falls back to dfs)
+# segmented: routes from bus stop to bus stop, for routes with many bus stops (falls back to dfs)
+CALC_ROUTE_ENGINE = os.getenv('CALC_ROUTE_ENGINE', 'dfs')
+
+assert CALC_ROUTE_ENGINE in {'dfs', 'best_first', 'bidirectional', 'segmented'}, (
+    f'Unsupported CALC_ROUTE_ENGINE: {CALC_ROUTE_ENGINE}'
+)
+
+CALC_ROUTE_TIMEOUT = 3  # seconds
+
+# calculations beyond CALC_ROUTE_MAX_REQUESTS wait in per-user fair queues, at most this long
+CALC_ROUTE_QUEUE_TIMEOUT = 30  # seconds
+
+# search on native threads instead of the process pool, when the compiled build is available
+CALC_ROUTE_NATIVE = os.getenv('CALC_ROUTE_NATIVE', '1') == '1'
+
+# repair the previous route of the connection after small edits, instead of searching from scratch
+CALC_ROUTE_REROUTE = os.getenv('CALC_ROUTE_REROUTE', '1') == '1'
+
+# calculated routes of identical requests are reused
+CALC_ROUTE_CACHE_SIZE = 256
+CALC_ROUTE_CACHE_TTL = 3600  # seconds
+
+# maximum number of search states remembered by each worker for dominance pruning
+CALC_ROUTE_TRANSPOSITION_TABLE_SIZE = int(os.getenv('CALC_ROUTE_TRANSPOSITION_TABLE_SIZE', '200000'))
+
+# anytime mode: stream the best route found so far and return the best one at the deadline,
+# instead of failing the request after CALC_ROUTE_TIMEOUT
+CALC_ROUTE_ANYTIME = os.getenv('CALC_ROUTE_ANYTIME', '0') == '1'
+CALC_ROUTE_ANYTIME_TIMEOUT = float(os.getenv('CALC_ROUTE_ANYTIME_TIMEOUT', '10'))  # seconds
+
+# record the received calc_bus_route payloads into this directory, for replaying them in benchmarks
+CALC_ROUTE_RECORD_DIR = os.getenv('CALC_ROUTE_RECORD_DIR', None)
+
 CHANGESET_ID_PLACEHOLDER = f'__CHANGESET_ID_PLACEHOLDER__{secrets.token_urlsafe(8)}__'
 
 DOWNLOAD_RELATION_WAY_BB_EXPAND = 250  # meters
@@ -1,20 +1,31 @@
 import asyncio
-from collections.abc import Sequence
+import pickle
+import sys
+import time
+from array import array
+from collections.abc import Awaitable, Callable, Generator, Sequence
 from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from dataclasses import replace
 from functools import partial
-from itertools import chain
-from typing import NamedTuple, Self
+from heapq import heapify, heappop, heappush
+from itertools import chain, count
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING, NamedTuple, Self
 
 import cython
 
+from config import CALC_ROUTE_NATIVE, CALC_ROUTE_TIMEOUT, CALC_ROUTE_TRANSPOSITION_TABLE_SIZE
 from cython_lib.geoutils import haversine_distance
+from cython_lib.route_native import NATIVE_AVAILABLE, NativeGraph, NativeStarts, native_dfs
 from models.element_id import ElementId
 from models.fetch_relation import FetchRelationBusStopCollection, FetchRelationElement
 from models.final_route import FinalRoute, FinalRouteWay
-from relation_builder import SortedBusEntry, sort_bus_on_path
 from utils import print_run_time
 
+if TYPE_CHECKING:
+    from relation_builder import SortedBusEntry
+
 if cython.compiled:
     from cython.cimports.libc.math import acos, pi
 
@@ -33,12 +44,34 @@ def _degrees(x: cython.double) -> cython.double:
 BOOL_START = True
 BOOL_END = False
 
+FLAG_ROUNDABOUT = 1
+FLAG_ONEWAY = 2
+
 VISITED_LIMIT = 2
 MAX_LOOP_LENGTH = 1000
 MAX_AFTER_FINISH_LENGTH = 1000
 MAX_EXTRA_DISTANCE_TO_CONVERT = 1000
 MAX_PATH_LENGTH_FACTOR = 2.2
 
+BEST_FIRST_CPU_BUDGET = 2.5  # seconds
+BIDIRECTIONAL_LENGTH_FACTOR = 2.2  # longest joined path, relative to the total length (detours included)
+BIDIRECTIONAL_MAX_STATES = 20000  # per direction
+BIDIRECTIONAL_MAX_JOINS = 200000
+SEGMENTED_MAX_ITER = 20000  # per segment
+SEGMENTED_FALLBACK_TIME_LIMIT = CALC_ROUTE_TIMEOUT / 2  # seconds, global search after incomplete segments
+BOARD_SYNC_INTERVAL = 256  # iterations
+PROGRESS_INTERVAL = 0.5  # seconds
+
+ROUTE_CONTEXT_CACHE_SIZE = 4
+REROUTE_MAX_CHANGED_WAYS = 4
+REROUTE_BACKTRACK_WAYS = 3  # ways before the first change that are searched again
+REROUTE_MAX_ITER = 5000
+REROUTE_LENGTH_TOLERANCE = 0.05  # longer repaired routes than the previous one (plus the changed ways) are rejected
+
+PATH_CHUNK_SIZE = 16
+SNAPSHOT_BITS = 4
+SNAPSHOT_BRANCHING = 1 << SNAPSHOT_BITS
+
 
 class GraphKey(NamedTuple):
     way_id: ElementId
@@ -50,39 +83,87 @@ class GraphValue(NamedTuple):
     connected_to: tuple[GraphKey, ...]
 
 
+class CompiledGraph(NamedTuple):
+    # id translation, only used at the boundaries
+    way_ids: tuple[ElementId, ...]
+    way_index: dict[ElementId, int]
+
+    # per way (indexed by way index)
+    way_length: array  # double
+    way_flags: array  # unsigned char
+    way_bits: tuple[int, ...]
+
+    # per bus stop (indexed by bus stop index), only used at the boundaries
+    bus_stop_ids: tuple[ElementId, ...]
+
+    # per node (indexed by way index << 1 | is end)
+    node_intersection: array  # int
+    node_bus_stops: tuple[tuple[int, int], ...]  # bitsets of visited and almost visited bus stops
+    node_bus_stop_order: tuple[tuple[tuple[int, ...], tuple[int, ...]], ...]  # the same, in order along the way
+
+    # csr adjacency (indexed by the exit node)
+    offsets: array  # int
+    targets: array  # int
+    edge_length: array  # double
+    edge_flags: array  # unsigned char
+    edge_angle: array  # double, difference from the straight path
+
+    # reverse csr adjacency (indexed by the entry node), for searching backwards
+    reverse_offsets: array  # int
+    reverse_edges: array  # int, forward edge indexes
+    reverse_sources: array  # int, exit nodes of the forward edges
+
+    snapshot_depth: int
+
+
+class PathNode(NamedTuple):
+    # persistent path: full chunks are shared between all the paths branching off them
+    parent: 'PathNode | None'
+    keys: tuple[int, ...]
+    size: int
+
+
+# persistent map of intersection id -> (bus stops count, visit count),
+# stored as a radix trie of SNAPSHOT_BRANCHING-sized tuples
+Snapshot = tuple | None
+
+
 class StackElement(NamedTuple):
-    path: tuple[GraphKey, ...]
-    visited_bus_stops: dict[ElementId, int]
-    almost_visited_bus_stops: dict[ElementId, int]
-    intersection_bus_stops_snapshot: dict[int, tuple[GraphKey, int]]
+    path: PathNode
+    visited_bus_stops: int  # bitset of bus stop indexes
+    almost_visited_bus_stops: int  # bitset of bus stop indexes, excluding the visited ones
+    intersection_bus_stops_snapshot: Snapshot
     length: float
-    complete_path: set[ElementId]
+    complete_path: int  # bitset of way indexes
     complete_length: float
     angle_sum: float = 0
     loop_length: float = 0
     after_finish_length: float = 0
-    roundabout_enter: GraphKey | None = None
+    roundabout_enter: int = -1
+    snapshot_hash: int = 0  # incrementally updated hash of the snapshot entries
 
 
 class BestPath(NamedTuple):
-    path: tuple[GraphKey, ...]
-    visited_bus_stops: dict[ElementId, int]
+    path: PathNode | None
+    visited_bus_stops: int
+    almost_visited_bus_stops: int
     bus_stops_count: int
     almost_bus_stops_count: int
     length: float
-    complete_path: set[ElementId]
+    complete_path: int
     complete_length: float
     angle_sum: float
 
     @classmethod
     def zero(cls) -> Self:
         return cls(
-            path=(),
-            visited_bus_stops={},
+            path=None,
+            visited_bus_stops=0,
+            almost_visited_bus_stops=0,
             bus_stops_count=0,
             almost_bus_stops_count=0,
             length=0,
-            complete_path=set(),
+            complete_path=0,
             complete_length=0,
             angle_sum=0,
         )
@@ -142,13 +223,278 @@ class BestPath(NamedTuple):
 class BestPathCollection(NamedTuple):
     invalid: BestPath
     valid: BestPath
+    iterations: int = 0  # search iterations that went into the paths
 
-    def merge(self, other: Self, ways: dict[ElementId, FetchRelationElement]) -> Self:
+    def merge(self, other: Self) -> Self:
         return BestPathCollection(
             invalid=self.invalid.select_best(other.invalid),
             valid=self.valid.select_best(other.valid),
+            iterations=self.iterations + other.iterations,
         )
 
+    def best(self) -> BestPath:
+        return self.valid if self.valid.path is not None else self.invalid
+
+
+def path_append(path: PathNode | None, key: int) -> PathNode:
+    if path is None:
+        return PathNode(None, (key,), 1)
+
+    # copy the (bounded) tail chunk, or start a new one
+    if len(path.keys) < PATH_CHUNK_SIZE:
+        return PathNode(path.parent, (*path.keys, key), path.size + 1)
+    else:
+        return PathNode(path, (key,), path.size + 1)
+
+
+def path_to_tuple(path: PathNode | None) -> tuple[int, ...]:
+    chunks = []
+
+    while path is not None:
+        chunks.append(path.keys)
+        path = path.parent
+
+    return tuple(chain.from_iterable(reversed(chunks)))
+
+
+def _snapshot_depth(size: cython.int) -> cython.int:
+    depth: cython.int = 1
+
+    while SNAPSHOT_BRANCHING**depth < size:
+        depth += 1
+
+    return depth
+
+
+def _snapshot_get(snapshot: Snapshot, depth: cython.int, key: cython.int) -> tuple[int, int] | None:
+    shift: cython.int = (depth - 1) * SNAPSHOT_BITS
+
+    while shift >= 0:
+        if snapshot is None:
+            return None
+
+        snapshot = snapshot[(key >> shift) & (SNAPSHOT_BRANCHING - 1)]
+        shift -= SNAPSHOT_BITS
+
+    return snapshot
+
+
+def _snapshot_set(snapshot: Snapshot, depth: cython.int, key: cython.int, value: tuple[int, int]) -> tuple:
+    # path copying: only the nodes on the way to the key are copied
+    if depth == 0:
+        return value
+
+    shift: cython.int = (depth - 1) * SNAPSHOT_BITS
+    index: cython.int = (key >> shift) & (SNAPSHOT_BRANCHING - 1)
+    node = list(snapshot) if snapshot is not None else [None] * SNAPSHOT_BRANCHING
+    node[index] = _snapshot_set(node[index], depth - 1, key, value)
+    return tuple(node)
+
+
+def _snapshot_entry_hash(key: cython.int, value: tuple[int, int] | None) -> int:
+    return hash((key, *value)) if value is not None else 0
+
+
+# receives the best path found so far, in anytime mode
+ProgressCallback = Callable[['BestPath'], Awaitable[None]]
+
+
+class RouteSeed(NamedTuple):
+    # path of the previous route, mapped onto the current graph
+    nodes: tuple[int, ...]
+    # leading nodes that are kept
+    prefix_size: int
+    # leading nodes that detours may not rejoin, they precede the changes
+    rejoin_size: int
+    # the repaired route must be as good as the previous one, adjusted for the changes (see _is_acceptable_reroute)
+    min_complete_length: float
+    min_bus_stops: int
+    max_length: float
+
+
+class PreviousRoute(NamedTuple):
+    ways_members: dict[ElementId, FetchRelationElement]
+    start_way: ElementId
+    end_way: ElementId
+    bus_stop_collections: Sequence[FetchRelationBusStopCollection]
+    tags: dict[str, str]
+    engine: str
+    route: FinalRoute
+
+
+class RouteStats:
+    """
+    Statistics of a single route calculation, filled in by calc_bus_route.
+    """
+
+    __slots__ = ('deadline_reached', 'iterations', 'rerouted')
+
+    def __init__(self):
+        self.iterations = 0
+        self.rerouted = False
+        self.deadline_reached = False  # the search was stopped early, the route may not be the best one
+
+
+class RouteContext(NamedTuple):
+    graph: CompiledGraph
+    end_way: int
+    max_length: float
+    total_length: float
+
+
+class RouteContextHandle(NamedTuple):
+    name: str
+    size: int
+
+
+# worker-resident copies of the shared route contexts, most recent last
+_route_context_cache: dict[str, RouteContext] = {}
+
+
+def _make_route_context(graph: CompiledGraph, end_way: int) -> RouteContext:
+    total_length = sum(graph.way_length)
+
+    return RouteContext(
+        graph=graph,
+        end_way=end_way,
+        max_length=MAX_PATH_LENGTH_FACTOR * total_length,
+        total_length=total_length,
+    )
+
+
+def _is_complete_path(best_path: BestPath, context: RouteContext) -> bool:
+    """
+    Check whether the path covers every member way and visits every bus stop directly.
+    """
+
+    return (
+        best_path.path is not None
+        and best_path.complete_length >= context.total_length - 0.1
+        and best_path.bus_stops_count >= len(context.graph.bus_stop_ids)
+    )
+
+
+def _incumbent_max_length(best_path: BestPath, context: RouteContext) -> float | None:
+    """
+    Get the length no better path can exceed, if the path bounds it.
+
+    A complete path can only be beaten by a path that is complete and not longer (see BestPath.select_best).
+    """
+
+    if not _is_complete_path(best_path, context):
+        return None
+
+    return best_path.length + 0.1
+
+
+@contextmanager
+def share_route_context(context: RouteContext) -> Generator[RouteContextHandle, None, None]:
+    data = pickle.dumps(context, protocol=pickle.HIGHEST_PROTOCOL)
+    shm = SharedMemory(create=True, size=len(data))
+
+    try:
+        shm.buf[: len(data)] = data
+        yield RouteContextHandle(shm.name, len(data))
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _load_route_context(handle: RouteContextHandle) -> RouteContext:
+    context = _route_context_cache.pop(handle.name, None)
+
+    if context is None:
+        shm = SharedMemory(handle.name)
+
+        try:
+            with shm.buf[: handle.size] as data:
+                context = pickle.loads(data)  # noqa: S301
+        finally:
+            shm.close()
+
+        # evict the least recently used contexts (their requests have most likely ended)
+        while len(_route_context_cache) >= ROUTE_CONTEXT_CACHE_SIZE:
+            del _route_context_cache[next(iter(_route_context_cache))]
+
+    _route_context_cache[handle.name] = context
+    return context
+
+
+class SearchBoardHandle(NamedTuple):
+    name: str
+    n_slots: int
+
+
+class SearchBoard:
+    """
+    Shared memory board of the parallel search.
+
+    It holds the complete length of the best valid path found by any worker (the incumbent),
+    and a flag per worker slot, set when the worker should return its stack for redistribution.
+    The incumbent is updated without a lock: a lost update only weakens pruning,
+    as every published value belongs to a path that was actually found.
+    """
+
+    __slots__ = ('_incumbent', '_shm', '_yield_flags')
+
+    def __init__(self, shm: SharedMemory, n_slots: int):
+        self._shm = shm
+        self._incumbent = shm.buf[:8].cast('d')
+        self._yield_flags = shm.buf[8 : 8 + n_slots]
+
+    def reset(self) -> None:
+        self._incumbent[0] = -1
+        self._yield_flags[:] = bytes(len(self._yield_flags))
+
+    def close(self) -> None:
+        self._incumbent.release()
+        self._yield_flags.release()
+        self._shm.close()
+
+    @property
+    def incumbent(self) -> float:
+        return self._incumbent[0]
+
+    def publish(self, best_path: BestPath) -> float:
+        incumbent = self._incumbent[0]
+
+        if best_path.path is not None and best_path.complete_length > incumbent:
+            self._incumbent[0] = incumbent = best_path.complete_length
+
+        return incumbent
+
+    def request_yield(self, slot: int) -> None:
+        self._yield_flags[slot] = 1
+
+    def clear_yield(self, slot: int) -> None:
+        self._yield_flags[slot] = 0
+
+    def yield_requested(self, slot: int) -> bool:
+        return self._yield_flags[slot] != 0
+
+
+@contextmanager
+def share_search_board(n_slots: int) -> Generator[tuple[SearchBoardHandle, SearchBoard], None, None]:
+    shm = SharedMemory(create=True, size=8 + n_slots)
+    board = SearchBoard(shm, n_slots)
+
+    try:
+        board.reset()
+        yield SearchBoardHandle(shm.name, n_slots), board
+    finally:
+        board.close()
+        shm.unlink()
+
+
+@contextmanager
+def _attach_search_board(handle: SearchBoardHandle) -> Generator[SearchBoard, None, None]:
+    board = SearchBoard(SharedMemory(handle.name), handle.n_slots)
+
+    try:
+        yield board
+    finally:
+        board.close()
+
 
 def get_way_endpoints(
     latlons: Sequence[tuple[cython.double, cython.double]],
@@ -157,55 +503,43 @@ def get_way_endpoints(
 
 
 def build_graph(ways: dict[ElementId, FetchRelationElement]) -> dict[GraphKey, GraphValue]:
-    graph: dict[GraphKey, list[GraphKey] | GraphValue] = {}
+    # index of way endpoints by location, every location is an intersection
+    endpoint_index: dict[tuple[float, float], list[GraphKey]] = {}
 
     for way_id, way in ways.items():
         start, end = get_way_endpoints(way.latLngs)
-        start_key, stop_key = (way_id, BOOL_START), (way_id, BOOL_END)
+        endpoint_index.setdefault(start, []).append(GraphKey(way_id, BOOL_START))
+        endpoint_index.setdefault(end, []).append(GraphKey(way_id, BOOL_END))
 
-        def get_neighbors_at(latlon: tuple[cython.double, cython.double]) -> list[GraphKey]:
-            neighbors = []
-
-            for connected_way_id in way.connectedTo:  # noqa: B023
-                connected_way = ways.get(connected_way_id)
-
-                # skip non-member ways
-                if not connected_way:
-                    continue
+    intersection_ids = {latlon: intersection_id for intersection_id, latlon in enumerate(endpoint_index)}
+    graph: dict[GraphKey, GraphValue] = {}
 
-                connected_start, connected_end = get_way_endpoints(connected_way.latLngs)
+    for way_id, way in ways.items():
+        # neighbors are listed in the connectedTo order
+        connected_order = {connected_way_id: i for i, connected_way_id in enumerate(way.connectedTo)}
+
+        for key, latlon in zip(
+            (GraphKey(way_id, BOOL_START), GraphKey(way_id, BOOL_END)),
+            get_way_endpoints(way.latLngs),
+            strict=True,
+        ):
+            neighbors = []
 
-                if latlon == connected_start:
-                    neighbors.append(GraphKey(connected_way_id, BOOL_START))
-                elif latlon == connected_end and not connected_way.oneway:
-                    neighbors.append(GraphKey(connected_way_id, BOOL_END))
-                else:
-                    # connected via other endpoint
+            for neighbor in endpoint_index[latlon]:
+                if neighbor.way_id not in connected_order:
                     continue
 
-            return neighbors
-
-        graph[start_key] = get_neighbors_at(start)
-        graph[stop_key] = get_neighbors_at(end)
+                if not neighbor.is_start:
+                    neighbor_way = ways[neighbor.way_id]
 
-    convert_keys = set(graph.keys())
-    intersection_num: cython.int = -1
+                    # oneway ways are entered only at their start, closed ways only once (at their start)
+                    if neighbor_way.oneway or neighbor_way.latLngs[0] == latlon:
+                        continue
 
-    while convert_keys:
-        intersection_num += 1
+                neighbors.append(neighbor)
 
-        key = convert_keys.pop()
-        neighbors = graph[key]
-        graph[key] = GraphValue(intersection_num, tuple(neighbors))
-
-        for neighbor in neighbors:
-            if neighbor in convert_keys:
-                # normal convert
-                convert_keys.remove(neighbor)
-                graph[neighbor] = GraphValue(intersection_num, tuple(graph[neighbor]))
-            else:
-                # merge convert (happens due to oneway)
-                graph[neighbor] = graph[neighbor]._replace(intersection_id=intersection_num)
+            neighbors.sort(key=lambda neighbor: connected_order[neighbor.way_id])
+            graph[key] = GraphValue(intersection_ids[latlon], tuple(neighbors))
 
     return graph
 
@@ -260,41 +594,21 @@ def angle_between_ways(
     return angle
 
 
-def select_neighbors(
-    way: FetchRelationElement,
-    neighbors: Sequence[GraphKey],
-    ways: dict[ElementId, FetchRelationElement],
-) -> Sequence[tuple[GraphKey, cython.double]]:
-    if not neighbors:
-        return ()
-    elif len(neighbors) == 1:
-        return ((neighbors[0], 0),)
-
-    angles = (
-        (
-            angle_between_ways(way.latLngs, ways[neighbor.way_id].latLngs),
-            neighbor,
-        )
-        for neighbor in neighbors
-    )
+def _neighbor_angle(
+    latlons1: Sequence[tuple[cython.double, cython.double]],
+    latlons2: Sequence[tuple[cython.double, cython.double]],
+) -> cython.double:
+    angle: cython.double = angle_between_ways(latlons1, latlons2)
 
     # the angle difference from the straight path
     # TODO: support 0-180 range by utilizing is_start
-    angle_differences = tuple(
-        (
-            neighbor,
-            90 - abs(90 - angle),
-        )
-        for angle, neighbor in angles
-    )
-
-    return angle_differences
+    return 90 - abs(90 - angle)
 
 
 def get_bus_stops_at(
     neighbor: GraphKey,
-    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
-) -> tuple[list[SortedBusEntry], list[SortedBusEntry]]:
+    id_sorted_bus_map: dict[ElementId, list['SortedBusEntry']],
+) -> tuple[list['SortedBusEntry'], list['SortedBusEntry']]:
     neighbor_is_forward = neighbor.is_start
 
     visited = []
@@ -313,365 +627,1681 @@ def get_bus_stops_at(
     return visited, almost_visited
 
 
-def modified_dfs_worker(
+def graph_node(way_index: cython.int, is_start: bool) -> cython.int:
+    return way_index << 1 | (0 if is_start else 1)
+
+
+def _way_flags(way: FetchRelationElement) -> cython.uchar:
+    return (FLAG_ROUNDABOUT if way.roundabout else 0) | (FLAG_ONEWAY if way.oneway else 0)
+
+
+def _bitset(indexes: Sequence[int]) -> int:
+    bits = 0
+
+    for i in indexes:
+        bits |= 1 << i
+
+    return bits
+
+
+def compile_graph(
     graph: dict[GraphKey, GraphValue],
     ways: dict[ElementId, FetchRelationElement],
-    end_way: ElementId,
-    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
-    stack: list[StackElement],
-    best_path: BestPathCollection,
-    max_length: cython.double,
-    max_iter: cython.int,
-) -> tuple[list[StackElement], BestPathCollection]:
-    message_ref = [f'Worker with {len(stack)} stack size']
+    id_sorted_bus_map: dict[ElementId, list['SortedBusEntry']],
+) -> CompiledGraph:
+    way_ids = tuple(ways)
+    way_index = {way_id: i for i, way_id in enumerate(way_ids)}
+
+    bus_stop_index: dict[ElementId, int] = {}
+
+    for sorted_buses in id_sorted_bus_map.values():
+        for sorted_bus in sorted_buses:
+            bus_stop_index.setdefault(sorted_bus.bus_stop_collection.best.id, len(bus_stop_index))
+
+    node_intersection = array('i')
+    node_bus_stops = []
+    node_bus_stop_order = []
+    offsets = array('i', (0,))
+    targets = array('i')
+    edge_length = array('d')
+    edge_flags = array('B')
+    edge_angle = array('d')
+
+    for way_id in way_ids:
+        way = ways[way_id]
+
+        for is_start in (BOOL_START, BOOL_END):
+            key = GraphKey(way_id, is_start)
+            value = graph[key]
+
+            visited_bus_stops, almost_visited_bus_stops = get_bus_stops_at(key, id_sorted_bus_map)
+            visited_order = tuple(bus_stop_index[b.bus_stop_collection.best.id] for b in visited_bus_stops)
+            almost_visited_order = tuple(
+                bus_stop_index[b.bus_stop_collection.best.id] for b in almost_visited_bus_stops
+            )
+            node_intersection.append(value.intersection_id)
+            node_bus_stops.append((_bitset(visited_order), _bitset(almost_visited_order)))
+            node_bus_stop_order.append((visited_order, almost_visited_order))
 
-    with print_run_time(message_ref):
-        for current_iter in range(1, max_iter + 1):  # noqa: B007
-            if not stack:
-                break
+            for neighbor in value.connected_to:
+                neighbor_way = ways[neighbor.way_id]
+                targets.append(graph_node(way_index[neighbor.way_id], neighbor.is_start))
+                edge_length.append(neighbor_way.length)
+                edge_flags.append(_way_flags(neighbor_way))
 
-            s = stack.pop()
+                # angles are static, compute them once per edge
+                if len(value.connected_to) == 1:
+                    edge_angle.append(0)
+                else:
+                    edge_angle.append(_neighbor_angle(way.latLngs, neighbor_way.latLngs))
+
+            offsets.append(len(targets))
+
+    reverse_offsets, reverse_edges, reverse_sources = _reverse_adjacency(offsets, targets)
+
+    return CompiledGraph(
+        way_ids=way_ids,
+        way_index=way_index,
+        way_length=array('d', (way.length for way in ways.values())),
+        way_flags=array('B', (_way_flags(way) for way in ways.values())),
+        way_bits=tuple(1 << i for i in range(len(way_ids))),
+        bus_stop_ids=tuple(bus_stop_index),
+        node_intersection=node_intersection,
+        node_bus_stops=tuple(node_bus_stops),
+        node_bus_stop_order=tuple(node_bus_stop_order),
+        offsets=offsets,
+        targets=targets,
+        edge_length=edge_length,
+        edge_flags=edge_flags,
+        edge_angle=edge_angle,
+        reverse_offsets=reverse_offsets,
+        reverse_edges=reverse_edges,
+        reverse_sources=reverse_sources,
+        snapshot_depth=_snapshot_depth(max(node_intersection, default=0) + 1),
+    )
 
-            current_key = s.path[-1]
-            exit_at_key = current_key._replace(is_start=not current_key.is_start)
-
-            current_best_path = BestPath(
-                s.path,
-                visited_bus_stops=s.visited_bus_stops | s.almost_visited_bus_stops,
-                bus_stops_count=len(s.visited_bus_stops),
-                almost_bus_stops_count=len(s.almost_visited_bus_stops),
-                length=s.length,
-                complete_path=s.complete_path,
-                complete_length=s.complete_length,
-                angle_sum=s.angle_sum,
-            )
 
-            if current_key.way_id == end_way:
-                if (replace := best_path.valid.select_best(current_best_path)) == current_best_path:
-                    best_path = best_path._replace(valid=replace)
-            else:
-                if (replace := best_path.invalid.select_best(current_best_path)) == current_best_path:
-                    best_path = best_path._replace(invalid=replace)
+def _reverse_adjacency(offsets: array, targets: array) -> tuple[array, array, array]:
+    # the forward edges already respect oneway ways, group them by their target
+    n_nodes: cython.int = len(offsets) - 1
+    reverse_offsets = array('i', (0,)) * (n_nodes + 1)
 
-            current_way = ways[current_key.way_id]
-            neighbors = graph[exit_at_key].connected_to
-            valid_neighbors = select_neighbors(current_way, neighbors, ways)
+    for target in targets:
+        reverse_offsets[target + 1] += 1
 
-            intersection_id = graph[exit_at_key].intersection_id
+    for node in range(n_nodes):
+        reverse_offsets[node + 1] += reverse_offsets[node]
 
-            if (t := s.intersection_bus_stops_snapshot.get(intersection_id, None)) is not None:
-                intersection_bus_stops_count, intersection_visit_count = t
-            else:
-                intersection_bus_stops_count = None
-                intersection_visit_count = 0
+    position = array('i', reverse_offsets)
+    reverse_edges = array('i', (0,)) * len(targets)
+    reverse_sources = array('i', (0,)) * len(targets)
 
-            new_intersection_bus_stops_snapshot = s.intersection_bus_stops_snapshot.copy()
+    for exit_at_node in range(n_nodes):
+        for edge in range(offsets[exit_at_node], offsets[exit_at_node + 1]):
+            target = targets[edge]
+            reverse_edges[position[target]] = edge
+            reverse_sources[position[target]] = exit_at_node
+            position[target] += 1
 
-            if (intersection_bus_stops_count is None) or (
-                intersection_bus_stops_count < len(s.visited_bus_stops) + len(s.almost_visited_bus_stops)
-            ):
-                new_intersection_visit_count = 1
-                new_intersection_bus_stops_snapshot[intersection_id] = (
-                    len(s.visited_bus_stops) + len(s.almost_visited_bus_stops),
-                    new_intersection_visit_count,
-                )
-            elif intersection_visit_count < VISITED_LIMIT:
-                new_intersection_visit_count = intersection_visit_count + 1
-                new_intersection_bus_stops_snapshot[intersection_id] = (
-                    intersection_bus_stops_count,
-                    new_intersection_visit_count,
-                )
-            else:
-                continue
+    return reverse_offsets, reverse_edges, reverse_sources
 
-            for neighbor, neighbor_angle in valid_neighbors:
-                neighbor_way = ways[neighbor.way_id]
 
-                new_path = (*s.path, neighbor)
+def _make_best_path(s: StackElement) -> BestPath:
+    return BestPath(
+        s.path,
+        visited_bus_stops=s.visited_bus_stops,
+        almost_visited_bus_stops=s.almost_visited_bus_stops,
+        bus_stops_count=s.visited_bus_stops.bit_count(),
+        almost_bus_stops_count=s.almost_visited_bus_stops.bit_count(),
+        length=s.length,
+        complete_path=s.complete_path,
+        complete_length=s.complete_length,
+        angle_sum=s.angle_sum,
+    )
 
-                visited_bus_stops, almost_visited_bus_stops = get_bus_stops_at(neighbor, id_sorted_bus_map)
 
-                if visited_bus_stops or almost_visited_bus_stops:
-                    new_visited_bus_stops = s.visited_bus_stops.copy()
-                    new_almost_visited_bus_stops = s.almost_visited_bus_stops.copy()
+def _update_best_path(best_path: BestPathCollection, s: StackElement, end_way: cython.int) -> BestPathCollection:
+    current_best_path = _make_best_path(s)
 
-                    for b in visited_bus_stops:
-                        new_visited_bus_stops.setdefault(b.bus_stop_collection.best.id, len(new_path))
+    if s.path.keys[-1] >> 1 == end_way:
+        if (replace := best_path.valid.select_best(current_best_path)) is current_best_path:
+            best_path = best_path._replace(valid=replace)
+    else:
+        if (replace := best_path.invalid.select_best(current_best_path)) is current_best_path:
+            best_path = best_path._replace(invalid=replace)
 
-                    for b in almost_visited_bus_stops:
-                        new_almost_visited_bus_stops.setdefault(b.bus_stop_collection.best.id, len(new_path))
+    return best_path
 
-                    new_almost_visited_bus_stops = {
-                        k: v for k, v in new_almost_visited_bus_stops.items() if k not in new_visited_bus_stops
-                    }
-                else:
-                    new_visited_bus_stops = s.visited_bus_stops
-                    new_almost_visited_bus_stops = s.almost_visited_bus_stops
 
-                new_length = s.length + neighbor_way.length
+class TranspositionTable:
+    """
+    Worker-resident table of the expanded search states, used to discard dominated states.
 
-                if new_length > max_length:
-                    continue
+    Two states are in the same position when they end at the same node with the same complete ways,
+    bus stops, intersection snapshot and roundabout entry: they have the same possible continuations.
+    Of those, a state that is no shorter, no straighter and no further into a loop or past the finish
+    cannot lead to a better path (see BestPath.select_best).
+    """
 
-                if neighbor_way.id not in s.complete_path:
-                    new_complete_path = s.complete_path.copy()
-                    new_complete_path.add(neighbor_way.id)
-                    new_complete_length = s.complete_length + neighbor_way.length
-                else:
-                    new_complete_path = s.complete_path
-                    new_complete_length = s.complete_length
+    __slots__ = ('_max_size', '_table', 'dominated')
 
-                # roundabout looping and exits are free
-                if current_way.roundabout:  # noqa: SIM108
-                    new_angle_sum = s.angle_sum
-                else:
-                    new_angle_sum = s.angle_sum + neighbor_angle
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._table: dict[tuple, StackElement] = {}
+        self.dominated: int = 0
 
-                if new_intersection_visit_count > 1:  # noqa: SIM108
-                    new_loop_length = s.loop_length + neighbor_way.length
-                else:
-                    new_loop_length = 0
+    def is_dominated(self, s: StackElement) -> bool:
+        """
+        Check whether the state is dominated by an already expanded one, otherwise record it.
+        """
 
-                # stop path if too long loop
-                if new_loop_length > MAX_LOOP_LENGTH:
-                    continue
+        key = (
+            s.path.keys[-1],
+            s.complete_path,
+            s.snapshot_hash,
+            s.visited_bus_stops,
+            s.almost_visited_bus_stops,
+            s.roundabout_enter,
+        )
 
-                if s.after_finish_length > 0 or neighbor.way_id == end_way:
-                    new_after_finish_length = s.after_finish_length + neighbor_way.length
-                else:
-                    new_after_finish_length = 0
+        if (other := self._table.get(key)) is not None:
+            # hash collisions are not fatal: the state is expanded and the table is left unchanged
+            if not _same_position(other, s):
+                return False
 
-                # stop path if too long after finish
-                if new_after_finish_length > MAX_AFTER_FINISH_LENGTH:
-                    continue
+            if _dominates(other, s):
+                self.dominated += 1
+                return True
 
-                if neighbor_way.roundabout:
-                    if s.roundabout_enter:
-                        # stop path if looping in roundabout
-                        if s.roundabout_enter == neighbor:
-                            continue
-                        else:
-                            new_roundabout_enter = s.roundabout_enter
-                    else:
-                        new_roundabout_enter = neighbor
-                else:
-                    new_roundabout_enter = None
-
-                stack.append(
-                    StackElement(
-                        path=new_path,
-                        visited_bus_stops=new_visited_bus_stops,
-                        almost_visited_bus_stops=new_almost_visited_bus_stops,
-                        intersection_bus_stops_snapshot=new_intersection_bus_stops_snapshot,
-                        length=new_length,
-                        complete_path=new_complete_path,
-                        complete_length=new_complete_length,
-                        angle_sum=new_angle_sum,
-                        loop_length=new_loop_length,
-                        after_finish_length=new_after_finish_length,
-                        roundabout_enter=new_roundabout_enter,
-                    )
-                )
+            if not _dominates(s, other):
+                return False
 
-        message_ref[0] += f' and {current_iter} iterations'
+            del self._table[key]
 
-    return stack, best_path
+        # evict the oldest states first
+        elif len(self._table) >= self._max_size:
+            del self._table[next(iter(self._table))]
 
+        self._table[key] = s
+        return False
 
-async def modified_dfs(
-    graph: dict[GraphKey, GraphValue],
-    ways: dict[ElementId, FetchRelationElement],
-    start_way: ElementId,
-    end_way: ElementId,
-    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]],
-    executor: ProcessPoolExecutor,
-    n_processes: cython.int,
-) -> BestPath:
-    max_length = MAX_PATH_LENGTH_FACTOR * sum(w.length for w in ways.values())
 
-    start_start_key = GraphKey(start_way, BOOL_START)
-    start_end_key = GraphKey(start_way, BOOL_END)
+def _same_position(a: StackElement, b: StackElement) -> bool:
+    return a.intersection_bus_stops_snapshot == b.intersection_bus_stops_snapshot
 
-    def init_stack_element(key: GraphKey) -> StackElement:
-        intersection_id = graph[key].intersection_id
-        visited_bus_stops, almost_visited_bus_stops = get_bus_stops_at(key, id_sorted_bus_map)
 
-        return StackElement(
-            path=(key,),
-            visited_bus_stops={b.bus_stop_collection.best.id: 1 for b in visited_bus_stops},
-            almost_visited_bus_stops={b.bus_stop_collection.best.id: 1 for b in almost_visited_bus_stops},
-            intersection_bus_stops_snapshot={
-                intersection_id: (len(visited_bus_stops) + len(almost_visited_bus_stops), 1)
-            },
-            length=ways[start_way].length,
-            complete_path={key.way_id},
-            complete_length=ways[start_way].length,
-        )
+def _dominates(a: StackElement, b: StackElement) -> bool:
+    return (
+        a.length <= b.length
+        and a.angle_sum <= b.angle_sum
+        and a.loop_length <= b.loop_length
+        and a.after_finish_length <= b.after_finish_length
+    )
 
-    stack: list[StackElement] = [
-        init_stack_element(start_start_key),
-        init_stack_element(start_end_key),
-    ]
 
-    best_path = BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero())
+# worker-resident transposition tables of the shared route contexts, most recent last
+_transposition_table_cache: dict[str, TranspositionTable] = {}
 
-    # for reference:
-    # AMD Ryzen 9 5950X: 10,000 iterations in ~ 0.1s
-    sync_max_iter = 3000  # .03s
-    async_max_iter = 10000  # .10s
 
-    # run a few iterations synchronously to get a head start
-    stack, best_path = modified_dfs_worker(
-        graph,
-        ways,
-        end_way,
-        id_sorted_bus_map,
-        stack,
-        best_path,
-        max_length=max_length,
-        max_iter=sync_max_iter,
-    )
+def _load_transposition_table(handle: RouteContextHandle) -> TranspositionTable:
+    table = _transposition_table_cache.pop(handle.name, None)
 
-    tasks = []
+    if table is None:
+        table = TranspositionTable(CALC_ROUTE_TRANSPOSITION_TABLE_SIZE)
 
-    async def worker(
-        stack_slice: list[StackElement],
-        best_path: BestPathCollection,
-        max_iter: cython.int,
-    ) -> tuple[list[StackElement], BestPathCollection]:
-        loop = asyncio.get_running_loop()
+        while len(_transposition_table_cache) >= ROUTE_CONTEXT_CACHE_SIZE:
+            del _transposition_table_cache[next(iter(_transposition_table_cache))]
 
-        return await loop.run_in_executor(
-            executor,
-            partial(
-                modified_dfs_worker,
-                graph,
-                ways,
-                end_way,
-                id_sorted_bus_map,
-                stack_slice,
-                best_path,
-                max_length=max_length,
-                max_iter=max_iter,
-            ),
-        )
+    _transposition_table_cache[handle.name] = table
+    return table
 
-    while stack or tasks:
-        stack_slices_len_target = n_processes - len(tasks)
-        stack_slice_size_target, remainder = divmod(len(stack), stack_slices_len_target)
-        stack_slices: list[list[StackElement]] = []
 
-        for i in range(stack_slices_len_target):
-            current_slice_size = stack_slice_size_target + (1 if i < remainder else 0)
-            if current_slice_size == 0:
-                break
+def _complete_length_bound(s: StackElement, context: RouteContext) -> float:
+    # admissible bound: every new complete meter costs at least one meter of path length
+    return s.complete_length + min(
+        context.total_length - s.complete_length,
+        context.max_length - s.length,
+    )
 
-            stack_slices.append(stack[:current_slice_size])
-            stack = stack[current_slice_size:]
 
-        assert not stack, 'Stack must be empty after slicing'
+def _expand_stack_element(s: StackElement, context: RouteContext) -> list[StackElement]:
+    graph = context.graph
+    end_way: cython.int = context.end_way
+    max_length: cython.double = context.max_length
+    snapshot_depth: cython.int = graph.snapshot_depth
 
-        print(f'[DEBUG] Stack slice sizes: {", ".join(str(len(stack_slice)) for stack_slice in stack_slices)}')
+    offsets: cython.int[:] = graph.offsets
+    targets: cython.int[:] = graph.targets
+    edge_length: cython.double[:] = graph.edge_length
+    edge_flags: cython.uchar[:] = graph.edge_flags
+    edge_angle: cython.double[:] = graph.edge_angle
 
-        tasks.extend(
-            asyncio.create_task(
-                worker(
-                    stack_slice,
-                    best_path,
-                    async_max_iter,
-                )
-            )
-            for stack_slice in stack_slices
-        )
+    result: list[StackElement] = []
 
-        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    current_node: cython.int = s.path.keys[-1]
+    exit_at_node: cython.int = current_node ^ 1
+    current_way: cython.int = current_node >> 1
+    current_way_roundabout: cython.bint = graph.way_flags[current_way] & FLAG_ROUNDABOUT
 
-        for task in done:
-            stack_slice, best_path_slice = task.result()
-            stack += stack_slice
-            best_path = best_path.merge(best_path_slice, ways)
+    edge_start: cython.int = offsets[exit_at_node]
+    edge_end: cython.int = offsets[exit_at_node + 1]
 
-        tasks = list(pending)
+    intersection_id: cython.int = graph.node_intersection[exit_at_node]
+    snapshot = s.intersection_bus_stops_snapshot
 
-    return best_path.valid if best_path.valid.path else best_path.invalid
+    if (t := _snapshot_get(snapshot, snapshot_depth, intersection_id)) is not None:
+        intersection_bus_stops_count, intersection_visit_count = t
+    else:
+        intersection_bus_stops_count = None
+        intersection_visit_count = 0
 
+    bus_stops_count: cython.int = s.visited_bus_stops.bit_count() + s.almost_visited_bus_stops.bit_count()
 
-def finalize_route(
-    best_path: BestPath,
-    ways: dict[ElementId, FetchRelationElement],
-    bus_stop_collections: Sequence[FetchRelationBusStopCollection],
-    tags: dict[str, str],
-) -> FinalRoute:
-    route_ways = tuple(
-        FinalRouteWay(
-            way=ways[key.way_id],
-            reversed_latLngs=not key.is_start,
-        )
-        for key in best_path.path
-    )
+    if (intersection_bus_stops_count is None) or (intersection_bus_stops_count < bus_stops_count):
+        new_intersection_visit_count = 1
+        new_snapshot_value = (bus_stops_count, new_intersection_visit_count)
+    elif intersection_visit_count < VISITED_LIMIT:
+        new_intersection_visit_count = intersection_visit_count + 1
+        new_snapshot_value = (intersection_bus_stops_count, new_intersection_visit_count)
+    else:
+        return result
 
-    route_latlons_gen = (
-        route_way.way.latLngs[::-1] if route_way.reversed_latLngs else route_way.way.latLngs for route_way in route_ways
+    new_intersection_bus_stops_snapshot = _snapshot_set(snapshot, snapshot_depth, intersection_id, new_snapshot_value)
+    new_snapshot_hash = (
+        s.snapshot_hash
+        ^ _snapshot_entry_hash(intersection_id, t)
+        ^ _snapshot_entry_hash(intersection_id, new_snapshot_value)
     )
 
-    route_latlons = tuple(
-        chain.from_iterable(latlons if i == 0 else latlons[1:] for i, latlons in enumerate(route_latlons_gen))
-    )
+    edge: cython.int
+    neighbor: cython.int
+    neighbor_way: cython.int
 
-    route_latlons_set = set(route_latlons)
+    for edge in range(edge_start, edge_end):
+        neighbor = targets[edge]
+        neighbor_way = neighbor >> 1
 
-    id_collection_map = {collection.best.id: collection for collection in bus_stop_collections}
+        new_path = path_append(s.path, neighbor)
 
-    route_bus_stops = []
+        visited_bus_stops, almost_visited_bus_stops = graph.node_bus_stops[neighbor]
 
-    for stop_id, _ in sorted(best_path.visited_bus_stops.items(), key=lambda x: x[1]):
-        collection = id_collection_map[stop_id]
+        if visited_bus_stops or almost_visited_bus_stops:
+            new_visited_bus_stops = s.visited_bus_stops | visited_bus_stops
+            new_almost_visited_bus_stops = (
+                s.almost_visited_bus_stops | almost_visited_bus_stops
+            ) & ~new_visited_bus_stops
+        else:
+            new_visited_bus_stops = s.visited_bus_stops
+            new_almost_visited_bus_stops = s.almost_visited_bus_stops
 
-        if collection.stop is not None and collection.stop.latLng not in route_latlons_set:
-            collection = replace(collection, stop=None)
+        new_length: cython.double = s.length + edge_length[edge]
 
-        if collection.platform is None and collection.stop is None:
+        if new_length > max_length:
             continue
 
-        route_bus_stops.append(collection)
+        neighbor_bit = graph.way_bits[neighbor_way]
 
-    return FinalRoute(
-        ways=route_ways,
-        latLngs=route_latlons,
-        busStops=tuple(route_bus_stops),
-        tags=tags,
-    )
+        if not s.complete_path & neighbor_bit:
+            new_complete_path = s.complete_path | neighbor_bit
+            new_complete_length = s.complete_length + edge_length[edge]
+        else:
+            new_complete_path = s.complete_path
+            new_complete_length = s.complete_length
 
+        # roundabout looping and exits are free
+        if current_way_roundabout:  # noqa: SIM108
+            new_angle_sum = s.angle_sum
+        else:
+            new_angle_sum = s.angle_sum + edge_angle[edge]
 
-async def calc_bus_route(
-    ways_members: dict[ElementId, FetchRelationElement],
-    start_way: ElementId,
-    end_way: ElementId,
-    bus_stop_collections: Sequence[FetchRelationBusStopCollection],
-    tags: dict[str, str],
-    executor: ProcessPoolExecutor,
-    n_processes: cython.int,
-) -> FinalRoute:
-    with print_run_time('Sorting bus stops'):
-        sorted_buses = sort_bus_on_path(bus_stop_collections, ways_members.values())
+        if new_intersection_visit_count > 1:  # noqa: SIM108
+            new_loop_length = s.loop_length + edge_length[edge]
+        else:
+            new_loop_length = 0
 
-    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]] = {}
+        # stop path if too long loop
+        if new_loop_length > MAX_LOOP_LENGTH:
+            continue
 
-    for sorted_bus in sorted_buses:
-        id_sorted_bus_map.setdefault(sorted_bus.neighbor_id, []).append(sorted_bus)
+        if s.after_finish_length > 0 or neighbor_way == end_way:
+            new_after_finish_length = s.after_finish_length + edge_length[edge]
+        else:
+            new_after_finish_length = 0
 
-    with print_run_time('Building graph'):
-        graph = build_graph(ways_members)
-
-    with print_run_time('Calculating route'):
-        best_path = await modified_dfs(
-            graph,
-            ways_members,
-            start_way,
-            end_way,
-            id_sorted_bus_map,
-            executor,
+        # stop path if too long after finish
+        if new_after_finish_length > MAX_AFTER_FINISH_LENGTH:
+            continue
+
+        if edge_flags[edge] & FLAG_ROUNDABOUT:
+            if s.roundabout_enter != -1:
+                # stop path if looping in roundabout
+                if s.roundabout_enter == neighbor:
+                    continue
+                else:
+                    new_roundabout_enter = s.roundabout_enter
+            else:
+                new_roundabout_enter = neighbor
+        else:
+            new_roundabout_enter = -1
+
+        result.append(
+            StackElement(
+                path=new_path,
+                visited_bus_stops=new_visited_bus_stops,
+                almost_visited_bus_stops=new_almost_visited_bus_stops,
+                intersection_bus_stops_snapshot=new_intersection_bus_stops_snapshot,
+                length=new_length,
+                complete_path=new_complete_path,
+                complete_length=new_complete_length,
+                angle_sum=new_angle_sum,
+                loop_length=new_loop_length,
+                after_finish_length=new_after_finish_length,
+                roundabout_enter=new_roundabout_enter,
+                snapshot_hash=new_snapshot_hash,
+            )
+        )
+
+    return result
+
+
+def modified_dfs_worker(
+    context: RouteContext,
+    stack: list[StackElement],
+    best_path: BestPathCollection,
+    max_iter: cython.int,
+    table: TranspositionTable | None = None,
+    board: SearchBoard | None = None,
+    slot: cython.int = -1,
+) -> tuple[list[StackElement], BestPathCollection]:
+    incumbent: cython.double = best_path.valid.complete_length if best_path.valid.path is not None else -1
+    pruned: cython.int = 0
+    dominated_before: cython.int = table.dominated if table is not None else 0
+
+    message_ref = [f'Worker with {len(stack)} stack size']
+
+    with print_run_time(message_ref):
+        for current_iter in range(1, max_iter + 1):
+            if not stack:
+                break
+
+            if board is not None and current_iter % BOARD_SYNC_INTERVAL == 0:
+                incumbent = max(incumbent, board.publish(best_path.valid))
+
+                if board.yield_requested(slot):
+                    break
+
+            s = stack.pop()
+
+            # the path (and every path it leads to) is less complete than the incumbent
+            if incumbent >= 0 and _complete_length_bound(s, context) < incumbent - 0.1:
+                pruned += 1
+                continue
+
+            if table is not None and table.is_dominated(s):
+                continue
+
+            best_path = _update_best_path(best_path, s, context.end_way)
+
+            if best_path.valid.path is not None and best_path.valid.complete_length > incumbent:
+                incumbent = best_path.valid.complete_length
+
+            stack.extend(_expand_stack_element(s, context))
+
+        if board is not None:
+            board.publish(best_path.valid)
+
+        dominated = table.dominated - dominated_before if table is not None else 0
+        message_ref[0] += f' and {current_iter} iterations ({pruned} pruned, {dominated} dominated)'
+
+    return stack, best_path._replace(iterations=best_path.iterations + current_iter)
+
+
+def modified_dfs_shared_worker(
+    handle: RouteContextHandle,
+    board_handle: SearchBoardHandle,
+    slot: cython.int,
+    stack: list[StackElement],
+    best_path: BestPathCollection,
+    max_iter: cython.int,
+) -> tuple[list[StackElement], BestPathCollection]:
+    with _attach_search_board(board_handle) as board:
+        return modified_dfs_worker(
+            _load_route_context(handle),
+            stack,
+            best_path,
+            max_iter,
+            _load_transposition_table(handle),
+            board,
+            slot,
+        )
+
+
+def _best_first_priority(s: StackElement) -> tuple:
+    # prefer paths that waste the least length on already complete ways,
+    # then the most complete ones (which gives the search a depth-first flavor)
+    return (
+        s.length - s.complete_length,
+        -s.complete_length,
+        -s.visited_bus_stops.bit_count(),
+        -s.almost_visited_bus_stops.bit_count(),
+        s.angle_sum,
+    )
+
+
+def best_first_worker(
+    context: RouteContext,
+    stack: list[StackElement],
+    best_path: BestPathCollection,
+    cpu_budget: cython.double,
+) -> BestPathCollection:
+    deadline: cython.double = time.process_time() + cpu_budget
+    pruned: cython.int = 0
+    counter = count()
+
+    heap: list[tuple[tuple, int, StackElement]] = [(_best_first_priority(s), next(counter), s) for s in stack]
+    heapify(heap)
+
+    message_ref = [f'Best-first worker with {len(stack)} stack size']
+
+    with print_run_time(message_ref):
+        current_iter: cython.int = 0
+
+        while heap:
+            current_iter += 1
+
+            if current_iter % 1000 == 0 and time.process_time() > deadline:
+                break
+
+            s = heappop(heap)[2]
+
+            if (
+                best_path.valid.path is not None
+                and _complete_length_bound(s, context) < best_path.valid.complete_length - 0.1
+            ):
+                pruned += 1
+                continue
+
+            best_path = _update_best_path(best_path, s, context.end_way)
+
+            for new_s in _expand_stack_element(s, context):
+                heappush(heap, (_best_first_priority(new_s), next(counter), new_s))
+
+        message_ref[0] += f' and {current_iter} iterations ({pruned} pruned, {len(heap)} left)'
+
+    return best_path._replace(iterations=best_path.iterations + current_iter)
+
+
+def _init_stack(context: RouteContext, start_way: cython.int) -> list[StackElement]:
+    graph = context.graph
+
+    def init_stack_element(node: cython.int) -> StackElement:
+        visited_bus_stops, almost_visited_bus_stops = graph.node_bus_stops[node]
+        almost_visited_bus_stops &= ~visited_bus_stops
+        intersection_id = graph.node_intersection[node]
+        snapshot_value = (visited_bus_stops.bit_count() + almost_visited_bus_stops.bit_count(), 1)
+
+        return StackElement(
+            path=path_append(None, node),
+            visited_bus_stops=visited_bus_stops,
+            almost_visited_bus_stops=almost_visited_bus_stops,
+            intersection_bus_stops_snapshot=_snapshot_set(None, graph.snapshot_depth, intersection_id, snapshot_value),
+            length=graph.way_length[start_way],
+            complete_path=graph.way_bits[start_way],
+            complete_length=graph.way_length[start_way],
+            snapshot_hash=_snapshot_entry_hash(intersection_id, snapshot_value),
+        )
+
+    return [
+        init_stack_element(graph_node(start_way, BOOL_START)),
+        init_stack_element(graph_node(start_way, BOOL_END)),
+    ]
+
+
+def _replay_path(context: RouteContext, s: StackElement, nodes: Sequence[int]) -> list[StackElement]:
+    """
+    Follow the path from the state, for as long as the search could have taken it.
+    """
+
+    states = []
+
+    for node in nodes:
+        for child in _expand_stack_element(s, context):
+            if child.path.keys[-1] == node:
+                states.append(child)
+                s = child
+                break
+        else:
+            break
+
+    return states
+
+
+def reroute_worker(context: RouteContext, seed: RouteSeed, max_iter: cython.int) -> BestPathCollection:
+    """
+    Repair the previous route around the changed ways.
+
+    The previous route is replayed up to a few ways before the changes, then detours are searched
+    (shortest first, for at most max_iter states). Whenever a detour rejoins the previous route
+    after the changes, the rest of the previous route is replayed from there.
+    """
+
+    nodes = seed.nodes
+    best_path = BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero())
+
+    start = next((s for s in _init_stack(context, nodes[0] >> 1) if s.path.keys[-1] == nodes[0]), None)
+
+    if start is None:
+        return best_path
+
+    prefix = [start, *_replay_path(context, start, nodes[1 : seed.prefix_size])]
+
+    if len(prefix) < seed.prefix_size:
+        return best_path
+
+    rejoin_index: dict[int, int] = {}
+
+    # prefer rejoining as early as possible
+    for i in range(len(nodes) - 1, seed.rejoin_size - 1, -1):
+        if nodes[i] != -1:
+            rejoin_index[nodes[i]] = i
+
+    table = TranspositionTable(CALC_ROUTE_TRANSPOSITION_TABLE_SIZE)
+    counter = count()
+    heap: list[tuple[float, int, StackElement]] = [(prefix[-1].length, next(counter), prefix[-1])]
+    pruned: cython.int = 0
+    rejoined: cython.int = 0
+
+    message_ref = ['Reroute worker']
+
+    with print_run_time(message_ref):
+        for current_iter in range(1, max_iter + 1):  # noqa: B007
+            if not heap:
+                break
+
+            s = heappop(heap)[2]
+
+            if (
+                best_path.valid.path is not None
+                and _complete_length_bound(s, context) < best_path.valid.complete_length - 0.1
+            ):
+                pruned += 1
+                continue
+
+            if table.is_dominated(s):
+                continue
+
+            best_path = _update_best_path(best_path, s, context.end_way)
+
+            if (i := rejoin_index.get(s.path.keys[-1])) is not None:
+                rejoined += 1
+
+                for r in _replay_path(context, s, nodes[i + 1 :]):
+                    best_path = _update_best_path(best_path, r, context.end_way)
+
+            for child in _expand_stack_element(s, context):
+                heappush(heap, (child.length, next(counter), child))
+
+        message_ref[0] += (
+            f' with {current_iter} iterations ({pruned} pruned, {table.dominated} dominated, {rejoined} rejoined)'
+        )
+
+    return best_path._replace(iterations=current_iter)
+
+
+async def reroute_search(
+    graph: CompiledGraph,
+    end_way: cython.int,
+    executor: ProcessPoolExecutor,
+    seed: RouteSeed,
+) -> BestPathCollection:
+    context = _make_route_context(graph, end_way)
+
+    loop = asyncio.get_running_loop()
+    best_path = await loop.run_in_executor(
+        executor,
+        partial(
+            reroute_worker,
+            context,
+            seed,
+            max_iter=REROUTE_MAX_ITER,
+        ),
+    )
+
+    return best_path
+
+
+async def modified_dfs(
+    graph: CompiledGraph,
+    start_way: cython.int,
+    end_way: cython.int,
+    executor: ProcessPoolExecutor,
+    n_processes: cython.int,
+    *,
+    deadline: float | None = None,
+    on_progress: ProgressCallback | None = None,
+    incumbent: BestPathCollection | None = None,
+) -> BestPathCollection:
+    context = _make_route_context(graph, end_way)
+    stack = _init_stack(context, start_way)
+
+    best_path = BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero())
+
+    # a known path prunes the less complete paths, and possibly the longer ones
+    if incumbent is not None:
+        best_path = incumbent._replace(iterations=0)
+
+        if (max_length := _incumbent_max_length(incumbent.valid, context)) is not None:
+            context = context._replace(max_length=min(context.max_length, max_length))
+
+    # for reference:
+    # AMD Ryzen 9 5950X: 10,000 iterations in ~ 0.1s
+    sync_max_iter = 3000  # .03s
+    async_max_iter = 10000  # .10s
+
+    # run a few iterations synchronously to get a head start
+    table = TranspositionTable(CALC_ROUTE_TRANSPOSITION_TABLE_SIZE)
+    stack, best_path = modified_dfs_worker(context, stack, best_path, max_iter=sync_max_iter, table=table)
+
+    if not stack:
+        return best_path
+
+    # progress is only reported by the process pool search
+    if NATIVE_AVAILABLE and CALC_ROUTE_NATIVE and on_progress is None:
+        return await _modified_dfs_native(context, stack, best_path, n_processes, deadline)
+
+    with share_route_context(context) as handle, share_search_board(n_processes) as (board_handle, board):
+        return await _modified_dfs_parallel(
+            handle,
+            board_handle,
+            board,
+            stack,
+            best_path,
+            executor,
             n_processes,
+            async_max_iter,
+            deadline,
+            on_progress,
+        )
+
+
+async def _modified_dfs_parallel(
+    handle: RouteContextHandle,
+    board_handle: SearchBoardHandle,
+    board: SearchBoard,
+    stack: list[StackElement],
+    best_path: BestPathCollection,
+    executor: ProcessPoolExecutor,
+    n_processes: cython.int,
+    async_max_iter: cython.int,
+    deadline: float | None,
+    on_progress: ProgressCallback | None,
+) -> BestPathCollection:
+    loop = asyncio.get_running_loop()
+    last_progress_time = loop.time()
+    last_progress = None
+    progress_latest = None
+    progress_task: asyncio.Task | None = None
+    tasks: dict[asyncio.Task, int] = {}
+    free_slots = list(range(n_processes))
+
+    async def send_progress() -> None:
+        nonlocal progress_latest
+
+        # only the latest path is sent, the paths found during a send replace each other
+        while (current := progress_latest) is not None:
+            progress_latest = None
+            await on_progress(current)
+
+    async def worker(
+        slot: cython.int,
+        stack_slice: list[StackElement],
+        best_path: BestPathCollection,
+        max_iter: cython.int,
+    ) -> tuple[list[StackElement], BestPathCollection]:
+        loop = asyncio.get_running_loop()
+
+        # only the stack slice and the best path are sent, the context is referenced by the handle
+        return await loop.run_in_executor(
+            executor,
+            partial(
+                modified_dfs_shared_worker,
+                handle,
+                board_handle,
+                slot,
+                stack_slice,
+                best_path,
+                max_iter=max_iter,
+            ),
+        )
+
+    try:
+        while stack or tasks:
+            stack_slices_len_target = n_processes - len(tasks)
+            stack_slice_size_target, remainder = divmod(len(stack), stack_slices_len_target)
+            stack_slices: list[list[StackElement]] = []
+
+            for i in range(stack_slices_len_target):
+                current_slice_size = stack_slice_size_target + (1 if i < remainder else 0)
+                if current_slice_size == 0:
+                    break
+
+                stack_slices.append(stack[:current_slice_size])
+                stack = stack[current_slice_size:]
+
+            assert not stack, 'Stack must be empty after slicing'
+
+            print(f'[DEBUG] Stack slice sizes: {", ".join(str(len(stack_slice)) for stack_slice in stack_slices)}')
+
+            for stack_slice in stack_slices:
+                slot = free_slots.pop()
+                board.clear_yield(slot)
+                # the iterations are counted here, the workers only report their own
+                task = asyncio.create_task(worker(slot, stack_slice, best_path._replace(iterations=0), async_max_iter))
+                tasks[task] = slot
+
+            # work stealing: some workers would sit idle, ask the busy ones to return their stacks early
+            if len(tasks) < n_processes:
+                for slot in tasks.values():
+                    board.request_yield(slot)
+
+            timeout = max(deadline - loop.time(), 0) if deadline is not None else None
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                free_slots.append(tasks.pop(task))
+                stack_slice, best_path_slice = task.result()
+                stack += stack_slice
+                best_path = best_path.merge(best_path_slice)
+
+            board.publish(best_path.valid)
+
+            # anytime mode: stop at the deadline and settle for the best path found so far
+            if deadline is not None and loop.time() >= deadline:
+                print(f'[DEBUG] Route deadline reached with {len(stack)} stack size and {len(tasks)} pending tasks')
+
+                for task, slot in tasks.items():
+                    board.request_yield(slot)
+                    task.cancel()
+
+                break
+
+            if on_progress is not None and loop.time() - last_progress_time >= PROGRESS_INTERVAL:
+                current = best_path.best()
+
+                if current is not last_progress and current.path is not None:
+                    last_progress_time = loop.time()
+                    last_progress = current
+                    progress_latest = current
+
+                    # sent in the background, the workers keep getting work meanwhile
+                    if progress_task is None or progress_task.done():
+                        if progress_task is not None:
+                            progress_task.result()  # raise the error of the previous send
+
+                        progress_task = asyncio.create_task(send_progress())
+    except BaseException:
+        if progress_task is not None:
+            progress_task.cancel()
+        raise
+
+    # the final path follows, only the path being sent is waited for
+    if progress_task is not None:
+        progress_latest = None
+        await progress_task
+
+    return best_path
+
+
+def _snapshot_items(
+    snapshot: Snapshot, depth: cython.int, key: cython.int = 0
+) -> Generator[tuple[int, tuple[int, int]]]:
+    if snapshot is None:
+        return
+
+    if depth == 0:
+        yield key, snapshot
+        return
+
+    for i, child in enumerate(snapshot):
+        yield from _snapshot_items(child, depth - 1, key << SNAPSHOT_BITS | i)
+
+
+def _bitset_words(bits: int, words: cython.int) -> bytes:
+    return bits.to_bytes(words * 8, sys.byteorder)
+
+
+def _native_graph(context: RouteContext) -> NativeGraph:
+    graph = context.graph
+    bus_stop_words = max(1, (len(graph.bus_stop_ids) + 63) // 64)
+    node_visited_bus_stops = array('Q')
+    node_almost_visited_bus_stops = array('Q')
+
+    for visited_bus_stops, almost_visited_bus_stops in graph.node_bus_stops:
+        node_visited_bus_stops.frombytes(_bitset_words(visited_bus_stops, bus_stop_words))
+        node_almost_visited_bus_stops.frombytes(_bitset_words(almost_visited_bus_stops, bus_stop_words))
+
+    return NativeGraph(
+        offsets=graph.offsets,
+        targets=graph.targets,
+        edge_length=graph.edge_length,
+        edge_angle=graph.edge_angle,
+        edge_flags=graph.edge_flags,
+        way_flags=graph.way_flags,
+        node_intersection=graph.node_intersection,
+        node_visited_bus_stops=node_visited_bus_stops,
+        node_almost_visited_bus_stops=node_almost_visited_bus_stops,
+        bus_stop_words=bus_stop_words,
+        way_words=max(1, (len(graph.way_ids) + 63) // 64),
+        intersections=max(graph.node_intersection, default=0) + 1,
+        end_way=context.end_way,
+        max_length=context.max_length,
+        total_length=context.total_length,
+        flag_roundabout=FLAG_ROUNDABOUT,
+        visited_limit=VISITED_LIMIT,
+        max_loop_length=MAX_LOOP_LENGTH,
+        max_after_finish_length=MAX_AFTER_FINISH_LENGTH,
+        max_extra_distance_to_convert=MAX_EXTRA_DISTANCE_TO_CONVERT,
+    )
+
+
+def _native_starts(graph: NativeGraph, stack: list[StackElement], snapshot_depth: cython.int) -> NativeStarts:
+    starts = NativeStarts(
+        path_offsets=array('i', (0,)),
+        path_nodes=array('i'),
+        length=array('d'),
+        complete_length=array('d'),
+        angle_sum=array('d'),
+        loop_length=array('d'),
+        after_finish_length=array('d'),
+        roundabout_enter=array('i'),
+        visited_bus_stops=array('Q'),
+        almost_visited_bus_stops=array('Q'),
+        complete_path=array('Q'),
+        snapshot_offsets=array('i', (0,)),
+        snapshot_keys=array('i'),
+        snapshot_counts=array('i'),
+        snapshot_visits=array('i'),
+    )
+
+    for s in stack:
+        starts.path_nodes.extend(path_to_tuple(s.path))
+        starts.path_offsets.append(len(starts.path_nodes))
+        starts.length.append(s.length)
+        starts.complete_length.append(s.complete_length)
+        starts.angle_sum.append(s.angle_sum)
+        starts.loop_length.append(s.loop_length)
+        starts.after_finish_length.append(s.after_finish_length)
+        starts.roundabout_enter.append(s.roundabout_enter)
+        starts.visited_bus_stops.frombytes(_bitset_words(s.visited_bus_stops, graph.bus_stop_words))
+        starts.almost_visited_bus_stops.frombytes(_bitset_words(s.almost_visited_bus_stops, graph.bus_stop_words))
+        starts.complete_path.frombytes(_bitset_words(s.complete_path, graph.way_words))
+
+        for key, (bus_stops_count, visit_count) in _snapshot_items(s.intersection_bus_stops_snapshot, snapshot_depth):
+            starts.snapshot_keys.append(key)
+            starts.snapshot_counts.append(bus_stops_count)
+            starts.snapshot_visits.append(visit_count)
+
+        starts.snapshot_offsets.append(len(starts.snapshot_keys))
+
+    return starts
+
+
+def _native_search(
+    context: RouteContext,
+    stack: list[StackElement],
+    incumbent: float,
+    n_threads: cython.int,
+    abort: bytearray,
+) -> tuple[int, list[tuple[tuple[int, ...] | None, tuple[int, ...] | None]]]:
+    graph = _native_graph(context)
+    starts = _native_starts(graph, stack, context.graph.snapshot_depth)
+
+    message_ref = [f'Native search with {len(stack)} stack size on {n_threads} threads']
+
+    with print_run_time(message_ref):
+        iterations, paths = native_dfs(graph, starts, incumbent, n_threads, abort)
+        message_ref[0] += f' and {iterations} iterations'
+
+    return iterations, paths
+
+
+async def _modified_dfs_native(
+    context: RouteContext,
+    stack: list[StackElement],
+    best_path: BestPathCollection,
+    n_threads: cython.int,
+    deadline: float | None,
+) -> BestPathCollection:
+    """
+    Finish the search on native threads, without the process pool.
+
+    The native search returns only the nodes of the best paths,
+    they are replayed here to rebuild the search states.
+    """
+
+    loop = asyncio.get_running_loop()
+    incumbent = best_path.valid.complete_length if best_path.valid.path is not None else -1
+    abort = bytearray(1)
+    deadline_handle = loop.call_at(deadline, abort.__setitem__, 0, 1) if deadline is not None else None
+
+    try:
+        iterations, paths = await loop.run_in_executor(
+            None,
+            partial(_native_search, context, stack, incumbent, n_threads, abort),
+        )
+    finally:
+        # the search thread cannot be cancelled, stop it when the request is gone
+        abort[0] = 1
+
+        if deadline_handle is not None:
+            deadline_handle.cancel()
+
+    for s, start_paths in zip(stack, paths, strict=True):
+        for nodes in start_paths:
+            if nodes is None:
+                continue
+
+            states = _replay_path(context, s, nodes)
+            assert len(states) == len(nodes), 'Native search diverged from the path expansion'
+            best_path = _update_best_path(best_path, states[-1] if states else s, context.end_way)
+
+    return best_path._replace(iterations=best_path.iterations + iterations)
+
+
+class BackwardElement(NamedTuple):
+    # partial path to the end way, grown backwards: the path holds the nodes in reverse order
+    path: PathNode
+    visited_bus_stops: int  # union of the node bitsets
+    almost_visited_bus_stops: int  # union of the node bitsets, the visited ones are removed on joining
+    length: float
+    complete_path: int
+    complete_length: float
+    repeated_path: int  # bitset of way indexes on the path more than once
+    angle_sum: float
+
+
+def _bits_length(bits: int, way_length: array) -> float:
+    length: cython.double = 0
+
+    while bits:
+        low = bits & -bits
+        length += way_length[low.bit_length() - 1]
+        bits ^= low
+
+    return length
+
+
+def _bidirectional_forward(
+    context: RouteContext,
+    start_way: cython.int,
+    half_length: cython.double,
+) -> list[StackElement] | None:
+    """
+    Collect the paths from the start way whose prefix (without the last way) is at most half_length long.
+    """
+
+    table = TranspositionTable(BIDIRECTIONAL_MAX_STATES)
+    stack = _init_stack(context, start_way)
+    states = list(stack)
+
+    while stack:
+        s = stack.pop()
+
+        if s.length > half_length or table.is_dominated(s):
+            continue
+
+        children = _expand_stack_element(s, context)
+        stack.extend(children)
+        states.extend(children)
+
+        if len(states) > BIDIRECTIONAL_MAX_STATES:
+            return None
+
+    return states
+
+
+def _bidirectional_backward(context: RouteContext, half_length: cython.double) -> list[BackwardElement] | None:
+    """
+    Collect the paths to the end way that are at most half_length long, following the edges backwards.
+
+    Only the per-path rules that do not depend on the rest of the path are applied here,
+    the joined paths are checked by replaying them.
+    """
+
+    graph = context.graph
+    end_way: cython.int = context.end_way
+    reverse_offsets: cython.int[:] = graph.reverse_offsets
+    reverse_edges: cython.int[:] = graph.reverse_edges
+    reverse_sources: cython.int[:] = graph.reverse_sources
+    edge_angle: cython.double[:] = graph.edge_angle
+
+    stack: list[BackwardElement] = []
+
+    for node in (graph_node(end_way, BOOL_START), graph_node(end_way, BOOL_END)):
+        visited_bus_stops, almost_visited_bus_stops = graph.node_bus_stops[node]
+        stack.append(
+            BackwardElement(
+                path=path_append(None, node),
+                visited_bus_stops=visited_bus_stops,
+                almost_visited_bus_stops=almost_visited_bus_stops,
+                length=graph.way_length[end_way],
+                complete_path=graph.way_bits[end_way],
+                complete_length=graph.way_length[end_way],
+                repeated_path=0,
+                angle_sum=0,
+            )
+        )
+
+    states = list(stack)
+    k: cython.int
+
+    while stack:
+        b = stack.pop()
+
+        if b.length > half_length:
+            continue
+
+        node: cython.int = b.path.keys[-1]
+
+        for k in range(reverse_offsets[node], reverse_offsets[node + 1]):
+            previous: cython.int = reverse_sources[k] ^ 1
+            previous_way: cython.int = previous >> 1
+            previous_bit = graph.way_bits[previous_way]
+
+            # a way is driven at most twice
+            if b.repeated_path & previous_bit:
+                continue
+
+            # roundabout looping and exits are free
+            if graph.way_flags[previous_way] & FLAG_ROUNDABOUT:
+                angle_sum = b.angle_sum
+            else:
+                angle_sum = b.angle_sum + edge_angle[reverse_edges[k]]
+
+            visited_bus_stops, almost_visited_bus_stops = graph.node_bus_stops[previous]
+
+            if b.complete_path & previous_bit:
+                complete_path = b.complete_path
+                complete_length = b.complete_length
+                repeated_path = b.repeated_path | previous_bit
+            else:
+                complete_path = b.complete_path | previous_bit
+                complete_length = b.complete_length + graph.way_length[previous_way]
+                repeated_path = b.repeated_path
+
+            new_b = BackwardElement(
+                path=path_append(b.path, previous),
+                visited_bus_stops=b.visited_bus_stops | visited_bus_stops,
+                almost_visited_bus_stops=b.almost_visited_bus_stops | almost_visited_bus_stops,
+                length=b.length + graph.way_length[previous_way],
+                complete_path=complete_path,
+                complete_length=complete_length,
+                repeated_path=repeated_path,
+                angle_sum=angle_sum,
+            )
+            stack.append(new_b)
+            states.append(new_b)
+
+        if len(states) > BIDIRECTIONAL_MAX_STATES:
+            return None
+
+    return states
+
+
+def _join_best_path(s: StackElement, b: BackwardElement, edge: cython.int, context: RouteContext) -> BestPath:
+    graph = context.graph
+    visited_bus_stops = s.visited_bus_stops | b.visited_bus_stops
+    almost_visited_bus_stops = (s.almost_visited_bus_stops | b.almost_visited_bus_stops) & ~visited_bus_stops
+
+    if graph.way_flags[s.path.keys[-1] >> 1] & FLAG_ROUNDABOUT:
+        angle_sum = s.angle_sum + b.angle_sum
+    else:
+        angle_sum = s.angle_sum + b.angle_sum + graph.edge_angle[edge]
+
+    return BestPath(
+        None,
+        visited_bus_stops=visited_bus_stops,
+        almost_visited_bus_stops=almost_visited_bus_stops,
+        bus_stops_count=visited_bus_stops.bit_count(),
+        almost_bus_stops_count=almost_visited_bus_stops.bit_count(),
+        length=s.length + b.length,
+        complete_path=s.complete_path | b.complete_path,
+        complete_length=(
+            s.complete_length + b.complete_length - _bits_length(s.complete_path & b.complete_path, graph.way_length)
+        ),
+        angle_sum=angle_sum,
+    )
+
+
+def bidirectional_worker(context: RouteContext, start_way: cython.int) -> BestPathCollection:
+    """
+    Search forwards from the start way and backwards from the end way, then join the partial paths.
+
+    Every path up to BIDIRECTIONAL_LENGTH_FACTOR times the total length splits into a forward part
+    whose prefix is at most half of that, and a backward part at most half of that.
+    The joined paths are ranked first, and only the ones that would become the best path
+    are replayed from the start, which applies the remaining rules and rebuilds the search state.
+    Returns no valid path when there are too many partial paths to join.
+    """
+
+    graph = context.graph
+    reverse_offsets: cython.int[:] = graph.reverse_offsets
+    reverse_edges: cython.int[:] = graph.reverse_edges
+    reverse_sources: cython.int[:] = graph.reverse_sources
+    half_length: cython.double = BIDIRECTIONAL_LENGTH_FACTOR * context.total_length / 2
+    best_path = BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero())
+    joins: cython.int = 0
+    replays: cython.int = 0
+    k: cython.int
+
+    message_ref = ['Bidirectional worker']
+
+    with print_run_time(message_ref):
+        forward = _bidirectional_forward(context, start_way, half_length)
+        backward = _bidirectional_backward(context, half_length) if forward is not None else None
+
+        if forward is None or backward is None:
+            message_ref[0] += ' gave up on too many partial paths'
+            return best_path
+
+        forward_by_exit: dict[int, list[StackElement]] = {}
+
+        for s in forward:
+            best_path = _update_best_path(best_path, s, context.end_way)
+            forward_by_exit.setdefault(s.path.keys[-1] ^ 1, []).append(s)
+
+        for b in backward:
+            node: cython.int = b.path.keys[-1]
+
+            for k in range(reverse_offsets[node], reverse_offsets[node + 1]):
+                for s in forward_by_exit.get(reverse_sources[k], ()):
+                    joins += 1
+
+                    if joins > BIDIRECTIONAL_MAX_JOINS:
+                        message_ref[0] += ' gave up on too many joins'
+                        return best_path._replace(valid=BestPath.zero(), iterations=len(forward) + len(backward))
+
+                    candidate = _join_best_path(s, b, reverse_edges[k], context)
+
+                    if best_path.valid.select_best(candidate) is not candidate:
+                        continue
+
+                    # the forward part is a search state already, only the backward part is replayed
+                    replays += 1
+                    nodes = path_to_tuple(b.path)[::-1]
+                    states = _replay_path(context, s, nodes)
+
+                    if len(states) == len(nodes):
+                        best_path = _update_best_path(best_path, states[-1], context.end_way)
+
+        message_ref[0] += (
+            f' with {len(forward)} forward and {len(backward)} backward paths ({joins} joins, {replays} replays)'
+        )
+
+    return best_path._replace(iterations=len(forward) + len(backward))
+
+
+async def bidirectional_search(
+    graph: CompiledGraph,
+    start_way: cython.int,
+    end_way: cython.int,
+    executor: ProcessPoolExecutor,
+) -> BestPathCollection:
+    context = _make_route_context(graph, end_way)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(bidirectional_worker, context, start_way))
+
+
+def _segment_search(
+    context: RouteContext,
+    s: StackElement,
+    to_end: cython.bint,
+) -> Generator[tuple[StackElement | None, int], None, None]:
+    """
+    Continue the path to the next bus stops (visited directly or from the wrong side), or to the end way,
+    shortest first.
+
+    Every node is expanded once, by its shortest state, for at most SEGMENTED_MAX_ITER states.
+    Yields the continuations with the number of states expanded so far, and finally None.
+    """
+
+    end_way: cython.int = context.end_way
+    served_bus_stops = s.visited_bus_stops | s.almost_visited_bus_stops
+    settled: set[tuple[int, int]] = set()
+    counter = count()
+    heap: list[tuple[float, int, StackElement]] = [(s.length, next(counter), s)]
+    current_iter: cython.int = 0
+
+    while heap and current_iter < SEGMENTED_MAX_ITER:
+        current_iter += 1
+        state = heappop(heap)[2]
+
+        if state is not s:
+            if to_end:
+                if state.path.keys[-1] >> 1 == end_way:
+                    yield state, current_iter
+            elif (state.visited_bus_stops | state.almost_visited_bus_stops) & ~served_bus_stops:
+                yield state, current_iter
+
+        key = (state.path.keys[-1], state.roundabout_enter)
+
+        # bus stops are only searched for before the end way
+        if key in settled or (not to_end and state.after_finish_length > 0):
+            continue
+
+        settled.add(key)
+
+        for child in _expand_stack_element(state, context):
+            heappush(heap, (child.length, next(counter), child))
+
+    yield None, current_iter
+
+
+def segmented_worker(context: RouteContext, start_way: cython.int) -> BestPathCollection:
+    """
+    Route from bus stop to bus stop, always to the nearest one that is not served yet, then to the end way.
+
+    The run time grows with the number of bus stops, not with the length of the route.
+    The segments are searched over the regular search states, so the route follows the same rules
+    as in the other engines. A bus stop is only accepted when the end way is still reachable from it
+    (the route would get stuck in a dead end otherwise), the path to the end way finishes the route.
+    The route may leave out member ways between the bus stops, see calc_bus_route.
+    Returns no valid path when the end way is not reachable.
+    """
+
+    end_way: cython.int = context.end_way
+    best_path = BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero())
+    iterations: cython.int = 0
+    segments: cython.int = 0
+
+    message_ref = ['Segmented worker']
+
+    with print_run_time(message_ref):
+        for s in _init_stack(context, start_way):
+            best_path = _update_best_path(best_path, s, end_way)
+            end, segment_iter = next(_segment_search(context, s, True))
+            iterations += segment_iter
+
+            if end is None:
+                continue
+
+            while True:
+                for candidate, segment_iter in _segment_search(context, s, False):  # noqa: B007
+                    if candidate is None:
+                        break
+
+                    candidate_end, end_iter = next(_segment_search(context, candidate, True))
+                    iterations += end_iter
+
+                    if candidate_end is not None:
+                        break
+
+                iterations += segment_iter
+
+                if candidate is None:
+                    break
+
+                s, end = candidate, candidate_end
+                segments += 1
+                best_path = _update_best_path(best_path, s, end_way)
+
+            best_path = _update_best_path(best_path, end, end_way)
+
+        message_ref[0] += f' with {segments} segments and {iterations} iterations'
+
+    return best_path._replace(iterations=iterations)
+
+
+async def segmented_search(
+    graph: CompiledGraph,
+    start_way: cython.int,
+    end_way: cython.int,
+    executor: ProcessPoolExecutor,
+) -> BestPathCollection:
+    context = _make_route_context(graph, end_way)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(segmented_worker, context, start_way))
+
+
+async def best_first_search(
+    graph: CompiledGraph,
+    start_way: cython.int,
+    end_way: cython.int,
+    executor: ProcessPoolExecutor,
+) -> BestPathCollection:
+    context = _make_route_context(graph, end_way)
+    stack = _init_stack(context, start_way)
+
+    best_path = BestPathCollection(valid=BestPath.zero(), invalid=BestPath.zero())
+
+    # the search is inherently sequential, run it in a single worker process
+    loop = asyncio.get_running_loop()
+    best_path = await loop.run_in_executor(
+        executor,
+        partial(
+            best_first_worker,
+            context,
+            stack,
+            best_path,
+            cpu_budget=BEST_FIRST_CPU_BUDGET,
+        ),
+    )
+
+    return best_path
+
+
+def _path_bus_stops(best_path: BestPath, graph: CompiledGraph) -> list[ElementId]:
+    """
+    List the bus stops of the path in the order of their first visit.
+    """
+
+    result: list[ElementId] = []
+    remaining_visited = best_path.visited_bus_stops
+    remaining_almost_visited = best_path.almost_visited_bus_stops
+
+    for node in path_to_tuple(best_path.path):
+        if not (remaining_visited or remaining_almost_visited):
+            break
+
+        visited_order, almost_visited_order = graph.node_bus_stop_order[node]
+
+        for i in visited_order:
+            if remaining_visited & (bit := 1 << i):
+                remaining_visited &= ~bit
+                result.append(graph.bus_stop_ids[i])
+
+        for i in almost_visited_order:
+            if remaining_almost_visited & (bit := 1 << i):
+                remaining_almost_visited &= ~bit
+                result.append(graph.bus_stop_ids[i])
+
+    return result
+
+
+def finalize_route(
+    best_path: BestPath,
+    graph: CompiledGraph,
+    ways: dict[ElementId, FetchRelationElement],
+    bus_stop_collections: Sequence[FetchRelationBusStopCollection],
+    tags: dict[str, str],
+) -> FinalRoute:
+    route_ways = tuple(
+        FinalRouteWay(
+            way=ways[graph.way_ids[node >> 1]],
+            reversed_latLngs=bool(node & 1),
         )
+        for node in path_to_tuple(best_path.path)
+    )
+
+    route_latlons_gen = (
+        route_way.way.latLngs[::-1] if route_way.reversed_latLngs else route_way.way.latLngs for route_way in route_ways
+    )
+
+    route_latlons = tuple(
+        chain.from_iterable(latlons if i == 0 else latlons[1:] for i, latlons in enumerate(route_latlons_gen))
+    )
+
+    route_latlons_set = set(route_latlons)
+
+    id_collection_map = {collection.best.id: collection for collection in bus_stop_collections}
+
+    route_bus_stops = []
+
+    for stop_id in _path_bus_stops(best_path, graph):
+        collection = id_collection_map[stop_id]
+
+        if collection.stop is not None and collection.stop.latLng not in route_latlons_set:
+            collection = replace(collection, stop=None)
+
+        if collection.platform is None and collection.stop is None:
+            continue
+
+        route_bus_stops.append(collection)
+
+    return FinalRoute(
+        ways=route_ways,
+        latLngs=route_latlons,
+        busStops=tuple(route_bus_stops),
+        tags=tags,
+    )
+
+
+def _reroute_seed(
+    previous: PreviousRoute,
+    graph: CompiledGraph,
+    ways_members: dict[ElementId, FetchRelationElement],
+    start_way: ElementId,
+    end_way: ElementId,
+    bus_stop_collections: Sequence[FetchRelationBusStopCollection],
+    tags: dict[str, str],
+    engine: str,
+) -> RouteSeed | None:
+    """
+    Seed the search with the previous route when only a few member ways have changed since.
+    """
+
+    if (
+        previous.start_way != start_way
+        or previous.end_way != end_way
+        or previous.engine != engine
+        or previous.tags != tags
+        or previous.bus_stop_collections != bus_stop_collections
+    ):
+        return None
+
+    previous_ways = previous.ways_members
+    changed_ways = [
+        way
+        for way_id, way in ways_members.items()
+        if (previous_way := previous_ways.get(way_id)) is None or previous_way.latLngs != way.latLngs
+    ]
+    changed_ways.extend(way for way_id, way in previous_ways.items() if way_id not in ways_members)
+
+    if not changed_ways or len(changed_ways) > REROUTE_MAX_CHANGED_WAYS:
+        return None
+
+    # the graph around the changed ways has changed
+    changed_latlons = set(chain.from_iterable(get_way_endpoints(way.latLngs) for way in changed_ways))
+    nodes: list[int] = []
+    first_changed: cython.int = -1
+
+    for route_way in previous.route.ways:
+        way = route_way.way
+
+        # removed ways stay in the path as a dead end
+        if (way_index := graph.way_index.get(way.id)) is not None:
+            nodes.append(graph_node(way_index, not route_way.reversed_latLngs))
+        else:
+            nodes.append(-1)
+
+        if first_changed == -1 and not changed_latlons.isdisjoint(get_way_endpoints(way.latLngs)):
+            first_changed = len(nodes) - 1
+
+    # the changes are away from the previous route, there is nothing to repair
+    if first_changed == -1 or nodes[0] == -1:
+        return None
+
+    print(f'[DEBUG] Rerouting after {len(changed_ways)} changed ways, from way {first_changed}')
+    prefix_size = max(first_changed - REROUTE_BACKTRACK_WAYS, 1)
+
+    previous_route_way_ids = {route_way.way.id for route_way in previous.route.ways}
+    previous_missing_length = sum(
+        way.length for way_id, way in previous_ways.items() if way_id not in previous_route_way_ids
+    )
+    # the changed ways are traversed (at least once) in their current shape, if they are still members
+    changed_way_ids = {way.id for way in changed_ways}
+    previous_length = sum(
+        route_way.way.length for route_way in previous.route.ways if route_way.way.id not in changed_way_ids
+    )
+    changed_length = sum(ways_members[way_id].length for way_id in changed_way_ids if way_id in ways_members)
+
+    return RouteSeed(
+        nodes=tuple(nodes),
+        prefix_size=prefix_size,
+        rejoin_size=max(first_changed, prefix_size),
+        min_complete_length=sum(graph.way_length) - previous_missing_length,
+        min_bus_stops=len(previous.route.busStops),
+        max_length=(previous_length + changed_length) * (1 + REROUTE_LENGTH_TOLERANCE),
+    )
+
+
+def _is_acceptable_reroute(best_path: BestPath, seed: RouteSeed) -> bool:
+    """
+    Check whether the repaired route is as good as the previous one.
+
+    The repair only searches around the changes, so it can miss the route the full search would find.
+    Accepting a worse route would also carry the loss over to the next changes, it seeds their repair.
+    """
+
+    return (
+        best_path.path is not None
+        and best_path.complete_length >= seed.min_complete_length - 0.1
+        and best_path.bus_stops_count + best_path.almost_bus_stops_count >= seed.min_bus_stops
+        and best_path.length <= seed.max_length
+    )
+
+
+async def calc_bus_route(
+    ways_members: dict[ElementId, FetchRelationElement],
+    start_way: ElementId,
+    end_way: ElementId,
+    bus_stop_collections: Sequence[FetchRelationBusStopCollection],
+    tags: dict[str, str],
+    executor: ProcessPoolExecutor,
+    n_processes: cython.int,
+    engine: str = 'dfs',
+    *,
+    time_limit: float | None = None,
+    on_progress: Callable[[FinalRoute], Awaitable[None]] | None = None,
+    previous: PreviousRoute | None = None,
+    stats: RouteStats | None = None,
+) -> FinalRoute:
+    # imported here, the search workers do not need it (and sklearn is slow to import)
+    from relation_builder import sort_bus_on_path
+
+    with print_run_time('Sorting bus stops'):
+        sorted_buses = sort_bus_on_path(bus_stop_collections, ways_members.values())
+
+    id_sorted_bus_map: dict[ElementId, list[SortedBusEntry]] = {}
+
+    for sorted_bus in sorted_buses:
+        id_sorted_bus_map.setdefault(sorted_bus.neighbor_id, []).append(sorted_bus)
+
+    with print_run_time('Building graph'):
+        graph = compile_graph(build_graph(ways_members), ways_members, id_sorted_bus_map)
+
+    start_way_index = graph.way_index[start_way]
+    end_way_index = graph.way_index[end_way]
+
+    seed = None
+
+    if previous is not None:
+        seed = _reroute_seed(previous, graph, ways_members, start_way, end_way, bus_stop_collections, tags, engine)
+
+    deadline = asyncio.get_running_loop().time() + time_limit if time_limit is not None else None
+    on_best_path_progress = None
+
+    if on_progress is not None:
+
+        async def on_best_path_progress(best_path: BestPath) -> None:
+            await on_progress(finalize_route(best_path, graph, ways_members, bus_stop_collections, tags))
+
+    best_path = None
+    iterations = 0
+
+    if seed is not None:
+        with print_run_time('Rerouting'):
+            reroute_path = await reroute_search(graph, end_way_index, executor, seed)
+            iterations += reroute_path.iterations
+
+            if _is_acceptable_reroute(reroute_path.valid, seed):
+                best_path = reroute_path
+            elif reroute_path.valid.path is not None:
+                print('[DEBUG] Rejected the repaired route, it is worse than the previous one')
+
+    rerouted = best_path is not None
+    message_ref = [f'Calculating route ({engine})']
+
+    with print_run_time(message_ref):
+        if rerouted:
+            pass
+        elif engine == 'dfs':
+            best_path = await modified_dfs(
+                graph,
+                start_way_index,
+                end_way_index,
+                executor,
+                n_processes,
+                deadline=deadline,
+                on_progress=on_best_path_progress,
+            )
+            iterations += best_path.iterations
+        elif engine == 'best_first':
+            best_path = await best_first_search(
+                graph,
+                start_way_index,
+                end_way_index,
+                executor,
+            )
+            iterations += best_path.iterations
+        elif engine == 'segmented':
+            segmented_path = await segmented_search(
+                graph,
+                start_way_index,
+                end_way_index,
+                executor,
+            )
+            iterations += segmented_path.iterations
+
+            if _is_complete_path(segmented_path.valid, _make_route_context(graph, end_way_index)):
+                best_path = segmented_path
+            else:
+                # the segments left out member ways or served bus stops from the wrong side, the global search
+                # improves on their path within a strict time limit, it is exponential on the routes this engine is for
+                fallback_deadline = asyncio.get_running_loop().time() + SEGMENTED_FALLBACK_TIME_LIMIT
+                deadline = min(deadline, fallback_deadline) if deadline is not None else fallback_deadline
+                best_path = await modified_dfs(
+                    graph,
+                    start_way_index,
+                    end_way_index,
+                    executor,
+                    n_processes,
+                    deadline=deadline,
+                    on_progress=on_best_path_progress,
+                    incumbent=segmented_path,
+                )
+                iterations += best_path.iterations
+        elif engine == 'bidirectional':
+            best_path = await bidirectional_search(
+                graph,
+                start_way_index,
+                end_way_index,
+                executor,
+            )
+            iterations += best_path.iterations
+
+            # the engine gave up, or found no valid path
+            if best_path.valid.path is None:
+                best_path = await modified_dfs(
+                    graph,
+                    start_way_index,
+                    end_way_index,
+                    executor,
+                    n_processes,
+                    deadline=deadline,
+                    on_progress=on_best_path_progress,
+                )
+                iterations += best_path.iterations
+        else:
+            raise ValueError(f'Unsupported route engine: {engine!r}')
+
+        message_ref[0] += f' with {iterations} iterations'
+
+    if stats is not None:
+        stats.iterations = iterations
+        stats.rerouted = rerouted
+        stats.deadline_reached = deadline is not None and asyncio.get_running_loop().time() >= deadline
 
-    return finalize_route(best_path, ways_members, bus_stop_collections, tags)
+    return finalize_route(best_path.best(), graph, ways_members, bus_stop_collections, tags)
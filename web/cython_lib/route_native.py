@@ -0,0 +1,708 @@
+from array import array
+from typing import NamedTuple
+
+import cython
+from cython.parallel import prange, threadid
+
+if cython.compiled:
+    from cython.cimports.libc.math import fabs
+    from cython.cimports.libc.stdlib import free, malloc, realloc
+    from cython.cimports.libc.string import memcpy
+
+    print(f'{__name__}: 🐇 compiled')
+else:
+    print(f'{__name__}: 🐌 not compiled')
+
+# the native search needs the compiled build, pure python installs use the process pool
+NATIVE_AVAILABLE: bool = cython.compiled
+
+SYNC_INTERVAL = cython.declare(cython.int, 256)  # iterations
+INITIAL_CAPACITY = cython.declare(cython.int, 64)  # path nodes
+
+
+class NativeGraph(NamedTuple):
+    # see CompiledGraph in route.py
+    offsets: array  # int
+    targets: array  # int
+    edge_length: array  # double
+    edge_angle: array  # double
+    edge_flags: array  # unsigned char
+    way_flags: array  # unsigned char
+    node_intersection: array  # int
+    node_visited_bus_stops: array  # unsigned long long, bus_stop_words per node
+    node_almost_visited_bus_stops: array  # unsigned long long, bus_stop_words per node
+    bus_stop_words: int
+    way_words: int
+    intersections: int
+    end_way: int
+    max_length: float
+    total_length: float
+
+    # search limits, see route.py
+    flag_roundabout: int
+    visited_limit: int
+    max_loop_length: float
+    max_after_finish_length: float
+    max_extra_distance_to_convert: int
+
+
+class NativeStarts(NamedTuple):
+    # unexpanded search states, the fields of StackElement flattened into arrays
+    path_offsets: array  # int, per state + 1
+    path_nodes: array  # int
+    length: array  # double
+    complete_length: array  # double
+    angle_sum: array  # double
+    loop_length: array  # double
+    after_finish_length: array  # double
+    roundabout_enter: array  # int
+    visited_bus_stops: array  # unsigned long long, bus_stop_words per state
+    almost_visited_bus_stops: array  # unsigned long long, bus_stop_words per state
+    complete_path: array  # unsigned long long, way_words per state
+    snapshot_offsets: array  # int, per state + 1
+    snapshot_keys: array  # int
+    snapshot_counts: array  # int
+    snapshot_visits: array  # int
+
+
+Graph = cython.struct(
+    offsets=cython.p_int,
+    targets=cython.p_int,
+    edge_length=cython.p_double,
+    edge_angle=cython.p_double,
+    edge_flags=cython.p_uchar,
+    way_flags=cython.p_uchar,
+    node_intersection=cython.p_int,
+    node_visited=cython.pointer(cython.ulonglong),
+    node_almost=cython.pointer(cython.ulonglong),
+    bus_stop_words=cython.int,
+    way_words=cython.int,
+    intersections=cython.int,
+    end_way=cython.int,
+    max_length=cython.double,
+    total_length=cython.double,
+    flag_roundabout=cython.int,
+    visited_limit=cython.int,
+    max_loop_length=cython.double,
+    max_after_finish_length=cython.double,
+    max_extra_distance_to_convert=cython.int,
+)
+
+Starts = cython.struct(
+    path_offsets=cython.p_int,
+    path_nodes=cython.p_int,
+    length=cython.p_double,
+    complete_length=cython.p_double,
+    angle_sum=cython.p_double,
+    loop_length=cython.p_double,
+    after_finish_length=cython.p_double,
+    roundabout_enter=cython.p_int,
+    visited=cython.pointer(cython.ulonglong),
+    almost=cython.pointer(cython.ulonglong),
+    complete=cython.pointer(cython.ulonglong),
+    snapshot_offsets=cython.p_int,
+    snapshot_keys=cython.p_int,
+    snapshot_counts=cython.p_int,
+    snapshot_visits=cython.p_int,
+)
+
+# one per path node, holds the search state after the node and what to restore on backtracking
+Frame = cython.struct(
+    node=cython.int,
+    length=cython.double,
+    complete_length=cython.double,
+    angle_sum=cython.double,
+    loop_length=cython.double,
+    after_finish_length=cython.double,
+    roundabout_enter=cython.int,
+    bus_stops_count=cython.int,
+    almost_bus_stops_count=cython.int,
+    newly_complete=cython.bint,
+    # next edge to follow, edges are followed in reverse (like popping them from a stack)
+    edge=cython.int,
+    edge_start=cython.int,
+    # intersection entry changed on expansion, -1 if unchanged
+    intersection=cython.int,
+    intersection_visit_count=cython.int,
+    old_count=cython.int,
+    old_visit_count=cython.int,
+)
+
+# see BestPath in route.py
+Score = cython.struct(
+    complete_length=cython.double,
+    length=cython.double,
+    bus_stops_count=cython.int,
+    almost_bus_stops_count=cython.int,
+    angle_sum=cython.double,
+)
+
+Result = cython.struct(
+    iterations=cython.longlong,
+    error=cython.bint,
+    valid_nodes=cython.p_int,
+    valid_size=cython.int,
+    invalid_nodes=cython.p_int,
+    invalid_size=cython.int,
+)
+
+
+@cython.cfunc
+@cython.nogil
+@cython.exceptval(check=False)
+def _popcount(x: cython.ulonglong) -> cython.int:
+    count: cython.int = 0
+
+    while x:
+        x &= x - 1
+        count += 1
+
+    return count
+
+
+@cython.cfunc
+@cython.nogil
+@cython.exceptval(check=False)
+def _is_better(best: Score, other: Score, max_extra_distance_to_convert: cython.int) -> cython.bint:
+    # BestPath.select_best, returns whether other is selected
+    complete_length_diff: cython.double = other.complete_length - best.complete_length
+    if fabs(complete_length_diff) < 0.1:
+        complete_length_diff = 0
+
+    if complete_length_diff > 0:
+        return True
+    if complete_length_diff < 0:
+        return False
+
+    length_diff: cython.double = other.length - best.length
+    if fabs(length_diff) < 0.1:
+        length_diff = 0
+
+    bus_stops_count_diff: cython.int = other.bus_stops_count - best.bus_stops_count
+    almost_bus_stops_count_diff: cython.int = other.almost_bus_stops_count - best.almost_bus_stops_count
+
+    if bus_stops_count_diff and bus_stops_count_diff + almost_bus_stops_count_diff == 0:
+        max_convert_distance: cython.int = max_extra_distance_to_convert * bus_stops_count_diff
+
+        if length_diff < max_convert_distance < 0:
+            return True
+        if 0 < max_convert_distance < length_diff:
+            return False
+
+    if bus_stops_count_diff > 0:
+        return True
+    if bus_stops_count_diff < 0:
+        return False
+
+    if almost_bus_stops_count_diff > 0:
+        return True
+    if almost_bus_stops_count_diff < 0:
+        return False
+
+    if length_diff < 0:
+        return True
+    if length_diff > 0:
+        return False
+
+    return best.angle_sum > other.angle_sum
+
+
+@cython.cfunc
+@cython.nogil
+@cython.exceptval(check=False)
+def _copy_path(
+    frames: cython.pointer(Frame),
+    base: cython.int,
+    depth: cython.int,
+    nodes: cython.pointer(cython.p_int),
+    size: cython.p_int,
+) -> cython.bint:
+    # store the nodes after the starting state
+    new_nodes: cython.p_int = cython.cast(
+        cython.p_int, realloc(nodes[0], (depth - base + 1) * cython.sizeof(cython.int))
+    )
+    k: cython.int
+
+    if new_nodes == cython.NULL:
+        return False
+
+    for k in range(base + 1, depth + 1):
+        new_nodes[k - base - 1] = frames[k].node
+
+    nodes[0] = new_nodes
+    size[0] = depth - base
+    return True
+
+
+@cython.cfunc
+@cython.nogil
+@cython.exceptval(check=False)
+def _search(
+    g: cython.pointer(Graph),
+    st: cython.pointer(Starts),
+    i: cython.int,
+    result: cython.pointer(Result),
+    incumbents: cython.p_double,
+    n_threads: cython.int,
+    slot: cython.int,
+    abort: cython.p_uchar,
+) -> cython.void:
+    """
+    Exhaustive depth-first search from a single starting state, see modified_dfs_worker in route.py.
+
+    The state is updated in place when following an edge and restored when backtracking,
+    so expanding a state allocates nothing.
+    """
+
+    bus_stop_words: cython.int = g.bus_stop_words
+    path_start: cython.int = st.path_offsets[i]
+    base: cython.int = st.path_offsets[i + 1] - path_start - 1
+    capacity: cython.int = base + INITIAL_CAPACITY
+    k: cython.int
+
+    frames: cython.pointer(Frame) = cython.cast(cython.pointer(Frame), malloc(capacity * cython.sizeof(Frame)))
+    visited: cython.pointer(cython.ulonglong) = cython.cast(
+        cython.pointer(cython.ulonglong), malloc(capacity * bus_stop_words * cython.sizeof(cython.ulonglong))
+    )
+    almost: cython.pointer(cython.ulonglong) = cython.cast(
+        cython.pointer(cython.ulonglong), malloc(capacity * bus_stop_words * cython.sizeof(cython.ulonglong))
+    )
+    complete: cython.pointer(cython.ulonglong) = cython.cast(
+        cython.pointer(cython.ulonglong), malloc(g.way_words * cython.sizeof(cython.ulonglong))
+    )
+    snapshot_counts: cython.p_int = cython.cast(cython.p_int, malloc(g.intersections * cython.sizeof(cython.int)))
+    snapshot_visits: cython.p_int = cython.cast(cython.p_int, malloc(g.intersections * cython.sizeof(cython.int)))
+
+    if (
+        frames == cython.NULL
+        or visited == cython.NULL
+        or almost == cython.NULL
+        or complete == cython.NULL
+        or snapshot_counts == cython.NULL
+        or snapshot_visits == cython.NULL
+    ):
+        result.error = True
+        free(frames)
+        free(visited)
+        free(almost)
+        free(complete)
+        free(snapshot_counts)
+        free(snapshot_visits)
+        return
+
+    # restore the starting state
+    for k in range(base + 1):
+        frames[k].node = st.path_nodes[path_start + k]
+
+    f: cython.pointer(Frame) = cython.address(frames[base])
+    f.length = st.length[i]
+    f.complete_length = st.complete_length[i]
+    f.angle_sum = st.angle_sum[i]
+    f.loop_length = st.loop_length[i]
+    f.after_finish_length = st.after_finish_length[i]
+    f.roundabout_enter = st.roundabout_enter[i]
+    f.newly_complete = False
+    f.bus_stops_count = 0
+    f.almost_bus_stops_count = 0
+
+    for k in range(bus_stop_words):
+        visited[base * bus_stop_words + k] = st.visited[i * bus_stop_words + k]
+        almost[base * bus_stop_words + k] = st.almost[i * bus_stop_words + k]
+        f.bus_stops_count += _popcount(st.visited[i * bus_stop_words + k])
+        f.almost_bus_stops_count += _popcount(st.almost[i * bus_stop_words + k])
+
+    memcpy(complete, cython.address(st.complete[i * g.way_words]), g.way_words * cython.sizeof(cython.ulonglong))
+
+    for k in range(g.intersections):
+        snapshot_counts[k] = -1
+        snapshot_visits[k] = 0
+
+    for k in range(st.snapshot_offsets[i], st.snapshot_offsets[i + 1]):
+        snapshot_counts[st.snapshot_keys[k]] = st.snapshot_counts[k]
+        snapshot_visits[st.snapshot_keys[k]] = st.snapshot_visits[k]
+
+    best_valid: Score = Score(complete_length=0, length=0, bus_stops_count=0, almost_bus_stops_count=0, angle_sum=0)
+    best_invalid: Score = best_valid
+    score: Score = best_valid
+
+    incumbent: cython.double = -1
+    for k in range(n_threads):
+        if incumbents[k] > incumbent:
+            incumbent = incumbents[k]
+
+    depth: cython.int = base
+    entering: cython.bint = True
+    iterations: cython.longlong = 0
+    c: cython.pointer(Frame)
+    exit_at_node: cython.int
+    intersection: cython.int
+    bus_stops_count: cython.int
+    edge: cython.int
+    neighbor: cython.int
+    neighbor_way: cython.int
+    current_way_roundabout: cython.bint
+    edge_length: cython.double
+    bound: cython.double
+    word: cython.ulonglong
+    new_frames: cython.pointer(Frame)
+    new_words: cython.pointer(cython.ulonglong)
+
+    while True:
+        f = cython.address(frames[depth])
+
+        if entering:
+            entering = False
+            iterations += 1
+
+            if iterations % SYNC_INTERVAL == 0:
+                if abort[0]:
+                    break
+
+                for k in range(n_threads):
+                    if incumbents[k] > incumbent:
+                        incumbent = incumbents[k]
+
+            f.intersection = -1
+            f.edge = 0
+            f.edge_start = 0
+
+            # the path (and every path it leads to) is less complete than the incumbent
+            bound = f.complete_length + min(g.total_length - f.complete_length, g.max_length - f.length)
+
+            if not (incumbent >= 0 and bound < incumbent - 0.1):
+                score.complete_length = f.complete_length
+                score.length = f.length
+                score.bus_stops_count = f.bus_stops_count
+                score.almost_bus_stops_count = f.almost_bus_stops_count
+                score.angle_sum = f.angle_sum
+
+                if f.node >> 1 == g.end_way:
+                    if _is_better(best_valid, score, g.max_extra_distance_to_convert):
+                        if not _copy_path(
+                            frames, base, depth, cython.address(result.valid_nodes), cython.address(result.valid_size)
+                        ):
+                            result.error = True
+                            break
+
+                        best_valid = score
+
+                        if score.complete_length > incumbent:
+                            incumbent = score.complete_length
+
+                            # every thread writes only its own slot
+                            if incumbent > incumbents[slot]:
+                                incumbents[slot] = incumbent
+                elif _is_better(best_invalid, score, g.max_extra_distance_to_convert):
+                    if not _copy_path(
+                        frames, base, depth, cython.address(result.invalid_nodes), cython.address(result.invalid_size)
+                    ):
+                        result.error = True
+                        break
+
+                    best_invalid = score
+
+                exit_at_node = f.node ^ 1
+                intersection = g.node_intersection[exit_at_node]
+                bus_stops_count = f.bus_stops_count + f.almost_bus_stops_count
+
+                if snapshot_counts[intersection] == -1 or snapshot_counts[intersection] < bus_stops_count:
+                    f.intersection_visit_count = 1
+                elif snapshot_visits[intersection] < g.visited_limit:
+                    f.intersection_visit_count = snapshot_visits[intersection] + 1
+                    bus_stops_count = snapshot_counts[intersection]
+                else:
+                    f.intersection_visit_count = 0
+
+                if f.intersection_visit_count:
+                    f.intersection = intersection
+                    f.old_count = snapshot_counts[intersection]
+                    f.old_visit_count = snapshot_visits[intersection]
+                    snapshot_counts[intersection] = bus_stops_count
+                    snapshot_visits[intersection] = f.intersection_visit_count
+                    f.edge_start = g.offsets[exit_at_node]
+                    f.edge = g.offsets[exit_at_node + 1]
+
+        if f.edge > f.edge_start:
+            f.edge -= 1
+            edge = f.edge
+            neighbor = g.targets[edge]
+            neighbor_way = neighbor >> 1
+            edge_length = g.edge_length[edge]
+
+            if f.length + edge_length > g.max_length:
+                continue
+
+            if depth + 1 >= capacity:
+                capacity *= 2
+                new_frames = cython.cast(cython.pointer(Frame), realloc(frames, capacity * cython.sizeof(Frame)))
+
+                if new_frames == cython.NULL:
+                    result.error = True
+                    break
+
+                frames = new_frames
+                f = cython.address(frames[depth])
+
+                new_words = cython.cast(
+                    cython.pointer(cython.ulonglong),
+                    realloc(visited, capacity * bus_stop_words * cython.sizeof(cython.ulonglong)),
+                )
+
+                if new_words == cython.NULL:
+                    result.error = True
+                    break
+
+                visited = new_words
+                new_words = cython.cast(
+                    cython.pointer(cython.ulonglong),
+                    realloc(almost, capacity * bus_stop_words * cython.sizeof(cython.ulonglong)),
+                )
+
+                if new_words == cython.NULL:
+                    result.error = True
+                    break
+
+                almost = new_words
+
+            c = cython.address(frames[depth + 1])
+            c.length = f.length + edge_length
+
+            # roundabout looping and exits are free
+            current_way_roundabout = g.way_flags[f.node >> 1] & g.flag_roundabout
+
+            if current_way_roundabout:
+                c.angle_sum = f.angle_sum
+            else:
+                c.angle_sum = f.angle_sum + g.edge_angle[edge]
+
+            if f.intersection_visit_count > 1:
+                c.loop_length = f.loop_length + edge_length
+            else:
+                c.loop_length = 0
+
+            # stop path if too long loop
+            if c.loop_length > g.max_loop_length:
+                continue
+
+            if f.after_finish_length > 0 or neighbor_way == g.end_way:
+                c.after_finish_length = f.after_finish_length + edge_length
+            else:
+                c.after_finish_length = 0
+
+            # stop path if too long after finish
+            if c.after_finish_length > g.max_after_finish_length:
+                continue
+
+            if g.edge_flags[edge] & g.flag_roundabout:
+                if f.roundabout_enter != -1:
+                    # stop path if looping in roundabout
+                    if f.roundabout_enter == neighbor:
+                        continue
+
+                    c.roundabout_enter = f.roundabout_enter
+                else:
+                    c.roundabout_enter = neighbor
+            else:
+                c.roundabout_enter = -1
+
+            c.node = neighbor
+            word = cython.cast(cython.ulonglong, 1) << (neighbor_way & 63)
+            c.newly_complete = not (complete[neighbor_way >> 6] & word)
+
+            if c.newly_complete:
+                complete[neighbor_way >> 6] |= word
+                c.complete_length = f.complete_length + edge_length
+            else:
+                c.complete_length = f.complete_length
+
+            c.bus_stops_count = 0
+            c.almost_bus_stops_count = 0
+
+            for k in range(bus_stop_words):
+                word = visited[depth * bus_stop_words + k] | g.node_visited[neighbor * bus_stop_words + k]
+                visited[(depth + 1) * bus_stop_words + k] = word
+                c.bus_stops_count += _popcount(word)
+
+                word = (almost[depth * bus_stop_words + k] | g.node_almost[neighbor * bus_stop_words + k]) & ~word
+                almost[(depth + 1) * bus_stop_words + k] = word
+                c.almost_bus_stops_count += _popcount(word)
+
+            depth += 1
+            entering = True
+            continue
+
+        # backtrack
+        if f.intersection != -1:
+            snapshot_counts[f.intersection] = f.old_count
+            snapshot_visits[f.intersection] = f.old_visit_count
+
+        if depth == base:
+            break
+
+        if f.newly_complete:
+            complete[(f.node >> 1) >> 6] &= ~(cython.cast(cython.ulonglong, 1) << ((f.node >> 1) & 63))
+
+        depth -= 1
+
+    result.iterations = iterations
+
+    free(frames)
+    free(visited)
+    free(almost)
+    free(complete)
+    free(snapshot_counts)
+    free(snapshot_visits)
+
+
+@cython.cfunc
+def _nodes_tuple(nodes: cython.p_int, size: cython.int) -> tuple:
+    if size < 0:
+        return None
+
+    return tuple([nodes[k] for k in range(size)])
+
+
+def native_dfs(
+    graph: NativeGraph,
+    starts: NativeStarts,
+    incumbent: float,
+    n_threads: cython.int,
+    abort: bytearray,
+) -> tuple[int, list[tuple[tuple[int, ...] | None, tuple[int, ...] | None]]]:
+    """
+    Search exhaustively from every starting state, in parallel on n_threads threads without the GIL.
+
+    Returns the total iterations and, per starting state, the nodes following it on the best valid
+    and the best invalid path (None if not found). Setting abort[0] stops the search early.
+    """
+
+    n_starts: cython.int = len(starts.length)
+
+    if not len(graph.targets):
+        # a graph without edges is valid, but the pointers below need an element
+        graph = graph._replace(
+            targets=array('i', (0,)),
+            edge_length=array('d', (0,)),
+            edge_angle=array('d', (0,)),
+            edge_flags=array('B', (0,)),
+        )
+
+    offsets: cython.int[::1] = graph.offsets
+    targets: cython.int[::1] = graph.targets
+    edge_length: cython.double[::1] = graph.edge_length
+    edge_angle: cython.double[::1] = graph.edge_angle
+    edge_flags: cython.uchar[::1] = graph.edge_flags
+    way_flags: cython.uchar[::1] = graph.way_flags
+    node_intersection: cython.int[::1] = graph.node_intersection
+    node_visited: cython.ulonglong[::1] = graph.node_visited_bus_stops
+    node_almost: cython.ulonglong[::1] = graph.node_almost_visited_bus_stops
+
+    path_offsets: cython.int[::1] = starts.path_offsets
+    path_nodes: cython.int[::1] = starts.path_nodes
+    length: cython.double[::1] = starts.length
+    complete_length: cython.double[::1] = starts.complete_length
+    angle_sum: cython.double[::1] = starts.angle_sum
+    loop_length: cython.double[::1] = starts.loop_length
+    after_finish_length: cython.double[::1] = starts.after_finish_length
+    roundabout_enter: cython.int[::1] = starts.roundabout_enter
+    visited: cython.ulonglong[::1] = starts.visited_bus_stops
+    almost: cython.ulonglong[::1] = starts.almost_visited_bus_stops
+    complete: cython.ulonglong[::1] = starts.complete_path
+    snapshot_offsets: cython.int[::1] = starts.snapshot_offsets
+    snapshot_keys: cython.int[::1] = starts.snapshot_keys
+    snapshot_counts: cython.int[::1] = starts.snapshot_counts
+    snapshot_visits: cython.int[::1] = starts.snapshot_visits
+
+    incumbents: cython.double[::1] = array('d', (incumbent,) * n_threads)
+    abort_flag: cython.uchar[::1] = abort
+
+    if not n_starts:
+        return 0, []
+
+    g: Graph = Graph(
+        offsets=cython.address(offsets[0]),
+        targets=cython.address(targets[0]),
+        edge_length=cython.address(edge_length[0]),
+        edge_angle=cython.address(edge_angle[0]),
+        edge_flags=cython.address(edge_flags[0]),
+        way_flags=cython.address(way_flags[0]),
+        node_intersection=cython.address(node_intersection[0]),
+        node_visited=cython.address(node_visited[0]),
+        node_almost=cython.address(node_almost[0]),
+        bus_stop_words=graph.bus_stop_words,
+        way_words=graph.way_words,
+        intersections=graph.intersections,
+        end_way=graph.end_way,
+        max_length=graph.max_length,
+        total_length=graph.total_length,
+        flag_roundabout=graph.flag_roundabout,
+        visited_limit=graph.visited_limit,
+        max_loop_length=graph.max_loop_length,
+        max_after_finish_length=graph.max_after_finish_length,
+        max_extra_distance_to_convert=graph.max_extra_distance_to_convert,
+    )
+    st: Starts = Starts(
+        path_offsets=cython.address(path_offsets[0]),
+        path_nodes=cython.address(path_nodes[0]),
+        length=cython.address(length[0]),
+        complete_length=cython.address(complete_length[0]),
+        angle_sum=cython.address(angle_sum[0]),
+        loop_length=cython.address(loop_length[0]),
+        after_finish_length=cython.address(after_finish_length[0]),
+        roundabout_enter=cython.address(roundabout_enter[0]),
+        visited=cython.address(visited[0]),
+        almost=cython.address(almost[0]),
+        complete=cython.address(complete[0]),
+        snapshot_offsets=cython.address(snapshot_offsets[0]),
+        snapshot_keys=cython.address(snapshot_keys[0]),
+        snapshot_counts=cython.address(snapshot_counts[0]),
+        snapshot_visits=cython.address(snapshot_visits[0]),
+    )
+
+    g_ptr: cython.pointer(Graph) = cython.address(g)
+    st_ptr: cython.pointer(Starts) = cython.address(st)
+    incumbents_ptr: cython.p_double = cython.address(incumbents[0])
+    abort_ptr: cython.p_uchar = cython.address(abort_flag[0])
+    results: cython.pointer(Result) = cython.cast(cython.pointer(Result), malloc(n_starts * cython.sizeof(Result)))
+
+    if results == cython.NULL:
+        raise MemoryError
+
+    i: cython.int
+
+    for i in range(n_starts):
+        results[i] = Result(
+            iterations=0,
+            error=False,
+            valid_nodes=cython.NULL,
+            valid_size=-1,
+            invalid_nodes=cython.NULL,
+            invalid_size=-1,
+        )
+
+    try:
+        for i in prange(n_starts, nogil=True, schedule='dynamic', chunksize=1, num_threads=n_threads):
+            _search(g_ptr, st_ptr, i, cython.address(results[i]), incumbents_ptr, n_threads, threadid(), abort_ptr)
+
+        iterations = 0
+        paths = []
+
+        for i in range(n_starts):
+            if results[i].error:
+                raise MemoryError
+
+            iterations += results[i].iterations
+            paths.append(
+                (
+                    _nodes_tuple(results[i].valid_nodes, results[i].valid_size),
+                    _nodes_tuple(results[i].invalid_nodes, results[i].invalid_size),
+                )
+            )
+    finally:
+        for i in range(n_starts):
+            free(results[i].valid_nodes)
+            free(results[i].invalid_nodes)
+
+        free(results)
+
+    return iterations, paths
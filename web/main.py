@@ -1,7 +1,10 @@
 import asyncio
-from concurrent.futures import ProcessPoolExecutor
+import time
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, replace
+from functools import partial
 from itertools import chain
+from pathlib import Path
 
 from authlib.integrations.httpx_client import AsyncOAuth2Client
 from dacite import Config, from_dict
@@ -18,8 +21,20 @@ from starlette.websockets import WebSocketState
 
 from compression import deflate_compress, deflate_decompress
 from config import (
+    CALC_ROUTE_ANYTIME,
+    CALC_ROUTE_ANYTIME_TIMEOUT,
+    CALC_ROUTE_CACHE_SIZE,
+    CALC_ROUTE_CACHE_TTL,
+    CALC_ROUTE_ENGINE,
     CALC_ROUTE_MAX_PROCESSES,
+    CALC_ROUTE_MAX_REQUESTS,
     CALC_ROUTE_N_PROCESSES,
+    CALC_ROUTE_QUEUE_TIMEOUT,
+    CALC_ROUTE_RECORD_DIR,
+    CALC_ROUTE_REROUTE,
+    CALC_ROUTE_TIMEOUT,
+    CALC_ROUTE_WORKER_MAX_RSS,
+    CALC_ROUTE_WORKER_MAX_TASKS,
     CREATED_BY,
     OSM_CLIENT,
     OSM_SCOPES,
@@ -28,7 +43,7 @@ from config import (
     USER_AGENT,
     WEBSITE,
 )
-from cython_lib.route import calc_bus_route
+from cython_lib.route import PreviousRoute, RouteStats, calc_bus_route
 from deflate_middleware import DeflateRoute
 from models.download_history import Cell, DownloadHistory
 from models.element_id import ElementId
@@ -44,25 +59,47 @@ from models.final_route import FinalRoute, WarningSeverity
 from openstreetmap import OpenStreetMap
 from overpass import Overpass
 from relation_builder import build_osm_change, get_relation_members, sort_and_upgrade_members
+from route_cache import RouteCache, route_fingerprint
+from route_pool import RoutePool
+from route_scheduler import RouteQueueTimeoutError, RouteScheduler
 from route_warnings import check_for_issues
 from user_session import fetch_user_details, require_user_details, require_user_token, set_user_token, unset_user_token
-from utils import print_run_time
+from utils import close_http_clients, http_client_stats, print_run_time, single_flight_stats
 
 INDEX_REDIRECT = RedirectResponse('/', status_code=status.HTTP_302_FOUND)
 
 _json_decode = Decoder().decode
 _json_encode = Encoder(decimal_format='number').encode
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # the first route calculation after a deploy should not wait for the workers to start
+    await route_pool.start()
+
+    try:
+        yield
+    finally:
+        route_pool.shutdown()
+        await close_http_clients()
+
+
+app = FastAPI(lifespan=lifespan)
 app.router.route_class = DeflateRoute
 app.add_middleware(SessionMiddleware, secret_key=SECRET, max_age=31536000)  # 1 year
 app.mount('/static', StaticFiles(directory='static', html=True), name='static')
 
 templates = Jinja2Templates(directory='templates')
 
-process_executor = ProcessPoolExecutor(CALC_ROUTE_MAX_PROCESSES)
+route_pool = RoutePool(
+    max_workers=CALC_ROUTE_MAX_PROCESSES,
+    max_tasks=CALC_ROUTE_WORKER_MAX_TASKS,
+    max_rss=CALC_ROUTE_WORKER_MAX_RSS,
+)
 openstreetmap = OpenStreetMap()
 overpass = Overpass()
+route_cache = RouteCache(maxsize=CALC_ROUTE_CACHE_SIZE, ttl=CALC_ROUTE_CACHE_TTL)
+route_scheduler = RouteScheduler(max_running=CALC_ROUTE_MAX_REQUESTS, queue_timeout=CALC_ROUTE_QUEUE_TIMEOUT)
 
 
 @app.get('/')
@@ -158,7 +195,9 @@ async def post_query(model: PostQueryModel, _=Depends(require_user_details)):
         download_targets = None
 
     with print_run_time('Querying relation data'):
-        query_task = asyncio.create_task(overpass.query_relation(model.relationId, download_hist, download_targets))
+        query_task = asyncio.create_task(
+            overpass.query_relation(model.relationId, download_hist, download_targets, reload=model.reload)
+        )
         get_task = asyncio.create_task(openstreetmap.get_relation(model.relationId))
 
         try:
@@ -207,14 +246,61 @@ class PostCalcBusRouteModel:
     tags: dict[str, str]
 
 
+async def postprocess_route(model: PostCalcBusRouteModel, relation_task: asyncio.Task, route: FinalRoute) -> FinalRoute:
+    relation_members = get_relation_members(await relation_task)
+
+    ways_members = {way_id: way for way_id, way in model.ways.items() if way.member}
+    ways_non_members = {way_id: way for way_id, way in model.ways.items() if not way.member}
+
+    route = replace(route, extraWaysToUpdate=tuple(ways_non_members.values()))
+    route = sort_and_upgrade_members(route, relation_members)
+
+    return check_for_issues(
+        route=route,
+        ways=ways_members,
+        start_way=model.startWay,
+        end_way=model.stopWay,
+        bus_stop_collections=model.busStops,
+        relation_members=relation_members,
+    )
+
+
+async def send_provisional_route(
+    ws: WebSocket,
+    model: PostCalcBusRouteModel,
+    relation_task: asyncio.Task,
+    route: FinalRoute,
+) -> None:
+    route = await postprocess_route(model, relation_task, route)
+    route = replace(route, provisional=True)
+    await ws.send_bytes(deflate_compress(_json_encode(route)))
+
+
+async def send_queue_position(ws: WebSocket, position: int) -> None:
+    await ws.send_bytes(deflate_compress(_json_encode({'queuePosition': position})))
+
+
+def record_calc_bus_route(body: bytes) -> None:
+    # the body is stored as received (deflate-compressed), see benchmarks/route.py
+    path = Path(CALC_ROUTE_RECORD_DIR, f'{time.time_ns()}.json.deflate')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(body)
+
+
 @app.websocket('/ws/calc_bus_route')
-async def post_calc_bus_route(ws: WebSocket, _=Depends(require_user_details)):
+async def post_calc_bus_route(ws: WebSocket, user=Depends(require_user_details)):
     await ws.accept()
 
+    # the previous route of this connection, the next one is most likely a small edit of it
+    previous_route: PreviousRoute | None = None
+
     try:
         while True:
             body = await ws.receive_bytes()
 
+            if CALC_ROUTE_RECORD_DIR:
+                record_calc_bus_route(body)
+
             with start_span(op='websocket.function', description='calc_bus_route'):
                 body = deflate_decompress(body)
                 json: dict = _json_decode(body)
@@ -230,7 +316,6 @@ async def post_calc_bus_route(ws: WebSocket, _=Depends(require_user_details)):
                 assert all(way_id == way.id for way_id, way in model.ways.items()), 'Way ids must match'
 
                 ways_members = {way_id: way for way_id, way in model.ways.items() if way.member}
-                ways_non_members = {way_id: way for way_id, way in model.ways.items() if not way.member}
 
                 assert ways_members, 'No ways are members of the relation'
 
@@ -241,47 +326,94 @@ async def post_calc_bus_route(ws: WebSocket, _=Depends(require_user_details)):
                     collection.stop.member for collection in model.busStops if collection.stop
                 ), 'All bus stops must be members of the relation'
 
-                try:
-                    async with asyncio.TaskGroup() as tg:
-                        get_task = tg.create_task(openstreetmap.get_relation(model.relationId))
-                        route_task = tg.create_task(
-                            asyncio.wait_for(
-                                calc_bus_route(
-                                    ways_members,
-                                    model.startWay,
-                                    model.stopWay,
-                                    model.busStops,
-                                    model.tags,
-                                    process_executor,
-                                    n_processes=CALC_ROUTE_N_PROCESSES,
-                                ),
-                                timeout=3,
+                route_key = route_fingerprint(
+                    ways_members,
+                    model.startWay,
+                    model.stopWay,
+                    model.busStops,
+                    model.tags,
+                    CALC_ROUTE_ENGINE,
+                )
+
+                if (route := route_cache.get(route_key)) is not None:
+                    print(f'[CACHE] Reusing bus route ({route_cache.hits} hits, {route_cache.misses} misses)')
+                    get_task = asyncio.create_task(openstreetmap.get_relation(model.relationId))
+                else:
+                    if CALC_ROUTE_ANYTIME:
+                        # the search stops by itself at the deadline, the margin covers graph building
+                        search_time_limit = CALC_ROUTE_ANYTIME_TIMEOUT
+                        route_timeout = CALC_ROUTE_ANYTIME_TIMEOUT + CALC_ROUTE_TIMEOUT
+                    else:
+                        search_time_limit = None
+                        route_timeout = CALC_ROUTE_TIMEOUT
+
+                    route_stats = RouteStats()
+
+                    try:
+                        # the calculation time limits only start once the calculation is admitted
+                        async with (
+                            route_scheduler.slot(user['id'], partial(send_queue_position, ws)),
+                            route_pool.lease() as executor,
+                            asyncio.TaskGroup() as tg,
+                        ):
+                            get_task = tg.create_task(openstreetmap.get_relation(model.relationId))
+                            route_task = tg.create_task(
+                                asyncio.wait_for(
+                                    calc_bus_route(
+                                        ways_members,
+                                        model.startWay,
+                                        model.stopWay,
+                                        model.busStops,
+                                        model.tags,
+                                        executor,
+                                        n_processes=CALC_ROUTE_N_PROCESSES,
+                                        engine=CALC_ROUTE_ENGINE,
+                                        time_limit=search_time_limit,
+                                        on_progress=(
+                                            partial(send_provisional_route, ws, model, get_task)
+                                            if CALC_ROUTE_ANYTIME
+                                            else None
+                                        ),
+                                        previous=previous_route if CALC_ROUTE_REROUTE else None,
+                                        stats=route_stats,
+                                    ),
+                                    timeout=route_timeout,
+                                )
                             )
-                        )
 
-                except TimeoutError as e:
-                    raise HTTPException(status.HTTP_408_REQUEST_TIMEOUT, 'Route calculation timed out') from e
+                    except RouteQueueTimeoutError as e:
+                        raise HTTPException(
+                            status.HTTP_503_SERVICE_UNAVAILABLE, 'Route calculation queue timed out'
+                        ) from e
+                    except TimeoutError as e:
+                        raise HTTPException(status.HTTP_408_REQUEST_TIMEOUT, 'Route calculation timed out') from e
 
-                relation = get_task.result()
-                relation_members = get_relation_members(relation)
+                    route = route_task.result()
 
-                route = route_task.result()
-                route = replace(route, extraWaysToUpdate=tuple(ways_non_members.values()))
-                route = sort_and_upgrade_members(route, relation_members)
+                    # a repaired route depends on the previous one, not only on the request,
+                    # and a route cut short by the anytime deadline may be improved on the next request
+                    if not route_stats.rerouted and not route_stats.deadline_reached:
+                        route_cache.set(route_key, route)
 
-                final_route = check_for_issues(
-                    route=route,
-                    ways=ways_members,
+                previous_route = PreviousRoute(
+                    ways_members=ways_members,
                     start_way=model.startWay,
                     end_way=model.stopWay,
                     bus_stop_collections=model.busStops,
-                    relation_members=relation_members,
+                    tags=model.tags,
+                    engine=CALC_ROUTE_ENGINE,
+                    route=route,
                 )
 
+                final_route = await postprocess_route(model, get_task, route)
+
                 body = _json_encode(final_route)
                 body = deflate_compress(body)
                 await ws.send_bytes(body)
 
+                # replace the workers bloated by the calculation, after the response is sent
+                await route_pool.check()
+
     except WebSocketDisconnect:
         pass
     finally:
@@ -289,6 +421,19 @@ async def post_calc_bus_route(ws: WebSocket, _=Depends(require_user_details)):
             await ws.close(1011)
 
 
+@app.get('/stats')
+async def get_stats(_=Depends(require_user_details)):
+    return {
+        'route_cache': route_cache.stats(),
+        'route_scheduler': route_scheduler.stats(),
+        'route_pool': route_pool.stats(),
+        'http_clients': http_client_stats(),
+        'overpass_cache': overpass.cell_cache.stats(),
+        'overpass_endpoints': overpass.client.stats(),
+        'single_flight': single_flight_stats(),
+    }
+
+
 class PostDownloadOsmChangeModel(BaseModel):
     relationId: int
     route: dict
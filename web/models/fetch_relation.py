@@ -8,6 +8,7 @@ from cython_lib.geoutils import haversine_distance
 from models.bounding_box import BoundingBox
 from models.download_history import Cell, DownloadHistory
 from models.element_id import ElementId, element_id
+from models.overpass_element import OverpassTaggedElement
 from utils import normalize_name
 
 
@@ -86,9 +87,9 @@ class FetchRelationBusStop:
         return f'{self.type}/{self.id}'
 
     @classmethod
-    def from_data(cls, data: dict) -> Self:
-        name: str = data['tags'].get('name', '').strip()
-        local_ref: str = data['tags'].get('local_ref', '').strip()
+    def from_data(cls, data: OverpassTaggedElement) -> Self:
+        name: str = data.tags.get('name', '').strip()
+        local_ref: str = data.tags.get('local_ref', '').strip()
 
         # ignore local_ref if it's already part of the name
         if name and local_ref and name.endswith(local_ref):
@@ -99,15 +100,15 @@ class FetchRelationBusStop:
         group_name = normalize_name(name, lower=True, special=True, number=True)
 
         return cls(
-            id=element_id(data['id']),
-            type=data['type'],
+            id=element_id(data.id),
+            type=data.type,
             member=None,
-            latLng=(data['lat'], data['lon']),
-            tags=data['tags'],
+            latLng=data.lat_lon,
+            tags=data.tags,
             name=name,
             groupName=group_name,
-            highway=data['tags'].get('highway', None),
-            public_transport=PublicTransport(data['tags']['public_transport']),
+            highway=data.tags.get('highway', None),
+            public_transport=PublicTransport(data.tags['public_transport']),
         )
 
 
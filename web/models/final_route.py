@@ -38,6 +38,9 @@ class FinalRoute:
 
     warnings: tuple[FinalRouteWarning, ...] = None
 
+    # best route found so far, a better one is still being calculated
+    provisional: bool = False
+
     @property
     def roundtrip(self) -> bool:
         return self.tags.get('roundtrip', 'no') == 'yes'
@@ -0,0 +1,81 @@
+from typing import ClassVar
+
+from msgspec import Struct
+
+
+class OverpassBounds(Struct, frozen=True):
+    minlat: float
+    minlon: float
+    maxlat: float
+    maxlon: float
+
+
+class OverpassCenter(Struct, frozen=True):
+    lat: float
+    lon: float
+
+
+class OverpassMember(Struct, frozen=True):
+    type: str
+    ref: int
+    role: str
+
+
+class _OverpassElement(Struct, tag_field='type', omit_defaults=True):
+    pass
+
+
+class OverpassNode(_OverpassElement, tag='node'):
+    type: ClassVar[str] = 'node'
+
+    id: int
+    lat: float
+    lon: float
+    tags: dict[str, str] = {}
+
+    @property
+    def lat_lon(self) -> tuple[float, float]:
+        return self.lat, self.lon
+
+
+class OverpassWay(_OverpassElement, tag='way'):
+    type: ClassVar[str] = 'way'
+
+    id: int
+    nodes: list[int] = []
+    tags: dict[str, str] = {}
+    center: OverpassCenter | None = None
+    bounds: OverpassBounds | None = None
+
+    @property
+    def lat_lon(self) -> tuple[float, float]:
+        return self.center.lat, self.center.lon
+
+
+class OverpassRelation(_OverpassElement, tag='relation'):
+    type: ClassVar[str] = 'relation'
+
+    id: int
+    members: list[OverpassMember] = []
+    tags: dict[str, str] = {}
+    center: OverpassCenter | None = None
+
+    @property
+    def lat_lon(self) -> tuple[float, float]:
+        return self.center.lat, self.center.lon
+
+
+class OverpassCount(_OverpassElement, tag='count'):
+    pass
+
+
+OverpassElement = OverpassNode | OverpassWay | OverpassRelation | OverpassCount
+OverpassTaggedElement = OverpassNode | OverpassWay | OverpassRelation
+
+
+class OverpassResponse(Struct):
+    """
+    Overpass JSON response, fields not read by the application are skipped while decoding.
+    """
+
+    elements: list[OverpassElement]
@@ -8,7 +8,8 @@ from authlib.integrations.httpx_client import OAuth2Auth
 from cachetools import TTLCache
 
 from config import CHANGESET_ID_PLACEHOLDER, TAG_MAX_LENGTH
-from utils import ensure_list, get_http_client
+from osm_extract import get_osm_extract
+from utils import ensure_list, get_http_client, single_flight
 
 
 @dataclass(frozen=True, kw_only=True, slots=True)
@@ -28,13 +29,16 @@ class OpenStreetMap:
         else:
             self.auth = None
 
+        # only the reads, changes are always uploaded to the api
+        self.extract = get_osm_extract()
+
     def _get_http_client(self) -> httpx.AsyncClient:
-        return get_http_client('https://api.openstreetmap.org/api', auth=self.auth)
+        return get_http_client('https://api.openstreetmap.org/api')
 
     async def get_changeset_maxsize(self) -> int:
-        async with self._get_http_client() as http:
-            r = await http.get('/capabilities')
-            r.raise_for_status()
+        http = self._get_http_client()
+        r = await http.get('/capabilities', auth=self.auth)
+        r.raise_for_status()
 
         caps = xmltodict.parse(r.text)
 
@@ -59,26 +63,36 @@ class OpenStreetMap:
         return await self._get_elements('nodes', node_ids, json=json)
 
     @cached(TTLCache(maxsize=1024, ttl=60))
+    @single_flight
     async def _get_elements(self, elements_type: str, element_ids: Iterable[str], json: bool) -> list[dict]:
-        async with self._get_http_client() as http:
+        if self.extract is not None:
+            if json:
+                return await self.extract.get_elements(elements_type, element_ids)
+
+            text = await self.extract.get_elements_xml(elements_type, element_ids)
+        else:
+            http = self._get_http_client()
             r = await http.get(
                 f'/0.6/{elements_type}{".json" if json else ""}',
                 params={elements_type: ','.join(map(str, element_ids))},
+                auth=self.auth,
             )
             r.raise_for_status()
 
-        if json:
-            return r.json()['elements']
-        else:
-            return ensure_list(xmltodict.parse(r.text)['osm'][elements_type[:-1]])
+            if json:
+                return r.json()['elements']
+
+            text = r.text
+
+        return ensure_list(xmltodict.parse(text)['osm'][elements_type[:-1]])
 
     async def get_authorized_user(self) -> dict | None:
         if self.auth is None:
             return None
 
-        async with self._get_http_client() as http:
-            r = await http.get('/0.6/user/details.json')
-            r.raise_for_status()
+        http = self._get_http_client()
+        r = await http.get('/0.6/user/details.json', auth=self.auth)
+        r.raise_for_status()
 
         return r.json()['user']
 
@@ -117,29 +131,31 @@ class OpenStreetMap:
 
         changeset = xmltodict.unparse(changeset_dict)
 
-        async with self._get_http_client() as http:
-            r = await http.put(
-                '/0.6/changeset/create',
-                content=changeset,
-                headers={'Content-Type': 'text/xml; charset=utf-8'},
-                follow_redirects=False,
-            )
-            r.raise_for_status()
+        http = self._get_http_client()
+        r = await http.put(
+            '/0.6/changeset/create',
+            content=changeset,
+            headers={'Content-Type': 'text/xml; charset=utf-8'},
+            auth=self.auth,
+            follow_redirects=False,
+        )
+        r.raise_for_status()
 
-            changeset_id_raw = r.text
-            changeset_id = int(changeset_id_raw)
+        changeset_id_raw = r.text
+        changeset_id = int(changeset_id_raw)
 
-            osm_change = osm_change.replace(CHANGESET_ID_PLACEHOLDER, changeset_id_raw)
+        osm_change = osm_change.replace(CHANGESET_ID_PLACEHOLDER, changeset_id_raw)
 
-            upload_resp = await http.post(
-                f'/0.6/changeset/{changeset_id_raw}/upload',
-                content=osm_change,
-                headers={'Content-Type': 'text/xml; charset=utf-8'},
-                timeout=150,
-            )
+        upload_resp = await http.post(
+            f'/0.6/changeset/{changeset_id_raw}/upload',
+            content=osm_change,
+            headers={'Content-Type': 'text/xml; charset=utf-8'},
+            auth=self.auth,
+            timeout=150,
+        )
 
-            r = await http.put(f'/0.6/changeset/{changeset_id_raw}/close')
-            r.raise_for_status()
+        r = await http.put(f'/0.6/changeset/{changeset_id_raw}/close', auth=self.auth)
+        r.raise_for_status()
 
         if not upload_resp.is_success:
             return UploadResult(
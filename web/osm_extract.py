@@ -0,0 +1,583 @@
+"""
+Local OSM data backend, answering the Overpass and OSM API reads from an extract.
+
+The extract is imported from an .osm.pbf file into a sqlite database, with R*Tree indexes
+over the elements bounding boxes. Importing requires the optional osmium package.
+
+Usage (from the web directory): python -m osm_extract <input.osm.pbf> <output.db>
+"""
+
+import asyncio
+import sqlite3
+import sys
+from collections.abc import Iterable, Sequence
+from contextlib import closing
+from datetime import UTC
+from functools import cache
+from itertools import pairwise
+from pathlib import Path
+from xml.etree.ElementTree import Element, SubElement, tostring
+
+import httpx
+from msgspec.msgpack import Decoder, Encoder
+
+from config import DOWNLOAD_RELATION_GRID_CELL_EXPAND, OSM_EXTRACT_PATH
+from models.bounding_box import BoundingBox
+from models.download_history import Cell
+from models.overpass_element import (
+    OverpassBounds,
+    OverpassCenter,
+    OverpassCount,
+    OverpassElement,
+    OverpassMember,
+    OverpassNode,
+    OverpassRelation,
+    OverpassWay,
+)
+from utils import print_run_time
+
+_IMPORT_BATCH_SIZE = 100_000
+_QUERY_BATCH_SIZE = 10_000  # below the sqlite variables limit
+
+_OSMIUM_MEMBER_TYPES = {'n': 'node', 'w': 'way', 'r': 'relation'}
+
+_SCHEMA = (
+    'CREATE TABLE node (id INTEGER PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL, meta BLOB NOT NULL, tags BLOB)',
+    'CREATE TABLE way (id INTEGER PRIMARY KEY, meta BLOB NOT NULL, nodes BLOB NOT NULL, tags BLOB)',
+    'CREATE TABLE relation (id INTEGER PRIMARY KEY, meta BLOB NOT NULL, members BLOB NOT NULL, tags BLOB)',
+    'CREATE TABLE member (type TEXT NOT NULL, ref INTEGER NOT NULL, relation_id INTEGER NOT NULL)',
+    # tagged nodes only, the untagged ones are only queried by id
+    'CREATE VIRTUAL TABLE node_index USING rtree(id, minlat, maxlat, minlon, maxlon)',
+    'CREATE VIRTUAL TABLE way_index USING rtree(id, minlat, maxlat, minlon, maxlon)',
+    'CREATE VIRTUAL TABLE relation_index USING rtree(id, minlat, maxlat, minlon, maxlon)',
+)
+
+_msgpack_encode = Encoder().encode
+_meta_decode = Decoder(tuple[int, str, int, int, str]).decode  # version, timestamp, changeset, uid, user
+_tags_decode = Decoder(dict[str, str]).decode
+_nodes_decode = Decoder(list[int]).decode
+_members_decode = Decoder(list[tuple[str, int, str]]).decode
+
+
+def _decode_tags(data: bytes | None) -> dict[str, str]:
+    return _tags_decode(data) if data is not None else {}
+
+
+def _segment_intersects(bb: BoundingBox, a: tuple[float, float], b: tuple[float, float]) -> bool:
+    # liang-barsky clipping of the segment to the bounding box
+    t0, t1 = 0.0, 1.0
+    dlat = b[0] - a[0]
+    dlon = b[1] - a[1]
+
+    for p, q in (
+        (-dlat, a[0] - bb.minlat),
+        (dlat, bb.maxlat - a[0]),
+        (-dlon, a[1] - bb.minlon),
+        (dlon, bb.maxlon - a[1]),
+    ):
+        if p == 0:
+            if q < 0:
+                return False
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+
+        if t0 > t1:
+            return False
+
+    return True
+
+
+def _bb_params(bb: BoundingBox) -> tuple[float, float, float, float]:
+    # index rows overlapping the bounding box
+    return bb.minlat, bb.maxlat, bb.minlon, bb.maxlon
+
+
+_OVERLAPS = 'i.maxlat >= ? AND i.minlat <= ? AND i.maxlon >= ? AND i.minlon <= ?'
+
+
+class _Query:
+    """
+    Single read of the extract, remembering the node locations it has loaded.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._locations: dict[int, tuple[float, float]] = {}
+
+    def locations(self, node_ids: Iterable[int]) -> dict[int, tuple[float, float]]:
+        missing = tuple({n for n in node_ids if n not in self._locations})
+
+        for i in range(0, len(missing), _QUERY_BATCH_SIZE):
+            batch = missing[i : i + _QUERY_BATCH_SIZE]
+            rows = self.conn.execute(
+                f'SELECT id, lat, lon FROM node WHERE id IN ({",".join("?" * len(batch))})',  # noqa: S608
+                batch,
+            )
+            self._locations.update((node_id, (lat, lon)) for node_id, lat, lon in rows)
+
+        return self._locations
+
+    def way_intersects(self, bb: BoundingBox, node_ids: Sequence[int]) -> bool:
+        locations = self.locations(node_ids)
+        points = [locations[n] for n in node_ids if n in locations]
+
+        if len(points) == 1:
+            return _segment_intersects(bb, points[0], points[0])
+
+        return any(_segment_intersects(bb, a, b) for a, b in pairwise(points))
+
+    def relation_intersects(self, bb: BoundingBox, members: Iterable[tuple[str, int, str]]) -> bool:
+        node_ids = [ref for type, ref, _ in members if type == 'node']
+        locations = self.locations(node_ids)
+
+        if any(_segment_intersects(bb, locations[n], locations[n]) for n in node_ids if n in locations):
+            return True
+
+        way_ids = [ref for type, ref, _ in members if type == 'way']
+        return any(self.way_intersects(bb, nodes) for _, nodes, _ in self.ways(way_ids))
+
+    def nodes(self, node_ids: Iterable[int]) -> list[tuple[int, float, float, bytes | None]]:
+        return self._by_id('SELECT id, lat, lon, tags FROM node', node_ids)
+
+    def ways(self, way_ids: Iterable[int]) -> list[tuple[int, list[int], bytes | None]]:
+        rows = self._by_id('SELECT id, nodes, tags FROM way', way_ids)
+        return [(way_id, _nodes_decode(nodes), tags) for way_id, nodes, tags in rows]
+
+    def relations(self, relation_ids: Iterable[int]) -> list[tuple[int, list[tuple[str, int, str]], bytes | None]]:
+        rows = self._by_id('SELECT id, members, tags FROM relation', relation_ids)
+        return [(relation_id, _members_decode(members), tags) for relation_id, members, tags in rows]
+
+    def _by_id(self, select: str, ids: Iterable[int]) -> list[tuple]:
+        ids = tuple(sorted(set(ids)))
+        result = []
+
+        for i in range(0, len(ids), _QUERY_BATCH_SIZE):
+            batch = ids[i : i + _QUERY_BATCH_SIZE]
+            result.extend(self.conn.execute(f'{select} WHERE id IN ({",".join("?" * len(batch))})', batch))
+
+        result.sort()
+        return result
+
+    def way_center(self, node_ids: Sequence[int]) -> OverpassCenter | None:
+        locations = self.locations(node_ids)
+        points = [locations[n] for n in node_ids if n in locations]
+
+        if not points:
+            return None
+
+        lats, lons = zip(*points, strict=True)
+        return OverpassCenter(lat=(min(lats) + max(lats)) / 2, lon=(min(lons) + max(lons)) / 2)
+
+    def relation_center(self, relation_id: int) -> OverpassCenter | None:
+        row = self.conn.execute(
+            'SELECT minlat, maxlat, minlon, maxlon FROM relation_index WHERE id = ?',
+            (relation_id,),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        minlat, maxlat, minlon, maxlon = row
+        return OverpassCenter(lat=(minlat + maxlat) / 2, lon=(minlon + maxlon) / 2)
+
+    def tagged_nodes_in(self, bb: BoundingBox) -> list[OverpassNode]:
+        rows = self.conn.execute(
+            f'SELECT n.id, n.lat, n.lon, n.tags FROM node_index i JOIN node n USING (id) WHERE {_OVERLAPS} ORDER BY n.id',  # noqa: S608
+            _bb_params(bb),
+        )
+        return [
+            OverpassNode(id=node_id, lat=lat, lon=lon, tags=_decode_tags(tags))
+            for node_id, lat, lon, tags in rows
+            # the index is not exact, it stores single precision floats
+            if bb.minlat <= lat <= bb.maxlat and bb.minlon <= lon <= bb.maxlon
+        ]
+
+    def ways_in(self, bb: BoundingBox) -> list[tuple[int, list[int], dict[str, str]]]:
+        rows = self.conn.execute(
+            f'SELECT w.id, w.nodes, w.tags FROM way_index i JOIN way w USING (id) WHERE {_OVERLAPS} ORDER BY w.id',  # noqa: S608
+            _bb_params(bb),
+        )
+        return [(way_id, _nodes_decode(nodes), _decode_tags(tags)) for way_id, nodes, tags in rows]
+
+    def relations_in(self, bb: BoundingBox) -> list[tuple[int, list[tuple[str, int, str]], dict[str, str]]]:
+        rows = self.conn.execute(
+            f'SELECT r.id, r.members, r.tags FROM relation_index i JOIN relation r USING (id) WHERE {_OVERLAPS} ORDER BY r.id',  # noqa: S608
+            _bb_params(bb),
+        )
+        return [(relation_id, _members_decode(members), _decode_tags(tags)) for relation_id, members, tags in rows]
+
+    def meta(self, table: str, element_ids: Iterable[int]) -> dict[int, tuple[int, str, int, int, str]]:
+        return {
+            element_id: _meta_decode(meta)
+            for element_id, meta in self._by_id(f'SELECT id, meta FROM {table}', element_ids)  # noqa: S608
+        }
+
+
+class OsmExtract:
+    """
+    Read-only access to an imported extract.
+
+    The query results have the same layout as the corresponding Overpass and OSM API responses.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f'file:{self._path}?mode=ro', uri=True)
+
+    def _query_bb(self, relation_id: int) -> list[OverpassElement]:
+        # rel(relation_id);way(r);out ids bb qt;
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT DISTINCT i.id, i.minlat, i.maxlat, i.minlon, i.maxlon '
+                'FROM member m JOIN way_index i ON i.id = m.ref '
+                "WHERE m.relation_id = ? AND m.type = 'way' ORDER BY i.id",
+                (relation_id,),
+            ).fetchall()
+
+        return [
+            OverpassWay(id=way_id, bounds=OverpassBounds(minlat=minlat, minlon=minlon, maxlat=maxlat, maxlon=maxlon))
+            for way_id, minlat, maxlat, minlon, maxlon in rows
+        ]
+
+    def _query_cell(self, q: _Query, cell: Cell) -> list[OverpassElement]:
+        # see build_bus_query
+        bb = BoundingBox.from_grid_cell(cell.x, cell.y)
+        bb_expanded = bb.extend(unit_degrees=DOWNLOAD_RELATION_GRID_CELL_EXPAND)
+        count = OverpassCount()
+        result: list[OverpassElement] = []
+
+        # way[highway][!footway](bb);out body qt;
+        ways = [
+            (way_id, nodes, tags)
+            for way_id, nodes, tags in q.ways_in(bb)
+            if 'highway' in tags and 'footway' not in tags and q.way_intersects(bb, nodes)
+        ]
+        result.extend(OverpassWay(id=way_id, nodes=nodes, tags=tags) for way_id, nodes, tags in ways)
+        result.append(count)
+
+        # >;out skel qt;
+        locations = q.locations(n for _, nodes, _ in ways for n in nodes)
+        node_ids = sorted({n for _, nodes, _ in ways for n in nodes if n in locations})
+        result.extend(OverpassNode(id=n, lat=locations[n][0], lon=locations[n][1]) for n in node_ids)
+        result.append(count)
+
+        # node[highway=bus_stop][public_transport=platform](bb_expanded);out tags center qt;
+        # nwr[highway=platform][public_transport=platform](bb_expanded);out tags center qt;
+        # node[public_transport=stop_position](bb_expanded);out tags center qt;
+        def is_platform(tags: dict[str, str], highway: str) -> bool:
+            return tags.get('highway') == highway and tags.get('public_transport') == 'platform'
+
+        nodes = q.tagged_nodes_in(bb_expanded)
+        result.extend(n for n in nodes if is_platform(n.tags, 'bus_stop'))
+        result.extend(n for n in nodes if is_platform(n.tags, 'platform'))
+        result.extend(
+            OverpassWay(id=way_id, tags=tags, center=q.way_center(way_nodes))
+            for way_id, way_nodes, tags in q.ways_in(bb_expanded)
+            if is_platform(tags, 'platform') and q.way_intersects(bb_expanded, way_nodes)
+        )
+        result.extend(
+            OverpassRelation(id=relation_id, tags=tags, center=q.relation_center(relation_id))
+            for relation_id, members, tags in q.relations_in(bb_expanded)
+            if is_platform(tags, 'platform') and q.relation_intersects(bb_expanded, members)
+        )
+        result.extend(n for n in nodes if n.tags.get('public_transport') == 'stop_position')
+        result.append(count)
+
+        # rel[public_transport=stop_area](bb_expanded)->.r;.r out body qt;
+        stop_areas = [
+            (relation_id, members, tags)
+            for relation_id, members, tags in q.relations_in(bb_expanded)
+            if tags.get('public_transport') == 'stop_area' and q.relation_intersects(bb_expanded, members)
+        ]
+        result.extend(
+            OverpassRelation(
+                id=relation_id,
+                members=[OverpassMember(type=type, ref=ref, role=role) for type, ref, role in members],
+                tags=tags,
+            )
+            for relation_id, members, tags in stop_areas
+        )
+        result.append(count)
+
+        def role_members(role: str, member_type: str) -> set[int]:
+            return {
+                ref
+                for _, members, _ in stop_areas
+                for type, ref, member_role in members
+                if type == member_type and member_role == role
+            }
+
+        # node(r.r:platform);way(r.r:platform);rel(r.r:platform);out tags center qt;
+        # the members may lie outside of the extract, without any located node to center on
+        result.extend(
+            OverpassNode(id=node_id, lat=lat, lon=lon, tags=_decode_tags(tags))
+            for node_id, lat, lon, tags in q.nodes(role_members('platform', 'node'))
+        )
+        result.extend(
+            OverpassWay(id=way_id, tags=_decode_tags(tags), center=center)
+            for way_id, way_nodes, tags in q.ways(role_members('platform', 'way'))
+            if (center := q.way_center(way_nodes)) is not None
+        )
+        result.extend(
+            OverpassRelation(id=relation_id, tags=_decode_tags(tags), center=center)
+            for relation_id, _, tags in q.relations(role_members('platform', 'relation'))
+            if (center := q.relation_center(relation_id)) is not None
+        )
+        result.append(count)
+
+        # node(r.r:stop);out tags center qt;
+        result.extend(
+            OverpassNode(id=node_id, lat=lat, lon=lon, tags=_decode_tags(tags))
+            for node_id, lat, lon, tags in q.nodes(role_members('stop', 'node'))
+        )
+        result.append(count)
+
+        return result
+
+    def _query_bus(self, cells: Sequence[Cell]) -> list[OverpassElement]:
+        with closing(self._connect()) as conn:
+            q = _Query(conn)
+            return [e for cell in cells for e in self._query_cell(q, cell)]
+
+    def _query_parents(self, way_ids: Iterable[int]) -> str:
+        # see build_parents_query
+        way_ids = tuple(way_ids)
+
+        with closing(self._connect()) as conn:
+            q = _Query(conn)
+            relation_ids = {
+                relation_id
+                for batch_start in range(0, len(way_ids), _QUERY_BATCH_SIZE)
+                for (relation_id,) in conn.execute(
+                    "SELECT relation_id FROM member WHERE type = 'way' AND ref IN "  # noqa: S608
+                    f'({",".join("?" * len(way_ids[batch_start : batch_start + _QUERY_BATCH_SIZE]))})',
+                    way_ids[batch_start : batch_start + _QUERY_BATCH_SIZE],
+                )
+            }
+            relations = q.relations(relation_ids)
+            relations_meta = q.meta('relation', relation_ids)
+            ways = q.ways(ref for _, members, _ in relations for type, ref, _ in members if type == 'way')
+
+        root = Element('osm', version='0.6', generator='osm-relatify')
+
+        for relation_id, members, tags in relations:
+            version, timestamp, changeset, uid, user = relations_meta[relation_id]
+            element = SubElement(
+                root,
+                'relation',
+                id=str(relation_id),
+                version=str(version),
+                timestamp=timestamp,
+                changeset=str(changeset),
+                uid=str(uid),
+                user=user,
+            )
+
+            for type, ref, role in members:
+                SubElement(element, 'member', type=type, ref=str(ref), role=role)
+
+            for k, v in _decode_tags(tags).items():
+                SubElement(element, 'tag', k=k, v=v)
+
+        for way_id, nodes, _ in ways:
+            element = SubElement(root, 'way', id=str(way_id))
+
+            for node_id in nodes:
+                SubElement(element, 'nd', ref=str(node_id))
+
+        return tostring(root, encoding='unicode')
+
+    def _get_elements(self, elements_type: str, element_ids: Iterable[str]) -> list[dict]:
+        # /api/0.6/{elements_type}.json, missing elements are reported like the api does
+        table = elements_type[:-1]
+        element_ids = tuple(map(int, element_ids))
+
+        with closing(self._connect()) as conn:
+            q = _Query(conn)
+            meta = q.meta(table, element_ids)
+
+            if table == 'node':
+                rows = [(i, {'lat': lat, 'lon': lon}, tags) for i, lat, lon, tags in q.nodes(element_ids)]
+            elif table == 'way':
+                rows = [(i, {'nodes': nodes}, tags) for i, nodes, tags in q.ways(element_ids)]
+            else:
+                rows = [
+                    (i, {'members': [{'type': type, 'ref': ref, 'role': role} for type, ref, role in members]}, tags)
+                    for i, members, tags in q.relations(element_ids)
+                ]
+
+        if len(rows) != len(set(element_ids)):
+            request = httpx.Request('GET', f'file://{Path(self._path).absolute()}')
+            raise httpx.HTTPStatusError(
+                f'Some {elements_type} are not in the extract',
+                request=request,
+                response=httpx.Response(404, request=request),
+            )
+
+        elements_map = {}
+
+        for element_id, data, tags in rows:
+            version, timestamp, changeset, uid, user = meta[element_id]
+            element = {
+                'type': table,
+                'id': element_id,
+                **data,
+                'timestamp': timestamp,
+                'version': version,
+                'changeset': changeset,
+                'user': user,
+                'uid': uid,
+            }
+
+            if tags is not None:
+                element['tags'] = _decode_tags(tags)
+
+            elements_map[element_id] = element
+
+        return [elements_map[element_id] for element_id in element_ids]
+
+    def _get_elements_xml(self, elements_type: str, element_ids: Iterable[str]) -> str:
+        # /api/0.6/{elements_type}
+        root = Element('osm', version='0.6', generator='osm-relatify')
+
+        for data in self._get_elements(elements_type, element_ids):
+            element = SubElement(
+                root,
+                data['type'],
+                id=str(data['id']),
+                visible='true',
+                version=str(data['version']),
+                changeset=str(data['changeset']),
+                timestamp=data['timestamp'],
+                user=data['user'],
+                uid=str(data['uid']),
+            )
+
+            if 'lat' in data:
+                element.set('lat', str(data['lat']))
+                element.set('lon', str(data['lon']))
+
+            for node_id in data.get('nodes', ()):
+                SubElement(element, 'nd', ref=str(node_id))
+
+            for member in data.get('members', ()):
+                SubElement(element, 'member', type=member['type'], ref=str(member['ref']), role=member['role'])
+
+            for k, v in data.get('tags', {}).items():
+                SubElement(element, 'tag', k=k, v=v)
+
+        return tostring(root, encoding='unicode')
+
+    async def query_bb(self, relation_id: int) -> list[OverpassElement]:
+        return await asyncio.to_thread(self._query_bb, relation_id)
+
+    async def query_bus(self, cells: Sequence[Cell]) -> list[OverpassElement]:
+        return await asyncio.to_thread(self._query_bus, cells)
+
+    async def query_parents(self, way_ids: Iterable[int]) -> str:
+        return await asyncio.to_thread(self._query_parents, way_ids)
+
+    async def get_elements(self, elements_type: str, element_ids: Iterable[str]) -> list[dict]:
+        return await asyncio.to_thread(self._get_elements, elements_type, element_ids)
+
+    async def get_elements_xml(self, elements_type: str, element_ids: Iterable[str]) -> str:
+        return await asyncio.to_thread(self._get_elements_xml, elements_type, element_ids)
+
+
+@cache
+def get_osm_extract() -> OsmExtract | None:
+    return OsmExtract(OSM_EXTRACT_PATH) if OSM_EXTRACT_PATH else None
+
+
+def _meta(o) -> bytes:
+    timestamp = o.timestamp.astimezone(UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return _msgpack_encode((o.version, timestamp, o.changeset, o.uid, o.user))
+
+
+def _tags(o) -> bytes | None:
+    return _msgpack_encode({t.k: t.v for t in o.tags}) if o.tags else None
+
+
+def import_extract(input_path: str, output_path: str) -> None:
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError('Importing an extract requires the osmium package') from None
+
+    with closing(sqlite3.connect(output_path)) as conn:
+        for statement in _SCHEMA:
+            conn.execute(statement)
+
+        batches: dict[str, list[tuple]] = {
+            'INSERT INTO node VALUES (?, ?, ?, ?, ?)': [],
+            'INSERT INTO node_index VALUES (?, ?, ?, ?, ?)': [],
+            'INSERT INTO way VALUES (?, ?, ?, ?)': [],
+            'INSERT INTO way_index VALUES (?, ?, ?, ?, ?)': [],
+            'INSERT INTO relation VALUES (?, ?, ?, ?)': [],
+            'INSERT INTO member VALUES (?, ?, ?)': [],
+        }
+        node_sql, node_index_sql, way_sql, way_index_sql, relation_sql, member_sql = batches
+
+        def flush(force: bool = False) -> None:
+            for sql, rows in batches.items():
+                if rows and (force or len(rows) >= _IMPORT_BATCH_SIZE):
+                    conn.executemany(sql, rows)
+                    rows.clear()
+
+        with print_run_time(f'Importing {input_path}'):
+            for o in osmium.FileProcessor(input_path).with_locations():
+                if o.is_node():
+                    if not o.location.valid():
+                        continue
+
+                    lat, lon = o.location.lat, o.location.lon
+                    batches[node_sql].append((o.id, lat, lon, _meta(o), _tags(o)))
+
+                    if o.tags:
+                        batches[node_index_sql].append((o.id, lat, lat, lon, lon))
+
+                elif o.is_way():
+                    nodes = [n.ref for n in o.nodes]
+                    batches[way_sql].append((o.id, _meta(o), _msgpack_encode(nodes), _tags(o)))
+
+                    if points := [(n.lat, n.lon) for n in o.nodes if n.location.valid()]:
+                        lats, lons = zip(*points, strict=True)
+                        batches[way_index_sql].append((o.id, min(lats), max(lats), min(lons), max(lons)))
+
+                elif o.is_relation():
+                    members = [(_OSMIUM_MEMBER_TYPES[m.type], m.ref, m.role) for m in o.members]
+                    batches[relation_sql].append((o.id, _meta(o), _msgpack_encode(members), _tags(o)))
+                    batches[member_sql].extend((type, ref, o.id) for type, ref, _ in members)
+
+                flush()
+
+            flush(force=True)
+
+        with print_run_time('Indexing relations'):
+            conn.execute('CREATE INDEX member_ref ON member (type, ref)')
+
+            # bounding boxes of the direct node and way members
+            conn.execute(
+                'INSERT INTO relation_index '
+                'SELECT relation_id, min(minlat), max(maxlat), min(minlon), max(maxlon) FROM ('
+                'SELECT m.relation_id, n.lat AS minlat, n.lat AS maxlat, n.lon AS minlon, n.lon AS maxlon '
+                "FROM member m JOIN node n ON m.type = 'node' AND n.id = m.ref "
+                'UNION ALL '
+                'SELECT m.relation_id, i.minlat, i.maxlat, i.minlon, i.maxlon '
+                "FROM member m JOIN way_index i ON m.type = 'way' AND i.id = m.ref"
+                ') GROUP BY relation_id'
+            )
+
+        conn.commit()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__.strip())
+        sys.exit(1)
+
+    import_extract(sys.argv[1], sys.argv[2])
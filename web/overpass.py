@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict
 from collections.abc import Iterable, Sequence
 from dataclasses import replace
@@ -8,31 +9,63 @@ import httpx
 import xmltodict
 from asyncache import cached
 from cachetools import TTLCache
+from msgspec.json import Decoder
 
 from bus_collection_builder import build_bus_stop_collections
-from config import DOWNLOAD_RELATION_GRID_CELL_EXPAND, DOWNLOAD_RELATION_WAY_BB_EXPAND, OVERPASS_API_INTERPRETER
+from config import (
+    DOWNLOAD_RELATION_GRID_CELL_EXPAND,
+    DOWNLOAD_RELATION_WAY_BB_EXPAND,
+    OVERPASS_API_INTERPRETERS,
+    OVERPASS_CACHE_PATH,
+    OVERPASS_CACHE_TTL,
+    OVERPASS_QUERY_CONCURRENCY,
+    OVERPASS_QUERY_GROUP_SIZE,
+    OVERPASS_QUERY_RETRIES,
+)
 from models.bounding_box import BoundingBox
 from models.bounding_box_collection import BoundingBoxCollection
 from models.download_history import Cell, DownloadHistory
 from models.element_id import ElementId, element_id
 from models.fetch_relation import FetchRelationBusStop, FetchRelationBusStopCollection, FetchRelationElement
-from utils import get_http_client
+from models.overpass_element import (
+    OverpassCount,
+    OverpassElement,
+    OverpassRelation,
+    OverpassResponse,
+    OverpassTaggedElement,
+    OverpassWay,
+)
+from osm_extract import get_osm_extract
+from overpass_cache import OverpassCellCache
+from overpass_client import OverpassClient
+from utils import single_flight
 from xmltodict_postprocessor import postprocessor
 
+_overpass_decode = Decoder(OverpassResponse).decode
+
 # TODO: right hand side detection by querying roundabouts, and first/last bus stop
 
 
+class SplitWay(NamedTuple):
+    id: ElementId
+    way: OverpassWay
+    nodes: list[int]
+
+
 class QueryParentsResult(NamedTuple):
     id_relations_map: dict[int, list[dict]]
     ways_map: dict[int, dict]
 
 
-def split_by_count(elements: Iterable[dict]) -> list[list[dict]]:
+BUS_QUERY_SPLITS = 6
+
+
+def split_by_count(elements: Iterable[OverpassElement]) -> list[list[OverpassTaggedElement]]:
     result = []
     current_split = []
 
     for e in elements:
-        if e['type'] == 'count':
+        if isinstance(e, OverpassCount):
             result.append(current_split)
             current_split = []
         else:
@@ -46,39 +79,45 @@ def build_bb_query(relation_id: int, timeout: int) -> str:
     return f'[out:json][timeout:{timeout}];rel({relation_id});way(r);out ids bb qt;'
 
 
-def build_bus_query(cell_bbs: Sequence[BoundingBox], cell_bbs_expanded: Sequence[BoundingBox], timeout: int) -> str:
-    return (
-        f'[out:json][timeout:{timeout}];'
-        f'(' + ''.join(f'way[highway][!footway]({bb});' for bb in cell_bbs) + ');'
-        'out body qt;'
-        'out count;'
-        '>;'
-        'out skel qt;'
-        'out count;'
-        + ''.join(
-            f'node[highway=bus_stop][public_transport=platform]({bb});'
-            f'out tags center qt;'
-            f'nwr[highway=platform][public_transport=platform]({bb});'
-            f'out tags center qt;'
-            f'node[public_transport=stop_position]({bb});'
-            f'out tags center qt;'
-            for bb in cell_bbs_expanded
+def build_bus_query(cells: Sequence[Cell], timeout: int) -> str:
+    """
+    Query the roads and bus stops of every cell separately, BUS_QUERY_SPLITS splits per cell.
+    """
+
+    def _cell(cell: Cell) -> str:
+        bb = BoundingBox.from_grid_cell(cell.x, cell.y)
+        bb_expanded = bb.extend(unit_degrees=DOWNLOAD_RELATION_GRID_CELL_EXPAND)
+
+        return (
+            f'way[highway][!footway]({bb});'
+            'out body qt;'
+            'out count;'
+            '>;'
+            'out skel qt;'
+            'out count;'
+            f'node[highway=bus_stop][public_transport=platform]({bb_expanded});'
+            'out tags center qt;'
+            f'nwr[highway=platform][public_transport=platform]({bb_expanded});'
+            'out tags center qt;'
+            f'node[public_transport=stop_position]({bb_expanded});'
+            'out tags center qt;'
+            'out count;'
+            f'rel[public_transport=stop_area]({bb_expanded})->.r;'
+            '.r out body qt;'
+            '.r out count;'
+            'node(r.r:platform);'
+            'out tags center qt;'
+            'way(r.r:platform);'
+            'out tags center qt;'
+            'rel(r.r:platform);'
+            'out tags center qt;'
+            'out count;'
+            'node(r.r:stop);'
+            'out tags center qt;'
+            'out count;'
         )
-        + 'out count;'
-        '(' + ''.join(f'rel[public_transport=stop_area]({bb});' for bb in cell_bbs_expanded) + ')->.r;'
-        '.r out body qt;'
-        '.r out count;'
-        'node(r.r:platform);'
-        'out tags center qt;'
-        'way(r.r:platform);'
-        'out tags center qt;'
-        'rel(r.r:platform);'
-        'out tags center qt;'
-        'out count;'
-        'node(r.r:stop);'
-        'out tags center qt;'
-        'out count;'
-    )
+
+    return f'[out:json][timeout:{timeout}];' + ''.join(_cell(cell) for cell in cells)
 
 
 def build_parents_query(way_ids: Iterable[int], timeout: int) -> str:
@@ -194,39 +233,44 @@ def is_rail_related(tags: dict[str, str]) -> bool:
     return any((rail_valid, train_valid, subway_valid, tram_valid))
 
 
-def _merge_relation_tags(element: dict, relation: dict, extra: dict) -> None:
-    element['tags'] = relation.get('tags', {}) | element.get('tags', {}) | extra
+def _merge_relation_tags(element: OverpassTaggedElement, relation: OverpassRelation, extra: dict) -> None:
+    element.tags = relation.tags | element.tags | extra
 
 
-def merge_relations_tags(relations: Iterable[dict], elements: Iterable[dict], role: str, public_transport: str) -> None:
-    element_map = {(e['type'], e['id']): e for e in elements}
+def merge_relations_tags(
+    relations: Iterable[OverpassRelation],
+    elements: Iterable[OverpassTaggedElement],
+    role: str,
+    public_transport: str,
+) -> None:
+    element_map = {(e.type, e.id): e for e in elements}
 
-    for relation in sorted(relations, key=lambda r: r['id']):
-        for member in (m for m in relation['members'] if m['role'] == role):
-            platform = element_map.get((member['type'], member['ref']), None)
+    for relation in sorted(relations, key=lambda r: r.id):
+        for member in (m for m in relation.members if m.role == role):
+            platform = element_map.get((member.type, member.ref), None)
 
             if platform is None:
-                print(f'🚧 Warning: Platform {member["type"]}/{member["ref"]} not found in map')
+                print(f'🚧 Warning: Platform {member.type}/{member.ref} not found in map')
                 continue
 
             _merge_relation_tags(platform, relation, {'public_transport': public_transport})
 
 
-def _create_node_counts(ways: list[dict]) -> dict[int, int]:
+def _create_node_counts(ways: Iterable[OverpassWay]) -> dict[int, int]:
     node_counts = defaultdict(int)
 
     for way in ways:
-        for node in way['nodes']:
+        for node in way.nodes:
             node_counts[node] += 1
 
     return node_counts
 
 
-def _split_way_on_intersection(way: dict, node_counts: dict[int, int]) -> list[list[int]]:
+def _split_way_on_intersection(way: OverpassWay, node_counts: dict[int, int]) -> list[list[int]]:
     segments: list[list[int]] = []
     current_segment: list[int] = []
 
-    for node in way['nodes']:
+    for node in way.nodes:
         current_segment.append(node)
 
         if node_counts[node] > 1 and len(current_segment) > 1:
@@ -239,11 +283,13 @@ def _split_way_on_intersection(way: dict, node_counts: dict[int, int]) -> list[l
     return segments
 
 
-def organize_ways(ways: list[dict]) -> tuple[list[dict], dict[ElementId, set[ElementId]], dict[int, list[ElementId]]]:
+def organize_ways(
+    ways: Sequence[OverpassWay],
+) -> tuple[list[SplitWay], dict[ElementId, set[ElementId]], dict[int, list[ElementId]]]:
     node_counts = _create_node_counts(ways)
     node_to_way_map = defaultdict(set)
 
-    split_ways: list[dict] = []
+    split_ways: list[SplitWay] = []
     connected_ways_map: dict[ElementId, set[ElementId]] = defaultdict(set)
     id_map = defaultdict(list)
 
@@ -254,36 +300,29 @@ def organize_ways(ways: list[dict]) -> tuple[list[dict], dict[ElementId, set[Ele
             extra_num = extra_num if len(split_segments) > 1 else None
             max_num = len(split_segments) if extra_num is not None else None
 
-            split_way = {
-                **way,
-                'id': element_id(way['id'], extra_num=extra_num, max_num=max_num),
-                'nodes': segment,
-            }
+            split_way = SplitWay(
+                id=element_id(way.id, extra_num=extra_num, max_num=max_num),
+                way=way,
+                nodes=segment,
+            )
 
             split_ways.append(split_way)
-            id_map[way['id']].append(split_way['id'])
+            id_map[way.id].append(split_way.id)
 
             for node in segment:
                 if node_counts[node] > 1:
                     for other_way_id in node_to_way_map[node]:
-                        connected_ways_map[split_way['id']].add(other_way_id)
-                        connected_ways_map[other_way_id].add(split_way['id'])
-                    node_to_way_map[node].add(split_way['id'])
+                        connected_ways_map[split_way.id].add(other_way_id)
+                        connected_ways_map[other_way_id].add(split_way.id)
+                    node_to_way_map[node].add(split_way.id)
 
     return split_ways, connected_ways_map, id_map
 
 
-def preprocess_elements(elements: Iterable[dict]) -> Sequence[dict]:
+def preprocess_elements(elements: Iterable[OverpassTaggedElement]) -> Sequence[OverpassTaggedElement]:
     # deduplicate
-    map = {(e['type'], e['id']): e for e in elements}
-    result = tuple(map.values())
-
-    # extract center
-    for e in result:
-        if 'center' in e:
-            e |= e['center']
-
-    return result
+    map = {(e.type, e.id): e for e in elements}
+    return tuple(map.values())
 
 
 def optimize_cells_and_get_bbs(
@@ -365,37 +404,92 @@ def get_download_triggers(
     return dict(result)
 
 
-# TODO: check data freshness
 class Overpass:
     def __init__(self):
-        pass
+        self.cell_cache = OverpassCellCache(OVERPASS_CACHE_PATH, OVERPASS_CACHE_TTL)
+        self.extract = get_osm_extract()
+        self.client = OverpassClient(OVERPASS_API_INTERPRETERS)
+        self._query_semaphore = asyncio.Semaphore(OVERPASS_QUERY_CONCURRENCY)
+
+    async def _post_bus_query(self, cells: Sequence[Cell]) -> list[OverpassElement]:
+        timeout = 180
+        query = build_bus_query(cells, timeout)
+
+        for attempt in range(OVERPASS_QUERY_RETRIES + 1):
+            try:
+                async with self._query_semaphore:
+                    r = await self.client.post(query, request_timeout=timeout * 2)
+                break
+            except httpx.HTTPError as e:
+                retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code in {429, 502, 503, 504}
+
+                if not retryable or attempt == OVERPASS_QUERY_RETRIES:
+                    raise
+
+                print(f'[OVERPASS] Retrying {len(cells)} cells after {e!r}')
+                await asyncio.sleep(2**attempt)
+
+        return _overpass_decode(r.content).elements
+
+    async def _download_cells(self, cells: Sequence[Cell]) -> dict[Cell, list[list[OverpassTaggedElement]]]:
+        if self.extract is not None:
+            elements = await self.extract.query_bus(cells)
+        else:
+            elements = await self._post_bus_query(cells)
 
-    def _get_http_client(self) -> httpx.AsyncClient:
-        return get_http_client(OVERPASS_API_INTERPRETER)
+        elements_split = split_by_count(elements)
 
-    @cached(TTLCache(maxsize=1024, ttl=7200))  # 2 hours
-    async def _query_relation_history_post(
-        self,
-        session: str,
-        query: str,
-        timeout: float,
-    ) -> list[list[dict]]:
-        async with self._get_http_client() as http:
-            r = await http.post('', data={'data': query}, timeout=timeout * 2)
-            r.raise_for_status()
+        downloaded = {
+            cell: elements_split[i * BUS_QUERY_SPLITS : (i + 1) * BUS_QUERY_SPLITS] for i, cell in enumerate(cells)
+        }
+
+        # cached right away, so that a failure of another group does not waste this one
+        if self.extract is None:
+            await self.cell_cache.put(downloaded)
+
+        return downloaded
 
-        elements: list[dict] = r.json()['elements']
-        return split_by_count(elements)
+    async def _query_cells(self, cells: Sequence[Cell], *, reload: bool) -> list[list[OverpassTaggedElement]]:
+        # the extract is local, there is nothing to gain from caching it
+        cells_split = {} if reload or self.extract is not None else await self.cell_cache.get(cells)
+        missing_cells = sorted((cell for cell in cells if cell not in cells_split), key=lambda c: (c.y, c.x))
+
+        if missing_cells:
+            # neighbouring cells are queried together
+            groups = [
+                missing_cells[i : i + OVERPASS_QUERY_GROUP_SIZE]
+                for i in range(0, len(missing_cells), OVERPASS_QUERY_GROUP_SIZE)
+            ]
+
+            print(f'[OVERPASS] Downloading {len(missing_cells)} of {len(cells)} cells in {len(groups)} queries')
+
+            async with asyncio.TaskGroup() as tg:
+                tasks = [tg.create_task(self._download_cells(group)) for group in groups]
+
+            for task in tasks:
+                cells_split |= task.result()
+
+        # merge the cells, elements near the cell borders are present in multiple cells
+        merged_split: list[dict[tuple[str, int], OverpassTaggedElement]] = [{} for _ in range(BUS_QUERY_SPLITS)]
+
+        for cell in cells:
+            for merged, elements in zip(merged_split, cells_split[cell], strict=True):
+                for e in elements:
+                    merged[(e.type, e.id)] = e
+
+        return [list(merged.values()) for merged in merged_split]
 
     async def _query_relation_history(
         self,
         relation_id: int,
         download_hist: DownloadHistory,
-    ) -> tuple[list[list[dict]], BoundingBoxCollection]:
+        *,
+        reload: bool,
+    ) -> tuple[list[list[OverpassTaggedElement]], BoundingBoxCollection]:
         if not download_hist.history or not all(download_hist.history):
             raise ValueError('No grid cells to download')
 
-        all_elements_split = None
+        all_cells: dict[Cell, None] = {}  # ordered set
         all_bbs = []
 
         for cells in download_hist.history:
@@ -404,31 +498,26 @@ class Overpass:
 
             # pick more optimal cells
             cell_bbs_t = hor_bbs_t if len(hor_bbs_t) <= len(ver_bbs_t) else ver_bbs_t
-            cell_bbs, cell_bbs_expand = cell_bbs_t
+            cell_bbs, _ = cell_bbs_t
             all_bbs.extend(cell_bbs)
+            all_cells.update(dict.fromkeys(cells))
 
-            print(f'[OVERPASS] Downloading {len(cell_bbs)} cells for relation {relation_id}')
-
-            timeout = 180
-            query = build_bus_query(cell_bbs, cell_bbs_expand, timeout)
-            elements_split = await self._query_relation_history_post(download_hist.session, query, timeout)
-
-            if all_elements_split is None:
-                all_elements_split = elements_split
-            else:
-                for i, elements in enumerate(elements_split):
-                    all_elements_split[i].extend(elements)
+        print(f'[OVERPASS] Querying {len(all_cells)} cells for relation {relation_id}')
 
+        all_elements_split = await self._query_cells(tuple(all_cells), reload=reload)
         bbc = BoundingBoxCollection(all_bbs)
 
         return all_elements_split, bbc
 
     @cached(TTLCache(maxsize=128, ttl=60))
+    @single_flight
     async def query_relation(
         self,
         relation_id: int,
         download_hist: DownloadHistory | None,
         download_targets: Sequence[Cell] | None,
+        *,
+        reload: bool = False,
     ) -> tuple[
         BoundingBox,
         DownloadHistory,
@@ -438,25 +527,24 @@ class Overpass:
         list[FetchRelationBusStopCollection],
     ]:
         if download_targets is None:
-            timeout = 60
-            query = build_bb_query(relation_id, timeout)
-
-            async with self._get_http_client() as http:
-                r = await http.post('', data={'data': query}, timeout=timeout * 2)
-                r.raise_for_status()
-
-            elements: list[dict] = r.json()['elements']
+            if self.extract is not None:
+                elements = await self.extract.query_bb(relation_id)
+            else:
+                timeout = 60
+                query = build_bb_query(relation_id, timeout)
+                r = await self.client.post(query, request_timeout=timeout * 2)
+                elements = _overpass_decode(r.content).elements
 
-            relation_way_members = {e['id'] for e in elements}
+            relation_way_members = {e.id for e in elements}
             union_grid_cells_set: set[Cell] = set()
 
             for way in elements:
                 union_grid_cells_set.update(
                     BoundingBox(
-                        minlat=way['bounds']['minlat'],
-                        minlon=way['bounds']['minlon'],
-                        maxlat=way['bounds']['maxlat'],
-                        maxlon=way['bounds']['maxlon'],
+                        minlat=way.bounds.minlat,
+                        minlon=way.bounds.minlon,
+                        maxlat=way.bounds.maxlat,
+                        maxlon=way.bounds.maxlon,
                     )
                     .extend(DOWNLOAD_RELATION_WAY_BB_EXPAND)
                     .get_grid_cells()
@@ -474,7 +562,7 @@ class Overpass:
         elif union_grid_cells:
             download_hist = replace(download_hist, history=(*download_hist.history, union_grid_cells))
 
-        elements_split, bbc = await self._query_relation_history(relation_id, download_hist)
+        elements_split, bbc = await self._query_relation_history(relation_id, download_hist, reload=reload)
 
         maybe_road_elements = elements_split[0]
         maybe_road_elements = preprocess_elements(maybe_road_elements)
@@ -500,33 +588,28 @@ class Overpass:
             public_transport='stop_position',
         )
 
-        road_elements = tuple(e for e in maybe_road_elements if is_road(e['tags']))
+        road_elements = tuple(e for e in maybe_road_elements if is_road(e.tags))
 
-        nodes_map = {e['id']: e for e in node_elements}
+        nodes_map = {e.id: e for e in node_elements}
 
-        for e in road_elements:
-            e['_member'] = e['id'] in relation_way_members
-            e['_oneway'] = is_oneway(e['tags'])
-            e['_roundabout'] = is_roundabout(e['tags'])
-
-        road_elements, connected_ways_map, id_map = organize_ways(road_elements)
+        split_ways, connected_ways_map, id_map = organize_ways(road_elements)
 
         ways = {
-            e['id']: FetchRelationElement(
-                id=e['id'],
-                member=e['_member'],
-                oneway=e['_oneway'],
-                roundabout=e['_roundabout'],
-                nodes=e['nodes'],
-                latLngs=[(nodes_map[n_id]['lat'], nodes_map[n_id]['lon']) for n_id in e['nodes']],
-                connectedTo=list(connected_ways_map[e['id']]),
+            w.id: FetchRelationElement(
+                id=w.id,
+                member=w.way.id in relation_way_members,
+                oneway=is_oneway(w.way.tags),
+                roundabout=is_roundabout(w.way.tags),
+                nodes=w.nodes,
+                latLngs=[nodes_map[n_id].lat_lon for n_id in w.nodes],
+                connectedTo=list(connected_ways_map[w.id]),
             )
-            for e in road_elements
+            for w in split_ways
         }
 
         bus_elements_ex = chain(stop_area_platform_elements, stop_area_stop_position_elements, bus_elements)
         bus_elements_ex = preprocess_elements(bus_elements_ex)
-        bus_elements_ex = (e for e in bus_elements_ex if is_bus_related(e['tags']) or not is_rail_related(e['tags']))
+        bus_elements_ex = (e for e in bus_elements_ex if is_bus_related(e.tags) or not is_rail_related(e.tags))
 
         bus_stops = tuple(FetchRelationBusStop.from_data(e) for e in bus_elements_ex)
         bus_stop_collections = build_bus_stop_collections(bus_stops)
@@ -538,16 +621,18 @@ class Overpass:
         return global_bb, download_hist, download_triggers, ways, id_map, bus_stop_collections
 
     @cached(TTLCache(maxsize=128, ttl=60))
+    @single_flight
     async def query_parents(self, way_ids_set: frozenset[int]) -> QueryParentsResult:
-        timeout = 60
-        query = build_parents_query(way_ids_set, timeout)
-
-        async with self._get_http_client() as http:
-            r = await http.post('', data={'data': query}, timeout=timeout * 2)
-            r.raise_for_status()
+        if self.extract is not None:
+            text = await self.extract.query_parents(way_ids_set)
+        else:
+            timeout = 60
+            query = build_parents_query(way_ids_set, timeout)
+            r = await self.client.post(query, request_timeout=timeout * 2)
+            text = r.text
 
         data: dict[str, list[dict]] = xmltodict.parse(
-            r.text,
+            text,
             postprocessor=postprocessor,
             force_list=('relation', 'way', 'member', 'tag', 'nd'),
         )['osm']
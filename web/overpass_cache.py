@@ -0,0 +1,103 @@
+import asyncio
+import sqlite3
+import time
+from collections.abc import Iterable
+from contextlib import closing
+from pathlib import Path
+
+from msgspec.msgpack import Decoder, Encoder
+
+from compression import deflate_compress, deflate_decompress
+from models.download_history import Cell
+from models.overpass_element import OverpassElement, OverpassTaggedElement
+
+_msgpack_decode = Decoder(list[list[OverpassElement]]).decode
+_msgpack_encode = Encoder().encode
+
+
+class OverpassCellCache:
+    """
+    Disk-backed cache of the Overpass data, per grid cell.
+
+    Every cell stores its query splits (see build_bus_query) with the time they were downloaded,
+    cells older than ttl are stale. The cache is shared by all users and survives restarts;
+    sqlite takes care of the concurrent access from multiple application processes.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self._path = Path(path)
+        self._ttl = ttl
+        self._initialized = False
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        conn = sqlite3.connect(self._path, timeout=30)
+
+        if not self._initialized:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cell ('
+                'x INTEGER NOT NULL, '
+                'y INTEGER NOT NULL, '
+                'updated_at REAL NOT NULL, '
+                'data BLOB NOT NULL, '
+                'PRIMARY KEY (x, y)'
+                ') WITHOUT ROWID'
+            )
+            self._initialized = True
+
+        return conn
+
+    def _get(self, cells: Iterable[Cell]) -> dict[Cell, list[list[OverpassTaggedElement]]]:
+        min_updated_at = time.time() - self._ttl
+        result = {}
+
+        with closing(self._connect()) as conn:
+            for cell in cells:
+                row = conn.execute(
+                    'SELECT data FROM cell WHERE x = ? AND y = ? AND updated_at >= ?',
+                    (cell.x, cell.y, min_updated_at),
+                ).fetchone()
+
+                if row is not None:
+                    result[cell] = _msgpack_decode(deflate_decompress(row[0]))
+
+        return result
+
+    def _put(self, cells_split: dict[Cell, list[list[OverpassTaggedElement]]]) -> None:
+        updated_at = time.time()
+
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO cell (x, y, updated_at, data) VALUES (?, ?, ?, ?)',
+                (
+                    (cell.x, cell.y, updated_at, deflate_compress(_msgpack_encode(split)))
+                    for cell, split in cells_split.items()
+                ),
+            )
+
+    async def get(self, cells: Iterable[Cell]) -> dict[Cell, list[list[OverpassTaggedElement]]]:
+        """
+        Get the fresh cells, the missing and stale ones are left out.
+
+        The returned elements are decoded on every call, so they may be modified freely.
+        """
+
+        cells = tuple(cells)
+        result = await asyncio.to_thread(self._get, cells)
+        self.hits += len(result)
+        self.misses += len(cells) - len(result)
+        return result
+
+    async def put(self, cells_split: dict[Cell, list[list[OverpassTaggedElement]]]) -> None:
+        await asyncio.to_thread(self._put, cells_split)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Sequence
+
+import httpx
+
+from config import (
+    OVERPASS_BACKOFF_MAX,
+    OVERPASS_BACKOFF_MIN,
+    OVERPASS_HEDGE_DELAY,
+    OVERPASS_HEDGE_MIN_SAMPLES,
+)
+from utils import get_http_client
+
+# the endpoint is overloaded, it is backed off
+_BACKOFF_STATUS_CODES = {429, 504}
+
+# the query itself is fine, another endpoint may answer it
+_FAILOVER_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class _Endpoint:
+    __slots__ = ('backoff_until', 'errors', 'failures', 'hedges', 'latencies', 'requests', 'url')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latencies: deque[float] = deque(maxlen=100)  # of the recent successful requests
+        self.failures = 0  # consecutive
+        self.backoff_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+
+    def backing_off(self, now: float) -> bool:
+        return self.backoff_until > now
+
+    def latency(self, quantile: float) -> float | None:
+        if len(self.latencies) < OVERPASS_HEDGE_MIN_SAMPLES:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * quantile), len(latencies) - 1)]
+
+    def succeeded(self, latency: float) -> None:
+        self.latencies.append(latency)
+        self.failures = 0
+
+    def failed(self, e: httpx.HTTPError) -> None:
+        self.errors += 1
+        self.failures += 1
+
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code in _BACKOFF_STATUS_CODES:
+            backoff = min(OVERPASS_BACKOFF_MIN * 2 ** (self.failures - 1), OVERPASS_BACKOFF_MAX)
+            self.backoff_until = time.monotonic() + backoff
+            print(f'[OVERPASS] Backing off {self.url} for {backoff}s after {e.response.status_code}')
+
+
+class OverpassClient:
+    """
+    Overpass API client spreading the queries over multiple endpoints.
+
+    A query goes to the healthiest endpoint. When it does not respond within its p95 latency,
+    a hedged duplicate is sent to the next endpoint, the first successful response wins
+    and the other request is cancelled. Failed requests fail over to the next endpoint,
+    and endpoints responding with 429 or 504 are backed off.
+    """
+
+    def __init__(self, urls: Sequence[str]):
+        assert urls, 'No Overpass endpoints'
+        self._endpoints = tuple(_Endpoint(url) for url in urls)
+
+    def _ranked(self) -> list[_Endpoint]:
+        now = time.monotonic()
+
+        # endpoints without enough samples are tried first, to learn their latency
+        return sorted(
+            self._endpoints,
+            key=lambda e: (e.backing_off(now), e.failures, e.latency(0.5) or 0),
+        )
+
+    async def _request(self, endpoint: _Endpoint, query: str, request_timeout: float) -> httpx.Response:
+        endpoint.requests += 1
+        start = time.monotonic()
+
+        try:
+            http = get_http_client(endpoint.url)
+            r = await http.post('', data={'data': query}, timeout=request_timeout)
+            r.raise_for_status()
+        except httpx.HTTPError as e:
+            endpoint.failed(e)
+            raise
+
+        endpoint.succeeded(time.monotonic() - start)
+        return r
+
+    async def post(self, query: str, request_timeout: float) -> httpx.Response:
+        endpoints = self._ranked()
+        tasks: dict[asyncio.Task[httpx.Response], _Endpoint] = {}
+        error: httpx.HTTPError | None = None
+
+        def start_next(*, hedge: bool) -> bool:
+            if len(tasks) == len(endpoints):
+                return False
+
+            endpoint = endpoints[len(tasks)]
+
+            # hedging is an optimization, an overloaded endpoint would only get more load
+            if hedge and endpoint.backing_off(time.monotonic()):
+                return False
+
+            if hedge:
+                endpoint.hedges += 1
+
+            tasks[asyncio.create_task(self._request(endpoint, query, request_timeout))] = endpoint
+            return True
+
+        start_next(hedge=False)
+        pending = set(tasks)
+
+        try:
+            while pending:
+                last_endpoint = endpoints[len(tasks) - 1]
+                hedge_delay = last_endpoint.latency(0.95) or OVERPASS_HEDGE_DELAY
+
+                done, pending = await asyncio.wait(pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    if start_next(hedge=True):
+                        pending = {t for t in tasks if not t.done()}
+                    else:
+                        # nothing left to hedge with, wait for the running requests
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if (e := task.exception()) is None:
+                        return task.result()
+
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in _FAILOVER_STATUS_CODES:
+                        raise e
+
+                    error = e
+
+                    if start_next(hedge=False):
+                        pending = {t for t in tasks if not t.done()}
+
+            assert error is not None
+            raise error
+
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict[str, dict[str, int | float | bool | None]]:
+        now = time.monotonic()
+
+        return {
+            e.url: {
+                'requests': e.requests,
+                'errors': e.errors,
+                'hedges': e.hedges,
+                'p95_latency': e.latency(0.95),
+                'backing_off': e.backing_off(now),
+            }
+            for e in self._endpoints
+        }
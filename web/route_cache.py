@@ -0,0 +1,69 @@
+from collections.abc import Sequence
+from hashlib import blake2b
+
+from cachetools import TTLCache
+from msgspec.msgpack import Encoder
+
+from models.element_id import ElementId
+from models.fetch_relation import FetchRelationBusStopCollection, FetchRelationElement
+from models.final_route import FinalRoute
+
+_fingerprint_encode = Encoder(order='deterministic').encode
+
+
+def route_fingerprint(
+    ways_members: dict[ElementId, FetchRelationElement],
+    start_way: ElementId,
+    end_way: ElementId,
+    bus_stop_collections: Sequence[FetchRelationBusStopCollection],
+    tags: dict[str, str],
+    engine: str,
+) -> bytes:
+    """
+    Fingerprint everything the calculated route depends on.
+
+    Ways are encoded in id order, so payloads differing only in the way order share a fingerprint.
+    """
+
+    data = _fingerprint_encode(
+        (
+            tuple(
+                (way.id, way.oneway, way.roundabout, way.latLngs, way.connectedTo)
+                for _, way in sorted(ways_members.items())
+            ),
+            start_way,
+            end_way,
+            bus_stop_collections,
+            tags,
+            engine,
+        )
+    )
+
+    return blake2b(data, digest_size=16).digest()
+
+
+class RouteCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache: TTLCache[bytes, FinalRoute] = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: bytes) -> FinalRoute | None:
+        route = self._cache.get(key)
+
+        if route is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return route
+
+    def set(self, key: bytes, route: FinalRoute) -> None:
+        self._cache[key] = route
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,150 @@
+import asyncio
+import multiprocessing
+import os
+from collections.abc import AsyncGenerator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from utils import print_run_time
+
+# imported once by the forkserver, the workers are forked with them already loaded
+PRELOAD_MODULES = ['cython_lib.route']
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def _worker_rss(pid: int) -> int:
+    # resident set size in bytes, 0 when unknown (not linux, or the worker has already exited)
+    try:
+        return int(Path(f'/proc/{pid}/statm').read_text().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class RoutePool:
+    """
+    Process pool of the route calculations, started with the application.
+
+    The workers are forked from a forkserver with the route module preloaded, so that they start
+    without importing the rest of the application. They are recycled after max_tasks tasks,
+    and the whole pool is replaced once a worker grows above max_rss bytes.
+
+    Calculations lease the executor for their whole duration, a replaced executor is only shut down
+    once its last lease is released (a calculation submits new tasks until it finishes).
+    """
+
+    def __init__(self, max_workers: int, max_tasks: int, max_rss: int):
+        self._max_workers = max_workers
+        self._max_tasks = max_tasks
+        self._max_rss = max_rss
+        self._context = multiprocessing.get_context('forkserver')
+        self._context.set_forkserver_preload(PRELOAD_MODULES)
+        self._executor: ProcessPoolExecutor | None = None
+        self._leases: dict[ProcessPoolExecutor, int] = {}
+        self._retired: set[ProcessPoolExecutor] = set()
+        self._replacing = False
+        self.replaced = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        assert self._executor is not None, 'Route pool is not started'
+        return self._executor
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            self._max_workers,
+            mp_context=self._context,
+            max_tasks_per_child=self._max_tasks,
+        )
+
+    async def _warm_up(self, executor: ProcessPoolExecutor) -> None:
+        # the pool starts a worker for every task submitted while the others are busy
+        loop = asyncio.get_running_loop()
+
+        with print_run_time(f'Starting {self._max_workers} route workers'):
+            await asyncio.gather(*(loop.run_in_executor(executor, os.getpid) for _ in range(self._max_workers)))
+
+    async def start(self) -> None:
+        executor = self._create_executor()
+        await self._warm_up(executor)
+        self._executor = executor
+
+    def shutdown(self) -> None:
+        for executor in self._retired:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self._retired.clear()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncGenerator[ProcessPoolExecutor]:
+        """
+        Use the current executor until the context exits, even if the pool is replaced meanwhile.
+        """
+
+        executor = self.executor
+        self._leases[executor] = self._leases.get(executor, 0) + 1
+
+        try:
+            yield executor
+        finally:
+            self._leases[executor] -= 1
+
+            if not self._leases[executor]:
+                del self._leases[executor]
+
+                if executor in self._retired:
+                    self._retired.remove(executor)
+                    executor.shutdown(wait=False)
+
+    def _retire(self, executor: ProcessPoolExecutor) -> None:
+        if executor in self._leases:
+            self._retired.add(executor)
+        else:
+            executor.shutdown(wait=False)
+
+    def _worker_pids(self) -> list[int]:
+        # there is no public api for the worker processes
+        return list(self.executor._processes or ())  # noqa: SLF001
+
+    async def check(self) -> None:
+        """
+        Replace the pool when one of its workers has grown above max_rss.
+
+        The calculations in progress finish in the old workers.
+        """
+
+        if self._replacing or self._executor is None:
+            return
+
+        rss = max(map(_worker_rss, self._worker_pids()), default=0)
+
+        if rss <= self._max_rss:
+            return
+
+        print(f'[POOL] Replacing the route workers, a worker uses {rss // 1048576} MiB')
+        self._replacing = True
+
+        try:
+            executor = self._create_executor()
+            await self._warm_up(executor)
+            self._executor, old_executor = executor, self._executor
+            self._retire(old_executor)
+            self.replaced += 1
+        finally:
+            self._replacing = False
+
+    def stats(self) -> dict[str, int]:
+        pids = self._worker_pids() if self._executor is not None else []
+
+        return {
+            'workers': len(pids),
+            'leases': sum(self._leases.values()),
+            'retired': len(self._retired),
+            'replaced': self.replaced,
+            'max_worker_rss': max(map(_worker_rss, pids), default=0),
+        }
@@ -0,0 +1,147 @@
+import asyncio
+from collections import deque
+from collections.abc import AsyncGenerator, Awaitable, Callable, Hashable
+from contextlib import asynccontextmanager
+
+
+class RouteQueueTimeoutError(TimeoutError):
+    pass
+
+
+class _Waiter:
+    __slots__ = ('admitted', 'changed', 'position', 'user_id')
+
+    def __init__(self, user_id: Hashable):
+        self.user_id = user_id
+        self.changed = asyncio.Event()
+        self.position = 0
+        self.admitted = False
+
+
+class RouteScheduler:
+    """
+    Admission control for the route calculations.
+
+    At most max_running calculations run at once, the others wait in per-user queues
+    which are served round-robin, so that a single busy user cannot starve the others.
+    """
+
+    def __init__(self, max_running: int, queue_timeout: float):
+        self._max_running = max_running
+        self._queue_timeout = queue_timeout
+        self._running = 0
+        self._queues: dict[Hashable, deque[_Waiter]] = {}  # in round-robin order
+        self.admitted = 0
+        self.timed_out = 0
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        user_id: Hashable,
+        on_position: Callable[[int], Awaitable[None]] | None = None,
+    ) -> AsyncGenerator[None, None]:
+        """
+        Wait for a free calculation slot, reporting the queue position (1 is next) whenever it changes.
+
+        Raises RouteQueueTimeoutError when the slot is not free within the queue timeout.
+        The time spent in the queue is not part of the calculation.
+        """
+
+        waiter = _Waiter(user_id)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._admit()
+
+        try:
+            async with asyncio.timeout(self._queue_timeout):
+                reported_position = 0
+
+                while True:
+                    # cleared before reading the state, so that no change is missed
+                    waiter.changed.clear()
+
+                    if waiter.admitted:
+                        break
+
+                    if on_position is not None and waiter.position != reported_position:
+                        reported_position = waiter.position
+                        await on_position(reported_position)
+                        continue
+
+                    await waiter.changed.wait()
+
+        except BaseException as e:
+            if waiter.admitted:
+                self._release()
+            else:
+                self._remove(waiter)
+
+            if isinstance(e, TimeoutError):
+                self.timed_out += 1
+                raise RouteQueueTimeoutError('Route calculation queue timed out') from e
+
+            raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _admit(self) -> None:
+        while self._running < self._max_running and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+
+            # move the user to the end of the round
+            del self._queues[user_id]
+
+            if queue:
+                self._queues[user_id] = queue
+
+            waiter.admitted = True
+            waiter.changed.set()
+            self._running += 1
+            self.admitted += 1
+
+        self._update_positions()
+
+    def _release(self) -> None:
+        self._running -= 1
+        self._admit()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues[waiter.user_id]
+        queue.remove(waiter)
+
+        if not queue:
+            del self._queues[waiter.user_id]
+
+        self._update_positions()
+
+    def _update_positions(self) -> None:
+        # positions follow the round-robin order: the first waiter of every user, then the second, ...
+        position = 0
+        queues = [iter(queue) for queue in self._queues.values()]
+
+        while queues:
+            remaining = []
+
+            for queue in queues:
+                if (waiter := next(queue, None)) is None:
+                    continue
+
+                position += 1
+                remaining.append(queue)
+
+                if waiter.position != position:
+                    waiter.position = position
+                    waiter.changed.set()
+
+            queues = remaining
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'running': self._running,
+            'queued': sum(len(queue) for queue in self._queues.values()),
+            'admitted': self.admitted,
+            'timed_out': self.timed_out,
+        }
@@ -204,6 +204,18 @@ export const processRouteWarnings = (data) => {
     if (highestSeverityLevel === 0) editSubmitBtn.classList.remove("d-none")
 }
 
+export const processRouteQueuePosition = (position) => {
+    editSubmitBtn.classList.add("d-none")
+
+    editWarnings.innerHTML = ""
+    editWarnings.appendChild(
+        createElementFromHTML(`
+    <div class="warning warning-LOW">
+        <div class="warning-message">Waiting for the route calculation (${position}. in queue)</div>
+    </div>`),
+    )
+}
+
 const unload = () => {
     switchView("load")
 
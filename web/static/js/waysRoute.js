@@ -1,6 +1,6 @@
 import { clearAntPath, processRouteAntPath } from "./antPathLayer.js"
 import { busStopData } from "./busStopsLayer.js"
-import { processRouteStops, processRouteWarnings, relationId, relationTags } from "./menu.js"
+import { processRouteQueuePosition, processRouteStops, processRouteWarnings, relationId, relationTags } from "./menu.js"
 import { deflateCompress, deflateDecompress } from "./utils.js"
 import { startWay, stopWay } from "./waysEndpoint.js"
 import { waysData } from "./waysLayer.js"
@@ -78,11 +78,20 @@ const onopen = async () => {
 const onmessage = async (e) => {
     const data = await deflateDecompress(e.data)
 
+    // the route is calculated once the server has a free slot
+    if (data.queuePosition !== undefined) {
+        processRouteQueuePosition(data.queuePosition)
+        return
+    }
+
     processRouteData(data)
     processRouteAntPath(data)
     processRouteWarnings(data)
     processRouteStops(data)
 
+    // provisional routes are followed by a better one
+    if (data.provisional) return
+
     awaitingResponse = false
     await onopen()
 }
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+
+from models.download_history import Cell
+from models.fetch_relation import FetchRelationBusStop
+from osm_extract import OsmExtract, import_extract
+from overpass import split_by_count
+
+osmium = pytest.importorskip('osmium')
+
+_META = {'version': 1, 'changeset': 1, 'uid': 1, 'user': 'test', 'timestamp': datetime(2024, 1, 1, tzinfo=UTC)}
+_PLATFORM = {'highway': 'platform', 'public_transport': 'platform'}
+
+
+def _write_clipped_extract(path: Path) -> None:
+    """
+    Write an extract clipped at the cell edge, the stop area has platforms whose nodes were left out.
+    """
+
+    from osmium.osm.mutable import Node, Relation, Way
+
+    writer = osmium.SimpleWriter(str(path))
+
+    try:
+        # inside of the cell
+        writer.add_node(
+            Node(
+                id=1,
+                location=(20.005, 50.005),
+                tags={'highway': 'bus_stop', 'public_transport': 'platform', 'name': 'Inside'},
+                **_META,
+            )
+        )
+
+        # outside of the extract: nodes 10 and 11 are missing
+        writer.add_way(Way(id=100, nodes=[10, 11], tags={**_PLATFORM, 'name': 'Clipped'}, **_META))
+        writer.add_relation(
+            Relation(id=200, members=[('w', 100, 'outer')], tags={**_PLATFORM, 'name': 'Clipped'}, **_META)
+        )
+
+        writer.add_relation(
+            Relation(
+                id=300,
+                members=[('n', 1, 'platform'), ('w', 100, 'platform'), ('r', 200, 'platform')],
+                tags={'public_transport': 'stop_area', 'name': 'Inside'},
+                **_META,
+            )
+        )
+    finally:
+        writer.close()
+
+
+def test_query_bus_skips_platforms_outside_of_the_extract(tmp_path: Path):
+    pbf_path = tmp_path / 'clipped.osm.pbf'
+    db_path = tmp_path / 'clipped.db'
+    _write_clipped_extract(pbf_path)
+    import_extract(str(pbf_path), str(db_path))
+
+    elements = asyncio.run(OsmExtract(str(db_path)).query_bus((Cell(2000, 5000),)))
+    split = split_by_count(elements)
+
+    # platforms in the cell, and platforms of the stop areas in the cell
+    assert [(e.type, e.id) for e in split[2]] == [('node', 1)]
+    assert [(e.type, e.id) for e in split[4]] == [('node', 1)]
+
+    for e in split[2] + split[4]:
+        FetchRelationBusStop.from_data(e)
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pytest
+from dacite import Config, from_dict
+from msgspec.json import Encoder
+
+from benchmarks.route import FIXTURES_DIR, LENGTH_TOLERANCE, _run
+from benchmarks.synthetic import grid, loops
+from compression import deflate_compress, deflate_decompress
+from config import CALC_ROUTE_TIMEOUT
+from cython_lib.route import (
+    PreviousRoute,
+    RouteStats,
+    _make_route_context,
+    build_graph,
+    calc_bus_route,
+    compile_graph,
+    segmented_worker,
+)
+from models.element_id import ElementId
+from models.fetch_relation import FetchRelationBusStopCollection, FetchRelationElement, PublicTransport
+from relation_builder import sort_bus_on_path
+
+FIXTURES = sorted(FIXTURES_DIR.glob('*.json.deflate'))
+
+
+def _fixture_id(path: Path) -> str:
+    return path.name.removesuffix('.json.deflate')
+
+
+@pytest.mark.parametrize('path', FIXTURES, ids=_fixture_id)
+def test_segmented_route_is_not_worse_than_dfs(path: Path):
+    body = path.read_bytes()
+    dfs = asyncio.run(_run(body, 1, 'dfs'))
+    segmented = asyncio.run(_run(body, 1, 'segmented'))
+
+    assert segmented['bus_stops'] >= dfs['bus_stops']
+    assert segmented['ways'] >= dfs['ways']
+    assert segmented['length'] <= dfs['length'] * (1 + LENGTH_TOLERANCE)
+
+
+@pytest.mark.parametrize('seed', [4, 5])
+def test_segmented_route_finishes_on_many_bus_stops(seed: int):
+    data = Encoder().encode(loops(42, seed=seed))
+    payload = json.loads(data)
+    segmented = asyncio.run(_run(deflate_compress(data), 1, 'segmented'))
+
+    # the exhaustive search takes minutes here
+    assert segmented['time'] < CALC_ROUTE_TIMEOUT
+    assert segmented['ways'] == sum(way['member'] for way in payload['ways'].values())
+    assert segmented['bus_stops'] == len(payload['busStops'])
+
+
+@pytest.mark.parametrize('path', FIXTURES, ids=_fixture_id)
+def test_segmented_worker_serves_every_bus_stop(path: Path):
+    data = json.loads(deflate_decompress(path.read_bytes()))
+    config = Config(cast=[ElementId, tuple, PublicTransport], strict=True)
+    ways = {way_id: from_dict(FetchRelationElement, way, config) for way_id, way in data['ways'].items()}
+    ways_members = {way_id: way for way_id, way in ways.items() if way.member}
+    bus_stops = [from_dict(FetchRelationBusStopCollection, c, config) for c in data['busStops']]
+
+    id_sorted_bus_map = {}
+
+    for sorted_bus in sort_bus_on_path(bus_stops, ways_members.values()):
+        id_sorted_bus_map.setdefault(sorted_bus.neighbor_id, []).append(sorted_bus)
+
+    graph = compile_graph(build_graph(ways_members), ways_members, id_sorted_bus_map)
+    context = _make_route_context(graph, graph.way_index[ElementId(data['stopWay'])])
+    best_path = segmented_worker(context, graph.way_index[ElementId(data['startWay'])]).valid
+
+    # the fixtures have no unreachable bus stops, some can only be served from the wrong side
+    assert best_path.path is not None
+    assert best_path.bus_stops_count + best_path.almost_bus_stops_count == len(graph.bus_stop_ids)
+
+
+async def _reroute_after_adding(payload: dict, added_way: ElementId) -> RouteStats:
+    ways = payload['ways']
+    previous_ways = {way_id: way for way_id, way in ways.items() if way_id != added_way}
+    args = (payload['startWay'], payload['stopWay'], payload['busStops'], payload['tags'])
+    stats = RouteStats()
+
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as executor:
+        route = await calc_bus_route(previous_ways, *args, executor, 1)
+        previous = PreviousRoute(previous_ways, *args, 'dfs', route)
+        await calc_bus_route(ways, *args, executor, 1, time_limit=1, previous=previous, stats=stats)
+
+    return stats
+
+
+def test_worse_repaired_route_is_rejected():
+    payload = grid(3, 4, seed=0)
+    added_way = next(way_id for way_id in payload['ways'] if way_id not in (payload['startWay'], payload['stopWay']))
+
+    # the repaired route is 4438 m long, the previous one 3703 m plus the added 213 m way
+    stats = asyncio.run(_reroute_after_adding(payload, added_way))
+
+    assert not stats.rerouted
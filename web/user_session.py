@@ -30,8 +30,8 @@ async def fetch_user_details(request: Request = None, websocket: WebSocket = Non
     except KeyError:
         pass
 
-    async with get_http_client('https://api.openstreetmap.org/api', auth=OAuth2Auth(token)) as http:
-        response = await http.get('/0.6/user/details.json')
+    http = get_http_client('https://api.openstreetmap.org/api')
+    response = await http.get('/0.6/user/details.json', auth=OAuth2Auth(token))
 
     if not response.is_success:
         return None
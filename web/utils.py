@@ -1,11 +1,14 @@
+import asyncio
 import re
 import time
-from collections.abc import Generator
+from collections.abc import Awaitable, Callable, Generator, Hashable
 from contextlib import contextmanager
+from functools import wraps
 
 import httpx
+from cachetools.keys import hashkey
 
-from config import USER_AGENT
+from config import HTTP_KEEPALIVE_EXPIRY, HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, USER_AGENT
 
 
 @contextmanager
@@ -24,22 +27,135 @@ def print_run_time(message: str | list) -> Generator[None, None, None]:
         print(f'[⏱️] {message} took {elapsed_time:.3f}s')
 
 
-def get_http_client(base_url: str = '', *, auth: tuple | None = None, headers: dict | None = None) -> httpx.AsyncClient:
-    if not headers:
-        headers = {}
+class _MetricsTransport(httpx.AsyncHTTPTransport):
+    """
+    Transport counting the requests, and the new connections they had to open.
+    """
 
-    headers['User-Agent'] = USER_AGENT
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = 0
+        self.connections = 0
 
-    return httpx.AsyncClient(
-        base_url=base_url,
-        follow_redirects=True,
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        connected = False
+
+        async def trace(event_name: str, _) -> None:
+            nonlocal connected
+
+            if event_name == 'connection.connect_tcp.complete':
+                connected = True
+
+        request.extensions['trace'] = trace
+        response = await super().handle_async_request(request)
+
+        self.requests += 1
+
+        if connected:
+            self.connections += 1
+
+        return response
+
+
+# application-lifetime clients and their transports, by base url
+_http_clients: dict[str, httpx.AsyncClient] = {}
+_http_transports: dict[str, _MetricsTransport] = {}
+
+
+def get_http_client(base_url: str = '') -> httpx.AsyncClient:
+    """
+    Get the shared http client of the upstream, its connections are kept alive and reused between requests.
+
+    The client must not be closed (use close_http_clients on shutdown), authentication is passed per request.
+    """
+
+    if (client := _http_clients.get(base_url)) is not None:
+        return client
+
+    transport = _MetricsTransport(
         http1=True,
         http2=True,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+    client = httpx.AsyncClient(
+        base_url=base_url,
+        follow_redirects=True,
         timeout=30,
-        auth=auth,
-        headers=headers,
+        headers={'User-Agent': USER_AGENT},
+        transport=transport,
     )
 
+    _http_clients[base_url] = client
+    _http_transports[base_url] = transport
+    return client
+
+
+async def close_http_clients() -> None:
+    for client in _http_clients.values():
+        await client.aclose()
+
+    _http_clients.clear()
+    _http_transports.clear()
+
+
+def http_client_stats() -> dict[str, dict[str, int]]:
+    return {
+        base_url: {
+            'requests': transport.requests,
+            'connections': transport.connections,
+            'reused': transport.requests - transport.connections,
+        }
+        for base_url, transport in _http_transports.items()
+    }
+
+
+# coalescing counters, by function
+_single_flight_stats: dict[str, dict[str, int]] = {}
+
+
+def single_flight[**P, T](func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+    """
+    Coalesce concurrent calls with the same arguments into one call, awaited by all of them.
+
+    Apply it below @cached, which only helps once the first call completes. Failures are
+    propagated to all waiters and not remembered, and a cancelled waiter does not cancel the others.
+    """
+
+    in_flight: dict[Hashable, asyncio.Task[T]] = {}
+    stats = _single_flight_stats[func.__qualname__] = {'calls': 0, 'coalesced': 0}
+
+    def on_done(key: Hashable, task: asyncio.Task[T]) -> None:
+        del in_flight[key]
+
+        # retrieve the exception, in case all the waiters have been cancelled
+        if not task.cancelled():
+            task.exception()
+
+    @wraps(func)
+    async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        key = hashkey(*args, **kwargs)
+        task = in_flight.get(key)
+        stats['calls'] += 1
+
+        if task is None:
+            task = in_flight[key] = asyncio.create_task(func(*args, **kwargs))
+            task.add_done_callback(lambda t: on_done(key, t))
+        else:
+            stats['coalesced'] += 1
+
+        return await asyncio.shield(task)
+
+    return wrapper
+
+
+def single_flight_stats() -> dict[str, dict[str, int]]:
+    return {name: stats.copy() for name, stats in _single_flight_stats.items()}
+
 
 def ensure_list(obj: dict | list[dict]) -> list[dict]:
     if isinstance(obj, list):